@@ -0,0 +1,326 @@
+#! /usr/bin/env python3
+
+"""Benchmark the mplx_qc hot path on a synthetic batch.
+
+Generates N merges of M read groups each, alternating between the legacy
+(MergeDefn.json, seqEvents) and HGV19 (event.json, sequencing_events) JSON
+layouts, with a SAM header and a header-only CRAM for every merge. Then times
+process_json, Merge with each JSON parser backend, process_cram,
+compare_read_groups and a whole run_qc, and
+reports records/sec and peak memory. Timings are taken without tracemalloc;
+peak memory comes from a second, traced pass.
+
+Example:
+    python benchmarks/bench_mplx_qc.py --merges 2000 --read-groups 24 \\
+        --jobs 8 > bench_output.txt
+"""
+
+# First come standard libraries, in alphabetical order.
+import argparse
+import contextlib
+from functools import partial
+import io
+import json
+from pathlib import Path
+import shutil
+import struct
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+# After another blank line, import local libraries.
+from ngsi_pm import dump_js_barcodes, mplx_qc
+
+COLUMNS = ('sample_id_nwd_id merge_id hgsc_xfer_subdir batch '
+           'current_cram_name new_cram_name json_path cram_path').split()
+REFERENCE = '/stornext/snfs5/next-gen/Illumina/bwa_references/g/GRCh38'
+FLOWCELLS = 'HC5NCCCXY HC5W5CCXY HC55WCCXY H7TGTCCXY HC7GVCCXY'.split()
+
+
+def main():
+    args = parse_args()
+    run(args)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-n', '--merges', type=int, default=500,
+                        help='number of merges in the batch')
+    parser.add_argument('-m', '--read-groups', type=int, default=24,
+                        help='read groups (sequencing events) per merge')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='jobs for the parallel run_qc benchmark')
+    parser.add_argument('--workdir',
+                        help='generate the batch here and keep it '
+                             '(default: a temporary directory)')
+    args = parser.parse_args()
+    return args
+
+
+def run(args):
+    if args.workdir:
+        workdir = Path(args.workdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+    else:
+        workdir = Path(tempfile.mkdtemp(prefix='bench_mplx_qc_'))
+    try:
+        start = time.perf_counter()
+        batch = generate_batch(workdir, args.merges, args.read_groups)
+        print('generated {} merges x {} read groups in {:.1f} s: {}'.format(
+            args.merges, args.read_groups, time.perf_counter() - start,
+            workdir
+        ))
+        print(format_row('benchmark', 'records', 'seconds', 'records/s',
+                         'peak MiB'))
+        for name, func, items in generate_benchmarks(batch, workdir, args):
+            print(format_row(name, *measure(func, items)), flush=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(str(workdir))
+
+
+def generate_benchmarks(batch, workdir, args):
+    """Generator of (name, func, items) for each benchmark."""
+    legacy = [r for r in batch if r.legacy]
+    hgv19 = [r for r in batch if not r.legacy]
+    yield ('process_json legacy', mplx_qc.process_json,
+           [r.json_path for r in legacy])
+    yield ('process_json hgv19', mplx_qc.process_json,
+           [r.json_path for r in hgv19])
+    for json_parser in dump_js_barcodes.JSON_PARSERS[1:]:
+        if json_parser == 'orjson' and dump_js_barcodes.orjson is None:
+            continue
+        yield ('Merge ' + json_parser,
+               partial(dump_js_barcodes.Merge, json_parser=json_parser),
+               [r.json_path for r in batch])
+    yield ('process_cram native', native_process_cram,
+           [r.cram_path for r in batch])
+    if shutil.which('samtools'):
+        yield ('process_cram samtools', mplx_qc.process_cram,
+               [r.sam_path for r in batch])
+    yield ('compare_read_groups', native_compare,
+           batch)
+    tsv_path = str(workdir / 'batch_cram.tsv')
+    yield ('run_qc native', run_qc_native, [tsv_path])
+    yield ('run_qc native -j {}'.format(args.jobs),
+           lambda p: run_qc_native(p, jobs=args.jobs), [tsv_path])
+    cache_path = str(workdir / 'cache.sqlite')
+    run_qc_native(tsv_path, cache_path=cache_path)  # fill the cache
+    yield ('run_qc native warm cache',
+           lambda p: run_qc_native(p, cache_path=cache_path), [tsv_path])
+    if shutil.which('samtools'):
+        yield ('run_qc samtools -j {}'.format(args.jobs),
+               lambda p: run_qc_quietly(p, jobs=args.jobs),
+               [str(workdir / 'batch_sam.tsv')])
+
+
+def native_process_cram(cram_path):
+    return mplx_qc.process_cram(cram_path, 'native')
+
+
+def native_compare(record):
+    return mplx_qc.compare_read_groups(record.sample, record.cram_path,
+                                       record.json_path, 'native')
+
+
+def run_qc_native(tsv_path, **kwargs):
+    return run_qc_quietly(tsv_path, cram_reader='native', **kwargs)
+
+
+def run_qc_quietly(tsv_path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        error_code = mplx_qc.run_qc(tsv_path, **kwargs)
+    assert error_code == 0, error_code
+    return error_code
+
+
+def measure(func, items):
+    """Return (num_records, seconds, records_per_second, peak_mib). For a
+    whole-run benchmark, the records are the rows of the input."""
+    num_records = sum(count_records(item) for item in items)
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    for item in items:
+        func(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rate = num_records / seconds if seconds else float('inf')
+    return num_records, seconds, rate, peak / 2**20
+
+
+def count_records(item):
+    if isinstance(item, str) and item.endswith('.tsv'):
+        with open(item) as fin:
+            return sum(1 for _ in fin) - 1
+    return 1
+
+
+def format_row(name, num_records, seconds, rate, peak):
+    if isinstance(seconds, float):
+        seconds = '{:.3f}'.format(seconds)
+        rate = '{:.1f}'.format(rate)
+        peak = '{:.2f}'.format(peak)
+    return '{:<32} {:>8} {:>9} {:>10} {:>9}'.format(
+        name, num_records, seconds, rate, peak
+    )
+
+
+# Synthetic batch
+
+def generate_batch(workdir, num_merges, num_read_groups):
+    """Write a synthetic batch under workdir and return its records. Also
+    writes batch_cram.tsv and batch_sam.tsv, mplx_qc inputs that point at
+    the CRAM and SAM headers respectively."""
+    batch = []
+    for i in range(num_merges):
+        record = Record()
+        record.sample = 'NWD{:06}'.format(i)
+        record.merge_id = 'SYN.{}-1_2AMP-FLOWCELL-{}'.format(
+            record.sample, '-'.join(FLOWCELLS[:3])
+        )
+        record.legacy = i % 2 == 0
+        merge_dir = workdir / 'merges' / record.merge_id
+        (merge_dir / 'alignments').mkdir(parents=True, exist_ok=True)
+        barcodes = [
+            '{}-{}-IDX{:05}'.format(FLOWCELLS[j % len(FLOWCELLS)],
+                                    j % 8 + 1, i)
+            for j in range(num_read_groups)
+        ]
+        if record.legacy:
+            record.json_path = str(merge_dir / 'MergeDefn.json')
+            merge = legacy_merge_definition(record, barcodes, merge_dir)
+            cram_dir = merge_dir
+        else:
+            record.json_path = str(merge_dir / 'event.json')
+            merge = hgv19_merge_definition(record, barcodes, merge_dir)
+            cram_dir = merge_dir / 'alignments'
+        with open(record.json_path, 'w') as fout:
+            json.dump(merge, fout, indent=4)
+        header = sam_header(record, barcodes)
+        record.sam_path = str(cram_dir / (record.merge_id + '.hgv.sam'))
+        Path(record.sam_path).write_text(header)
+        record.cram_path = str(cram_dir / (record.merge_id + '.hgv.cram'))
+        Path(record.cram_path).write_bytes(cram_header_file(header))
+        batch.append(record)
+    write_tsv(workdir / 'batch_cram.tsv', batch, 'cram_path')
+    write_tsv(workdir / 'batch_sam.tsv', batch, 'sam_path')
+    return batch
+
+
+def legacy_merge_definition(record, barcodes, merge_dir):
+    return {
+        'eventId': record.merge_id,
+        'metaProject': 'SYN',
+        'libName': record.merge_id.split('-FLOWCELL')[0],
+        'seNum': len(barcodes),
+        'path': str(merge_dir),
+        'bamFile': str(merge_dir / (record.merge_id + '.hgv.bam')),
+        'reference': REFERENCE,
+        'seqEvents': dict(
+            (bc, sequencing_event(bc, record, 'eventId', 'sampleName'))
+            for bc in barcodes
+        ),
+    }
+
+
+def hgv19_merge_definition(record, barcodes, merge_dir):
+    return {
+        'event_id': record.merge_id,
+        'library_name': record.merge_id.split('-FLOWCELL')[0],
+        'path': str(merge_dir),
+        'sequencing_events': dict(
+            (bc, sequencing_event(bc, record, 'event_id', 'sample_name'))
+            for bc in barcodes
+        ),
+    }
+
+
+def sequencing_event(barcode, record, id_key, sample_key):
+    """One sequencing event, with the long strings real ones carry."""
+    lane_dir = ('/stornext/snfs0/next-gen/Illumina/Instruments/E00385/'
+                + barcode)
+    return {
+        id_key: barcode,
+        sample_key: record.sample,
+        'reference': REFERENCE,
+        'fastq1': lane_dir + '/' + barcode + '_R1_001.fastq.gz',
+        'fastq2': lane_dir + '/' + barcode + '_R2_001.fastq.gz',
+        'bamPath': lane_dir + '/' + barcode + '.hgv.bam',
+        'metrics': dict(('m{}'.format(k), k * 1.5) for k in range(20)),
+    }
+
+
+def sam_header(record, barcodes):
+    lines = ['@HD\tVN:1.5\tGO:none\tSO:coordinate',
+             '@SQ\tSN:chr1\tLN:248956422']
+    for j, bc in enumerate(barcodes):
+        lines.append(
+            '@RG\tID:0.{}\tCN:BCM\tDT:2017-10-09T16:10:39-0500\tLB:{}\t'
+            'PL:Illumina\tPU:{}\tSM:{}'.format(
+                j, record.merge_id.split('-FLOWCELL')[0], bc, record.sample
+            )
+        )
+    lines.append('@PG\tID:bwa\tPN:bwa\tVN:0.7.15')
+    return '\n'.join(lines) + '\n'
+
+
+def write_tsv(tsv_path, batch, path_attribute):
+    with open(str(tsv_path), 'w') as fout:
+        print(*COLUMNS, sep='\t', file=fout)
+        for r in batch:
+            print(r.sample, r.merge_id, 'SYN', 'SYN_batch',
+                  r.merge_id + '.hgv.cram', r.sample + '.hgv.cram',
+                  r.json_path, getattr(r, path_attribute),
+                  sep='\t', file=fout)
+
+
+def cram_header_file(header_text):
+    """Return a CRAM 3.0 file holding only a header container with one gzip
+    compressed header block, followed by the EOF container."""
+    text = header_text.encode()
+    raw = struct.pack('<i', len(text)) + text
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    data = compressor.compress(raw) + compressor.flush()
+    block = (bytes([1, 0]) + itf8(0) + itf8(len(data)) + itf8(len(raw))
+             + data)
+    block += struct.pack('<I', zlib.crc32(block))
+    container = (struct.pack('<i', len(block)) + itf8(0) + itf8(0) + itf8(0)
+                 + itf8(0) + itf8(0) + itf8(0) + itf8(1) + itf8(0))
+    container += struct.pack('<I', zlib.crc32(container))
+    file_definition = b'CRAM\x03\x00' + b'synthetic'.ljust(20, b'\0')
+    return file_definition + container + block + CRAM_EOF
+
+
+# The EOF container that ends every CRAM 3.0 file.
+CRAM_EOF = bytes.fromhex(
+    '0f000000ffffffff0fe0454f4600000000010005bdd94f00010006060100010001'
+    '00ee63014b'
+)
+
+
+def itf8(value):
+    """Encode a non-negative integer below 2**28 as ITF-8."""
+    if value < 0x80:
+        return bytes([value])
+    if value < 0x4000:
+        return bytes([0x80 | value >> 8, value & 0xff])
+    if value < 0x200000:
+        return bytes([0xc0 | value >> 16, value >> 8 & 0xff, value & 0xff])
+    return bytes([0xe0 | value >> 24, value >> 16 & 0xff, value >> 8 & 0xff,
+                  value & 0xff])
+
+
+class Record:
+    """One synthetic merge."""
+    pass
+
+
+if __name__ == '__main__':
+    main()
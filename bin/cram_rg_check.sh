@@ -1,9 +1,4 @@
 #! /usr/bin/env bash
 
-workbook="$1"
-
-dump_xl_cram_paths "$workbook" 2>&1 |
-    tr \\n \\0 |
-    xargs -0 -n1 samtools view -H |
-    dump_rgs |
-    diff - <(dump_xl_barcodes "$workbook" 2>&1)
\ No newline at end of file
+# Kept for old callers; see cram_rg_check --help.
+exec cram_rg_check "$@"
@@ -0,0 +1,342 @@
+#! /usr/bin/env python3
+
+"""Index the sequencing events of merge definitions by barcode, flowcell,
+lane, library index and sample, so questions like "which merges contain
+flowcell HC5NCCCXY lane 7" are answered without parsing every JSON again.
+
+    barcode_index build INDEX --root /path/to/merges
+    barcode_index query INDEX --flowcell HC5NCCCXY --lane 7
+
+build parses only the JSON files that are new or changed since the last
+build. A barcode like HC5W5CCXY-3-IDDUI040 is split into flowcell
+HC5W5CCXY, lane 3 and library index IDDUI040. query prints the matching
+events like dump_js_barcodes --add-references --add-json-path: barcode,
+sample, merge ID, reference and JSON path."""
+
+# First come standard libraries, in alphabetical order.
+import argparse
+from functools import partial
+import logging
+import os
+import sqlite3
+import sys
+
+# After another blank line, import local libraries.
+from .dump_js_barcodes import (CHUNK_SIZE, JSON_PARSERS, Merge,
+                               find_merge_definitions, generate_chunks)
+from .parallel import ordered_map, positive_int, process_pool
+from .parse_cache import connect, file_stamp
+from .profiling import (JSON_PARSE, OUTPUT_WRITE, add_profile_argument,
+                        add_stages, profiled, stage, worker_stages)
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+
+# Bump when the schema changes; an index with another version is rebuilt.
+FORMAT_VERSION = 1
+COMMIT_INTERVAL = 500  # JSON files per transaction
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS merges (
+    merge_key INTEGER PRIMARY KEY,
+    json_path TEXT NOT NULL UNIQUE,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    merge_id TEXT NOT NULL,
+    reference TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    merge_key INTEGER NOT NULL REFERENCES merges ON DELETE CASCADE,
+    barcode TEXT NOT NULL,
+    flowcell TEXT,
+    lane INTEGER,
+    library_index TEXT,
+    sample_name TEXT
+);
+CREATE INDEX IF NOT EXISTS events_merge_key ON events (merge_key);
+CREATE INDEX IF NOT EXISTS events_barcode ON events (barcode);
+CREATE INDEX IF NOT EXISTS events_flowcell_lane ON events (flowcell, lane);
+CREATE INDEX IF NOT EXISTS events_library_index ON events (library_index);
+CREATE INDEX IF NOT EXISTS events_sample_name ON events (sample_name);
+'''
+
+# query option -> events column
+QUERY_COLUMNS = (
+    ('barcode', 'barcode'),
+    ('flowcell', 'flowcell'),
+    ('lane', 'lane'),
+    ('index', 'library_index'),
+    ('sample', 'sample_name'),
+)
+
+
+def main():
+    args = parse_args()
+    config_logging(args)
+    with profiled(args.profile, 'barcode_index'):
+        try:
+            error_code = args.func(args)
+        except sqlite3.Error as e:
+            logger.error('cannot use index %s: %s', args.index, e)
+            error_code = 1
+    logging.shutdown()
+    sys.exit(error_code)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    add_profile_argument(parser)
+    parser.add_argument('-v', '--verbose', action='count')
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s {}'.format(__version__))
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build_parser = subparsers.add_parser(
+        'build', help='add new and changed merge definitions to the index'
+    )
+    build_parser.set_defaults(func=run_build)
+    build_parser.add_argument('index', help='SQLite index file')
+    build_parser.add_argument('json_path_stream', nargs='?',
+                              type=argparse.FileType('r'),
+                              help='JSON paths, one per line '
+                                   '(default: stdin, unless --root)')
+    build_parser.add_argument('--root', action='append', metavar='DIR',
+                              help='find the merge definitions under DIR; '
+                                   'may be repeated')
+    build_parser.add_argument('--prune', action='store_true',
+                              help='remove the merges whose JSON paths were '
+                                   'not given or found in this build')
+    build_parser.add_argument('--jobs', type=positive_int, default=1,
+                              help='parse JSON in this many processes')
+    build_parser.add_argument('--json-parser', choices=JSON_PARSERS,
+                              default='auto',
+                              help='JSON parser backend '
+                                   '(default: %(default)s)')
+
+    query_parser = subparsers.add_parser(
+        'query', help='print the sequencing events matching every option'
+    )
+    query_parser.set_defaults(func=run_query)
+    query_parser.add_argument('index', help='SQLite index file')
+    query_parser.add_argument('--barcode')
+    query_parser.add_argument('--flowcell')
+    query_parser.add_argument('--lane', type=int)
+    query_parser.add_argument('--index', dest='library_index',
+                              metavar='INDEX', help='library index')
+    query_parser.add_argument('--sample')
+    query_parser.add_argument('--merge', help='merge ID')
+    args = parser.parse_args()
+    if args.command == 'build' and args.root and args.json_path_stream:
+        parser.error('give either json_path_stream or --root, not both')
+    return args
+
+
+def config_logging(args):
+    global logger
+    if not args.verbose:
+        level = logging.WARNING
+    elif args.verbose == 1:
+        level = logging.INFO
+    else:
+        level = logging.DEBUG
+    logger = logging.getLogger('barcode_index')
+    err_handler = logging.StreamHandler()
+    logger.addHandler(err_handler)
+    logger.setLevel(level)
+
+
+def run_build(args):
+    if args.root:
+        json_paths = find_merge_definitions(args.root)
+    else:
+        json_paths = (line.rstrip('\n')
+                      for line in args.json_path_stream or sys.stdin)
+    index = BarcodeIndex(args.index)
+    try:
+        return index.build(json_paths, args.prune, args.jobs,
+                           args.json_parser)
+    finally:
+        index.close()
+
+
+def run_query(args):
+    index = BarcodeIndex(args.index)
+    try:
+        rows = index.query(barcode=args.barcode, flowcell=args.flowcell,
+                           lane=args.lane, index=args.library_index,
+                           sample=args.sample, merge=args.merge)
+        with stage(OUTPUT_WRITE):
+            for row in rows:
+                print(*row, sep='\t')
+    finally:
+        index.close()
+    return 0
+
+
+class BarcodeIndex:
+    """Sequencing events of merge definitions, stored in an SQLite file."""
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._connection = connect(self.db_path)
+        self._connection.execute('PRAGMA foreign_keys=ON')
+        version = self._connection.execute('PRAGMA user_version').fetchone()
+        if version[0] != FORMAT_VERSION:
+            logger.info('creating barcode index %s', self.db_path)
+            self._connection.executescript(
+                'DROP TABLE IF EXISTS events;'
+                'DROP TABLE IF EXISTS merges;'
+                'PRAGMA user_version={};'.format(FORMAT_VERSION)
+            )
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def build(self, json_paths, prune=False, jobs=1, json_parser='auto'):
+        """Index the new and changed merge definitions among json_paths, and
+        with prune, drop the merges not among them. Return 1 if any JSON
+        could not be indexed, else 0."""
+        seen = set()
+        stale = self._generate_stale_paths(json_paths, seen)
+        read_chunk = worker_stages(partial(read_merges,
+                                           json_parser=json_parser))
+        results = ordered_map(read_chunk, generate_chunks(stale, CHUNK_SIZE),
+                              jobs, process_pool)
+        error_code = 0
+        num_indexed = 0
+        self._connection.execute('BEGIN')
+        try:
+            for chunk, stages in results:
+                add_stages(stages)
+                for json_path, stamp, merge_row, event_rows in chunk:
+                    self._delete(json_path)
+                    if merge_row is None:
+                        logger.error('cannot index %s: %s', json_path,
+                                     event_rows)
+                        error_code = 1
+                        continue
+                    self._insert(json_path, stamp, merge_row, event_rows)
+                    num_indexed += 1
+                    if num_indexed % COMMIT_INTERVAL == 0:
+                        self._connection.execute('COMMIT')
+                        self._connection.execute('BEGIN')
+            if prune:
+                self._prune(seen)
+            self._connection.execute('COMMIT')
+        finally:
+            results.close()
+            if self._connection.in_transaction:
+                self._connection.execute('ROLLBACK')
+        logger.info('indexed %s of %s merge definitions',
+                    num_indexed, len(seen))
+        return error_code
+
+    def _generate_stale_paths(self, json_paths, seen):
+        """Generator of the json_paths that are not indexed as they are now.
+        Adds every absolute path to seen."""
+        for json_path in json_paths:
+            json_path = os.path.abspath(json_path)
+            if json_path in seen:
+                continue
+            seen.add(json_path)
+            row = self._connection.execute(
+                'SELECT inode, size, mtime_ns FROM merges '
+                'WHERE json_path = ?', (json_path,)
+            ).fetchone()
+            try:
+                if row is not None and tuple(row) == file_stamp(json_path):
+                    continue
+            except OSError:
+                pass  # let read_merges report it
+            yield json_path
+
+    def _delete(self, json_path):
+        self._connection.execute('DELETE FROM merges WHERE json_path = ?',
+                                 (json_path,))
+
+    def _insert(self, json_path, stamp, merge_row, event_rows):
+        cursor = self._connection.execute(
+            'INSERT INTO merges (json_path, inode, size, mtime_ns, merge_id, '
+            'reference) VALUES (?, ?, ?, ?, ?, ?)',
+            (json_path,) + stamp + merge_row
+        )
+        merge_key = cursor.lastrowid
+        self._connection.executemany(
+            'INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)',
+            ((merge_key,) + row for row in event_rows)
+        )
+
+    def _prune(self, seen):
+        json_paths = [
+            json_path for json_path, in
+            self._connection.execute('SELECT json_path FROM merges')
+            if json_path not in seen
+        ]
+        for json_path in json_paths:
+            self._delete(json_path)
+        logger.info('pruned %s merge definitions', len(json_paths))
+
+    def query(self, barcode=None, flowcell=None, lane=None, index=None,
+              sample=None, merge=None):
+        """Return (barcode, sample, merge ID, reference, JSON path) of the
+        events matching every given argument, ordered by JSON path and
+        barcode."""
+        values = dict(barcode=barcode, flowcell=flowcell, lane=lane,
+                      index=index, sample=sample)
+        conditions = []
+        parameters = []
+        for name, column in QUERY_COLUMNS:
+            if values[name] is not None:
+                conditions.append('events.{} = ?'.format(column))
+                parameters.append(values[name])
+        if merge is not None:
+            conditions.append('merges.merge_id = ?')
+            parameters.append(merge)
+        sql = ('SELECT barcode, sample_name, merge_id, reference, json_path '
+               'FROM events JOIN merges USING (merge_key)')
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY json_path, barcode'
+        return self._connection.execute(sql, parameters).fetchall()
+
+
+def read_merges(json_paths, json_parser='auto'):
+    """Return [(json_path, stamp, merge_row, event_rows)] for json_paths.
+    If a JSON cannot be read, merge_row is None and event_rows is the error
+    message. Runs in the worker processes."""
+    results = []
+    for json_path in json_paths:
+        try:
+            stamp = file_stamp(json_path)
+            with stage(JSON_PARSE):
+                merge = Merge(json_path, json_parser)
+        except (OSError, ValueError, KeyError, TypeError,
+                AssertionError) as e:
+            results.append((json_path, None, None, repr(e)))
+            continue
+        merge_row = str(merge.id), merge.reference
+        event_rows = [
+            (se.barcode,) + split_barcode(se.barcode) + (se.sample_name,)
+            for se in merge.sequencing_events
+        ]
+        results.append((json_path, stamp, merge_row, event_rows))
+    return results
+
+
+def split_barcode(barcode):
+    """Return (flowcell, lane, library index) of a barcode such as
+    HC5W5CCXY-3-IDDUI040, or (None, None, None) if it is not like that."""
+    parts = str(barcode).split('-', 2)
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None, None, None
+    return parts[0], int(parts[1]), parts[2]
+
+
+if __name__ == '__main__':
+    main()
@@ -2,90 +2,226 @@
 
 """A JSON document will be a three-level dictionary. We care about
 barcode, sample, and reference.
+
+The JSON paths are read one per line from a file or stdin, or found by
+searching the merge directories under --root.
 """
 
 import argparse
 from collections import Counter
+from functools import partial
+from itertools import islice
 import json
 import os
 import sys
-from pathlib import Path
-from subprocess import run, DEVNULL, PIPE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from .mplx_worklist import MERGE_EVENT_PATTERNS
+from .parallel import ordered_map, positive_int, process_pool
+from .profiling import (FILE_DISCOVERY, JSON_PARSE, OUTPUT_WRITE,
+                        add_profile_argument, add_stages, profiled, stage,
+                        worker_stages)
+from .table_output import (COMPRESSIONS, OUTPUT_FORMATS, check_available,
+                           format_rows, guess_compression, open_writer)
+from .tree_walk import DEFAULT_JOBS, find_files
+
+# auto is orjson if it is installed, else json.
+JSON_PARSERS = 'auto', 'json', 'orjson'
+CHUNK_SIZE = 64  # JSON paths per worker task, to amortize the IPC
+# Columns with few distinct values, dictionary encoded in Parquet output.
+DICTIONARY_COLUMNS = 'sample_name', 'merge_id', 'reference', 'json_path'
 
 
 def main():
     args = parse_args()
-    run(args.json_path_stream, args.add_references, args.add_json_path)
+    with profiled(args.profile, 'dump_js_barcodes'):
+        if args.root:
+            json_paths = find_merge_definitions(args.root, args.walk_jobs)
+        else:
+            json_paths = args.json_path_stream or sys.stdin
+        run(json_paths, args.add_references, args.add_json_path,
+            args.json_parser, args.jobs, args.format, args.output,
+            args.compress)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('json_path_stream',
                         nargs='?',
-                        type=argparse.FileType('r'),
-                        default=sys.stdin)
+                        type=argparse.FileType('r'))
+    parser.add_argument('--root', action='append', metavar='DIR',
+                        help='find the merge definitions (named {}) under '
+                             'DIR instead of reading their paths; may be '
+                             'repeated'.format(
+                                 ', '.join(MERGE_EVENT_PATTERNS)))
+    parser.add_argument('--walk-jobs', type=positive_int, default=DEFAULT_JOBS,
+                        help='directories read in parallel by --root '
+                             '(default: %(default)s)')
     parser.add_argument('--add-references', '-r', action='store_true')
     parser.add_argument('--add-json-path', '-j', action='store_true')
+    parser.add_argument('--json-parser', choices=JSON_PARSERS,
+                        default='auto',
+                        help='JSON parser backend (default: %(default)s)')
+    parser.add_argument('--jobs', type=positive_int, default=1,
+                        help='parse JSON in this many processes; output '
+                             'keeps input order (default: %(default)s)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='tsv',
+                        help='output format (default: %(default)s); jsonl '
+                             'and parquet name the columns barcode, '
+                             'sample_name, merge_id, reference and json_path')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write to FILE instead of stdout')
+    parser.add_argument('--compress', choices=COMPRESSIONS,
+                        help='compress the output (default: by the suffix '
+                             'of FILE, .gz or .zst); for parquet, the codec')
+    add_profile_argument(parser)
     args = parser.parse_args()
+    if args.root and args.json_path_stream:
+        parser.error('give either json_path_stream or --root, not both')
+    if args.compress is None and args.format != 'parquet':
+        args.compress = guess_compression(args.output)
+    message = check_available(args.format, args.compress)
+    if message:
+        parser.error(message)
+    if args.json_parser == 'orjson' and orjson is None:
+        parser.error('--json-parser orjson: orjson is not installed')
     return args
 
 
-def run(json_path_stream, add_references, add_json_path):
+def run(json_path_stream, add_references, add_json_path, json_parser='auto',
+        jobs=1, output_format='tsv', output_path=None, compression=None):
     references = set()
-    for merge in parse_merge_definitions(json_path_stream):
-        references.add(merge.reference)
-        for s in merge.sequencing_events:
-            row = [s.barcode, s.sample_name, merge.id]
-            if add_references:
-                row.append(merge.reference)
-            if add_json_path:
-                row.append(merge.json_path)
-            print(*row, sep='\t')
+    columns = output_columns(add_references, add_json_path)
+    format_chunk = worker_stages(partial(format_merges,
+                                         add_references=add_references,
+                                         add_json_path=add_json_path,
+                                         json_parser=json_parser,
+                                         output_format=output_format))
+    chunks = generate_chunks(json_path_stream, CHUNK_SIZE)
+    writer = open_writer(output_path, output_format, columns, compression,
+                         DICTIONARY_COLUMNS)
+    results = ordered_map(format_chunk, chunks, jobs, process_pool)
+    try:
+        for (chunk_references, formatted_rows, error), stages in results:
+            add_stages(stages)
+            references.update(chunk_references)
+            with stage(OUTPUT_WRITE):
+                writer.write(formatted_rows)
+            if error is not None:
+                raise error
+    finally:
+        results.close()
+        with stage(OUTPUT_WRITE):
+            writer.close()
     if len(references) > 1 and not add_references:
         print('Multiple references:', *sorted(references), file=sys.stderr)
 
 
-def parse_merge_definitions(json_path_stream):
+def output_columns(add_references, add_json_path):
+    columns = ['barcode', 'sample_name', 'merge_id']
+    if add_references:
+        columns.append('reference')
+    if add_json_path:
+        columns.append('json_path')
+    return columns
+
+
+def format_merges(json_paths, add_references, add_json_path, json_parser,
+                  output_format='tsv'):
+    """Return (references, formatted_rows, error), the set of references of
+    the merges at json_paths and their output rows, formatted by
+    table_output.format_rows. If a merge cannot be parsed, error is the
+    exception and only the merges before it are included, so that the
+    caller can write those before raising it; else error is None. Runs in
+    the worker processes, so only strings cross back to the main
+    process."""
+    references = set()
+    rows = []
+    error = None
+    try:
+        for merge in parse_merge_definitions(json_paths, json_parser):
+            references.add(merge.reference)
+            tail = (str(merge.id),)
+            if add_references:
+                tail += (str(merge.reference),)
+            if add_json_path:
+                tail += (str(merge.json_path),)
+            for s in merge.sequencing_events:
+                rows.append((str(s.barcode), str(s.sample_name)) + tail)
+    except Exception as e:
+        error = e
+    columns = output_columns(add_references, add_json_path)
+    return references, format_rows(rows, columns, output_format), error
+
+
+def generate_chunks(iterable, size):
+    """Generator of lists of up to size consecutive items of iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def find_merge_definitions(roots, jobs=DEFAULT_JOBS):
+    """Generator of the paths of the merge definitions under roots. The
+    directories below a merge definition are not searched."""
+    for root in roots:
+        paths = find_files(root, MERGE_EVENT_PATTERNS, jobs)
+        while True:
+            with stage(FILE_DISCOVERY):
+                path = next(paths, None)
+            if path is None:
+                break
+            yield path
+
+
+def parse_merge_definitions(json_path_stream, json_parser='auto'):
     """Generator of Merge objects. The input is a stream of JSON file paths."""
     for line in json_path_stream:
         json_path = line.rstrip('\n')
-        merge = Merge(json_path)
+        with stage(JSON_PARSE):
+            merge = Merge(json_path, json_parser)
         yield merge
 
 
 class Merge:
     """Contains global data about a merge and a list of SequencingEvent."""
-    def __init__(self, json_path):
+    # Slots, as batch reports hold tens of thousands of merges.
+    __slots__ = ('json_path', 'id', 'lib_name', 'num_sequencing_events',
+                 'sequencing_events', 'sample_name', 'reference')
+
+    def __init__(self, json_path, json_parser='auto'):
         self.json_path = json_path
-        json_path = Path(json_path)
-        if json_path.name == 'event.json':
-            self._load_hgv_19(json_path)
+        if os.path.basename(json_path) == 'event.json':
+            self._load_hgv_19(json_path, json_parser)
         else:
-            self._load_hgv_legacy(json_path)
+            self._load_hgv_legacy(json_path, json_parser)
         self.get_sequencing_events_data(json_path)
 
-    def _load_hgv_19(self, json_path):
-        self.json_path = json_path
-        with open(str(json_path)) as fin:
-            merge_definition_dict = json.load(fin)
+    def _load_hgv_19(self, json_path, json_parser):
+        merge_definition_dict = load_json(json_path, json_parser)
         self.id = merge_definition_dict['event_id']
         self.lib_name = merge_definition_dict['library_name']
         ses = merge_definition_dict['sequencing_events']
         self.sequencing_events = [
-            SequencingEvent(key, json_path, json_data)
+            SequencingEvent.from_hgv_19(key, json_data)
             for key, json_data in ses.items()
         ]
 
-    def _load_hgv_legacy(self, json_path):
-        self.json_path = json_path
-        with open(str(json_path)) as fin:
-            merge_definition_dict = json.load(fin)
+    def _load_hgv_legacy(self, json_path, json_parser):
+        merge_definition_dict = load_json(json_path, json_parser)
         self.num_sequencing_events = merge_definition_dict['seNum']
         self.id = merge_definition_dict['eventId']
         self.lib_name = merge_definition_dict['libName']
         ses = merge_definition_dict['seqEvents']
         self.sequencing_events = [
-            SequencingEvent(key, json_path, json_data)
+            SequencingEvent.from_hgv_legacy(key, json_data)
             for key, json_data in ses.items()
         ]
         # no equivalent in _load_hgv_19
@@ -102,27 +238,49 @@ class Merge:
         self.reference = r.most_common(1)[0][0]
 
 
+def load_json(json_path, json_parser):
+    """Return the parsed JSON at json_path."""
+    if json_parser == 'auto':
+        json_parser = 'json' if orjson is None else 'orjson'
+    if json_parser == 'orjson':
+        with open(str(json_path), 'rb') as fin:
+            data = fin.read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN and Infinity, which json accepts.
+            return json.loads(data.decode())
+    with open(str(json_path)) as fin:
+        return json.load(fin)
+
+
 class SequencingEvent:
-    """Represents everything about a single sequencing event"""
-    def __init__(self, key, json_path, json_data):
-        self.json_path = json_path
-        json_path = Path(json_path)
-        if json_path.name == 'event.json':
-            self._load_hgv_19_se(key, json_data)
-        else:
-            self._load_hgv_legacy_se(key, json_data)
-
-    def _load_hgv_19_se(self, key, json_data):
-        self.barcode = json_data['event_id']
-        assert self.barcode == key, key
-        self.sample_name = json_data['sample_name']
-        self.reference = json_data['reference']
-
-    def _load_hgv_legacy_se(self, key, json_data):
-        self.barcode = json_data['eventId']
-        assert self.barcode == key, key
-        self.sample_name = json_data['sampleName']
-        self.reference = json_data['reference']
+    """Represents everything about a single sequencing event. The sample
+    name and reference are interned, as every event of a merge, and often
+    of a batch, shares them."""
+    __slots__ = 'barcode', 'sample_name', 'reference'
+
+    def __init__(self, barcode, sample_name, reference):
+        self.barcode = barcode
+        self.sample_name = intern_str(sample_name)
+        self.reference = intern_str(reference)
+
+    @classmethod
+    def from_hgv_19(cls, key, json_data):
+        barcode = json_data['event_id']
+        assert barcode == key, key
+        return cls(barcode, json_data['sample_name'], json_data['reference'])
+
+    @classmethod
+    def from_hgv_legacy(cls, key, json_data):
+        barcode = json_data['eventId']
+        assert barcode == key, key
+        return cls(barcode, json_data['sampleName'], json_data['reference'])
+
+
+def intern_str(value):
+    """Return sys.intern(value) for a str, else value unchanged."""
+    return sys.intern(value) if type(value) is str else value
 
 
 if __name__ == '__main__':
@@ -1,30 +1,126 @@
 #! /usr/bin/env python3
 
-""" Reads the input text and returns the SM and PU."""
+""" Reads the input text and returns the SM and PU. With paths as
+arguments, reads the header of each file directly instead of standard
+input: BAM and CRAM headers are decoded natively, and SAM text is read up
+to its first alignment record."""
 
+import argparse
 import re
 import sys
 
+from .hts_header import (CRAM_MAGIC, HeaderError, read_bam_rg_lines,
+                         read_cram_rg_lines, select_rg_lines)
+from .profiling import (HEADER_READ, OUTPUT_WRITE, add_profile_argument,
+                        profiled, stage)
+
+PU_PATTERN = re.compile(r'PU:(?:[\w-]+_)?([\w-]+)')
+CHUNK_SIZE = 1 << 20  # bytes of SAM text read at a time
+# The start of the first line that is not a header line.
+FIRST_RECORD = re.compile(rb'^[^@]', re.MULTILINE)
+
 
 def main():
-    run()
+    args = parse_args()
+    bad_paths = []
+    with profiled(args.profile, 'dump_rgs'):
+        for path in args.paths or ['-']:
+            if path == '-':
+                rg_lines = generate_sam_rg_lines(sys.stdin.buffer,
+                                                 args.header_only)
+            else:
+                rg_lines = read_rg_lines(path, bad_paths)
+            run(rg_lines, path if args.add_source else None)
+    if bad_paths:
+        sys.exit(1)
+
 
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='*', metavar='path',
+                        help='read the header of this BAM, CRAM or SAM '
+                             'file; - is standard input')
+    parser.add_argument('-H', '--header-only', action='store_true',
+                        help='stop reading standard input at its first '
+                             'alignment record; files are always read only '
+                             'up to theirs')
+    parser.add_argument('-s', '--add-source', action='store_true',
+                        help='add a column with the path the RG came from '
+                             '(- for standard input)')
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    return args
 
-def run():
-    for line in sys.stdin:
-        linesplit = line.rstrip().split('\t')
-        if linesplit[0] != '@RG':
+
+def run(lines, source=None):
+    for line in lines:
+        rg = parse_rg_line(line)
+        if rg is None:
             continue
-        rg_dict = {}
-        for item in linesplit[1:]:
-            k, v = item.split(':', 1)
-            assert k not in rg_dict, (k, rg_dict)
-            assert ':' not in k
-            rg_dict[k] = v
-        pat = re.compile(r'PU:(?:[\w-]+_)?([\w-]+)')
-        rg_bc = pat.search(line).group(1)
-        rg_sm = rg_dict['SM']
-        print(rg_bc, rg_sm, sep='\t')
+        if source is not None:
+            rg += (source,)
+        with stage(OUTPUT_WRITE):
+            print(*rg, sep='\t')
+
+
+def parse_rg_line(line):
+    """Return (barcode, sample) of an @RG header line, or None if line is not
+    one. The barcode is the PU value without any prefix ending in _."""
+    linesplit = line.rstrip().split('\t')
+    if linesplit[0] != '@RG':
+        return None
+    rg_dict = {}
+    for item in linesplit[1:]:
+        k, v = item.split(':', 1)
+        assert k not in rg_dict, (k, rg_dict)
+        assert ':' not in k
+        rg_dict[k] = v
+    rg_bc = PU_PATTERN.search(line).group(1)
+    rg_sm = rg_dict['SM']
+    return rg_bc, rg_sm
+
+
+def read_rg_lines(path, bad_paths):
+    """Return the @RG lines of the BAM, CRAM or SAM file at path, telling
+    them apart by their first bytes. A file that cannot be read is reported
+    on standard error, appended to bad_paths and skipped, as samtools
+    would."""
+    try:
+        with stage(HEADER_READ):
+            with open(path, 'rb') as fin:
+                magic = fin.read(len(CRAM_MAGIC))
+                if magic == CRAM_MAGIC:
+                    return read_cram_rg_lines(path)
+                if magic[:1] in (b'@', b''):
+                    fin.seek(0)
+                    return list(generate_sam_rg_lines(fin, True))
+            return read_bam_rg_lines(path)
+    except (HeaderError, OSError, UnicodeDecodeError) as e:
+        print('dump_rgs: {}'.format(e), file=sys.stderr)
+        bad_paths.append(path)
+        return []
+
+
+def generate_sam_rg_lines(fin, header_only=False):
+    """Generator of the @RG lines of SAM text read from the binary file
+    fin in chunks. With header_only, stops at the first line that is not a
+    header line, so the alignment records are not read."""
+    pending = b''
+    while True:
+        chunk = fin.read(CHUNK_SIZE)
+        text = pending + chunk
+        if header_only:
+            # pending starts a line, so every match starts a line.
+            match = FIRST_RECORD.search(text)
+            if match is not None:
+                yield from select_rg_lines(text[:match.start()])
+                return
+        if not chunk:
+            yield from select_rg_lines(text)
+            return
+        end = text.rfind(b'\n') + 1
+        text, pending = text[:end], text[end:]
+        yield from select_rg_lines(text)
 
 
 if __name__ == "__main__":
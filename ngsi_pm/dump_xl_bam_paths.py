@@ -5,9 +5,10 @@
 import argparse
 import logging
 
-import openpyxl
-
+from .profiling import (OUTPUT_WRITE, WORKBOOK_LOAD, add_profile_argument,
+                        profiled, stage)
 from .version import __version__
+from .workbook import read_columns
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +16,8 @@ logger = logging.getLogger(__name__)
 def main():
     args = parse_args()
     configure_logging(args.verbose)
-    run(args.input_file)
+    with profiled(args.profile, "dump_xl_bam_paths"):
+        run(args.input_file)
 
 
 def parse_args():
@@ -24,6 +26,7 @@ def parse_args():
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="increase output verbosity"
     )
+    add_profile_argument(parser)
     parser.add_argument(
         "--version", action="version", version="%(prog)s {}".format(__version__)
     )
@@ -41,19 +44,11 @@ def configure_logging(verbose):
 
 
 def run(input_file):
-    wb = openpyxl.load_workbook(input_file)
-    sheet = wb["smpls"]
-    active_sheet = wb.active
-    assert sheet == active_sheet, (sheet.title, active_sheet.title)
-    row_iter = iter(active_sheet.rows)
-    header_row = next(row_iter)
-    column_names = [c.value for c in header_row]
-    records = [
-        dict((k, v.value) for k, v in zip(column_names, row) if k in ("bam_path",))
-        for row in row_iter
-    ]
-    for record in records:
-        logger.info(record["bam_path"])
+    with stage(WORKBOOK_LOAD):
+        rows = list(read_columns(input_file, ("bam_path",), sheet_name="smpls"))
+    with stage(OUTPUT_WRITE):
+        for bam_path, in rows:
+            logger.info(bam_path)
 
 
 if __name__ == "__main__":
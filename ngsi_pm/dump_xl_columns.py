@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+
+"""Output columns of the master worksheet of a workbook, in one pass.
+
+    dump_xl_columns MASTER.xlsx lane_barcode sample_id_nwd_id
+    dump_xl_columns -0 MASTER.xlsx cram_path | xargs -0 ls -l
+
+The worksheet is smpls or the one ending in _smpls, unless --sheet is given.
+Column names are matched with / read as _, so sample_id/nwd_id and
+sample_id_nwd_id are the same column. Empty cells are output as empty
+strings in TSV and null in JSON Lines."""
+
+# First come standard libraries, in alphabetical order.
+import argparse
+from itertools import islice
+import logging
+import sys
+
+# After another blank line, import local libraries.
+from .profiling import (OUTPUT_WRITE, WORKBOOK_LOAD, add_profile_argument,
+                        profiled, stage)
+from .table_output import (COMPRESSIONS, OUTPUT_FORMATS, check_available,
+                           format_rows, guess_compression, open_writer)
+from .version import __version__
+from .workbook import fix_column_name, read_columns
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 10000  # rows per write
+
+
+def main():
+    args = parse_args()
+    config_logging(args)
+    with profiled(args.profile, 'dump_xl_columns'):
+        error_code = run(args.input_file, args.columns, args.sheet, args.key,
+                         args.header, args.null, args.format, args.output,
+                         args.compress)
+    logging.shutdown()
+    sys.exit(error_code)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('input_file', help='an XLSX workbook')
+    parser.add_argument('columns', nargs='+', metavar='column',
+                        help='a column to output, in this order')
+    parser.add_argument('--sheet', metavar='NAME',
+                        help='read worksheet NAME, which must be the active '
+                             'one, instead of the master worksheet')
+    parser.add_argument('-k', '--key', metavar='COLUMN',
+                        help='skip the rows whose COLUMN is empty or starts '
+                             'with #, like the worklists do')
+    parser.add_argument('-H', '--header', action='store_true',
+                        help='start TSV output with the column names')
+    parser.add_argument('-0', '--null', action='store_true',
+                        help='end each value with NUL instead of tab or '
+                             'newline, for xargs -0')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='tsv',
+                        help='output format (default: %(default)s)')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write to FILE instead of stdout')
+    parser.add_argument('--compress', choices=COMPRESSIONS,
+                        help='compress the output (default: by the suffix '
+                             'of FILE, .gz or .zst); for parquet, the codec')
+    add_profile_argument(parser)
+    parser.add_argument('-v', '--verbose', action='count')
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s {}'.format(__version__))
+    args = parser.parse_args()
+    args.columns = [fix_column_name(name) for name in args.columns]
+    if args.key is not None:
+        args.key = fix_column_name(args.key)
+        if args.key not in args.columns:
+            parser.error('--key {} is not one of the columns'.format(args.key))
+    if args.null and args.format != 'tsv':
+        parser.error('--null needs --format tsv')
+    if args.compress is None and args.format != 'parquet':
+        args.compress = guess_compression(args.output)
+    message = check_available(args.format, args.compress)
+    if message:
+        parser.error(message)
+    return args
+
+
+def config_logging(args):
+    global logger
+    if not args.verbose:
+        level = logging.WARNING
+    elif args.verbose == 1:
+        level = logging.INFO
+    else:
+        level = logging.DEBUG
+    logger = logging.getLogger('dump_xl_columns')
+    err_handler = logging.StreamHandler()
+    logger.addHandler(err_handler)
+    logger.setLevel(level)
+
+
+def run(input_file, columns, sheet_name=None, key_column=None, header=False,
+        null=False, output_format='tsv', output_path=None, compression=None):
+    """Write the columns of each row of the worksheet, and return the exit
+    code: 2 if the worksheet or a column is missing, else 0."""
+    rows = read_columns(input_file, columns, sheet_name, fix_names=True,
+                        key_column=key_column)
+    writer = None
+    num_rows = 0
+    try:
+        with stage(WORKBOOK_LOAD):
+            chunk = list(islice(rows, CHUNK_ROWS))
+        writer = open_writer(output_path, output_format, columns,
+                             compression)
+        if header and output_format == 'tsv':
+            with stage(OUTPUT_WRITE):
+                writer.write(format_text_rows([columns], null))
+        while chunk:
+            num_rows += len(chunk)
+            with stage(OUTPUT_WRITE):
+                if output_format == 'tsv':
+                    writer.write(format_text_rows(chunk, null))
+                else:
+                    writer.write(format_rows(
+                        [tuple(cell_text(value, None) for value in row)
+                         for row in chunk],
+                        columns, output_format
+                    ))
+            with stage(WORKBOOK_LOAD):
+                chunk = list(islice(rows, CHUNK_ROWS))
+    except (AssertionError, KeyError) as e:
+        logger.error('%s: %s', input_file, e)
+        return 2
+    finally:
+        rows.close()
+        if writer is not None:
+            with stage(OUTPUT_WRITE):
+                writer.close()
+    logger.info('wrote %s rows', num_rows)
+    return 0
+
+
+def format_text_rows(rows, null=False):
+    """Return rows as TSV lines, or with null as NUL-terminated values."""
+    if null:
+        return ''.join(cell_text(value) + '\0'
+                       for row in rows for value in row)
+    return ''.join('\t'.join(cell_text(value) for value in row) + '\n'
+                   for row in rows)
+
+
+def cell_text(value, empty=''):
+    """Return the cell value as text, or empty if the cell is empty."""
+    if value is None:
+        return empty
+    return str(value)
+
+
+if __name__ == '__main__':
+    main()
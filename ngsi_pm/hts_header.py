@@ -0,0 +1,247 @@
+"""Read the SAM header of a CRAM or BAM file without running samtools.
+
+For CRAM, only the file definition and the start of the first container are
+read. The first container holds the SAM header in a single block, so that is
+the only block that is decompressed.
+
+For BAM, BGZF blocks are inflated one at a time from the start of the file
+until the header text and the reference list are complete."""
+
+# First come standard libraries, in alphabetical order.
+import bz2
+import logging
+import lzma
+import struct
+import zlib
+
+logger = logging.getLogger(__name__)
+
+BAM_MAGIC = b'BAM\x01'
+BGZF_HEADER = struct.Struct('<4BI2BH')  # gzip header with XLEN
+BGZF_FOOTER_SIZE = 8  # CRC32, ISIZE
+CRAM_MAGIC = b'CRAM'
+CRAM_FILE_DEFINITION_SIZE = 26  # magic, major, minor, 20-byte file id
+CRAM_MAJOR_VERSIONS = 2, 3
+FILE_HEADER_CONTENT_TYPE = 0
+# Block compression methods that the stdlib can undo. The spec only allows
+# raw and gzip for the header block, but other methods cost nothing here.
+RAW, GZIP, BZIP2, LZMA = range(4)
+
+
+def read_cram_rg_lines(cram_path):
+    """Return the @RG lines of the SAM header of a CRAM file as a list of
+    strings without line terminators."""
+    return select_rg_lines(read_cram_header_bytes(cram_path))
+
+
+def read_cram_header_bytes(cram_path):
+    """Return the raw SAM header text of a CRAM file as bytes."""
+    with open(str(cram_path), 'rb') as fin:
+        file_definition = fin.read(CRAM_FILE_DEFINITION_SIZE)
+        if (len(file_definition) != CRAM_FILE_DEFINITION_SIZE
+                or file_definition[:4] != CRAM_MAGIC):
+            raise HeaderError('not a CRAM file: {}'.format(cram_path))
+        major_version = file_definition[4]
+        if major_version not in CRAM_MAJOR_VERSIONS:
+            raise HeaderError('unsupported CRAM version {}.{}: {}'.format(
+                major_version, file_definition[5], cram_path
+            ))
+        reader = _CramReader(fin, cram_path)
+        skip_container_header(reader, major_version)
+        method = reader.byte()
+        content_type = reader.byte()
+        reader.itf8()  # content id
+        compressed_size = reader.itf8()
+        raw_size = reader.itf8()
+        if content_type != FILE_HEADER_CONTENT_TYPE:
+            raise HeaderError(
+                'first block is not a file header: {}'.format(cram_path)
+            )
+        data = decompress_block(reader.read(compressed_size), method,
+                                cram_path)
+    if len(data) != raw_size or raw_size < 4:
+        raise HeaderError('bad header block size: {}'.format(cram_path))
+    text_size, = struct.unpack('<i', data[:4])
+    if not 0 <= text_size <= raw_size - 4:
+        raise HeaderError('bad header text size: {}'.format(cram_path))
+    return data[4:4+text_size]
+
+
+def skip_container_header(reader, major_version):
+    """Advance past the header of the first container."""
+    reader.read(4)  # length of the container data
+    for _ in range(4):  # reference id, start, span, number of records
+        reader.itf8()
+    reader.ltf8()  # record counter
+    reader.ltf8()  # number of bases
+    reader.itf8()  # number of blocks
+    for _ in range(reader.itf8()):  # landmarks
+        reader.itf8()
+    if major_version >= 3:
+        reader.read(4)  # CRC32
+
+
+def decompress_block(data, method, cram_path):
+    try:
+        if method == RAW:
+            return data
+        if method == GZIP:
+            return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        if method == BZIP2:
+            return bz2.decompress(data)
+        if method == LZMA:
+            return lzma.decompress(data)
+    except (zlib.error, OSError, lzma.LZMAError) as e:
+        raise HeaderError('bad header block: {}: {}'.format(cram_path, e))
+    raise HeaderError('unsupported header block compression {}: {}'.format(
+        method, cram_path
+    ))
+
+
+def read_bam_rg_lines(bam_path):
+    """Return the @RG lines of the SAM header of a BAM file as a list of
+    strings without line terminators."""
+    header_bytes, _ = read_bam_header(bam_path)
+    return select_rg_lines(header_bytes)
+
+
+def read_bam_header(bam_path):
+    """Return (header_text, references) for a BAM file, where header_text is
+    the SAM header as bytes and references is a list of (name, length)."""
+    with open(str(bam_path), 'rb') as fin:
+        reader = _BgzfReader(fin, bam_path)
+        if reader.read(4) != BAM_MAGIC:
+            raise HeaderError('not a BAM file: {}'.format(bam_path))
+        text_size = reader.int32()
+        header_text = reader.read(text_size)
+        num_references = reader.int32()
+        references = []
+        for _ in range(num_references):
+            name_size = reader.int32()
+            name = reader.read(name_size).rstrip(b'\0').decode()
+            references.append((name, reader.int32()))
+    return header_text, references
+
+
+def select_rg_lines(header_bytes):
+    """Return the @RG lines of SAM header text, decoding only those lines."""
+    return [line.decode().rstrip('\r')
+            for line in header_bytes.split(b'\n')
+            if line.startswith(b'@RG\t')]
+
+
+class _CramReader:
+    """Reads the CRAM integer encodings from a binary file object."""
+
+    def __init__(self, fin, path):
+        self.fin = fin
+        self.path = path
+
+    def read(self, size):
+        data = self.fin.read(size)
+        if len(data) != size:
+            raise HeaderError('truncated CRAM: {}'.format(self.path))
+        return data
+
+    def byte(self):
+        return self.read(1)[0]
+
+    def itf8(self):
+        """Read an ITF-8 integer: 1 to 5 bytes, signed 32 bits."""
+        first = self.byte()
+        if first < 0x80:
+            return first
+        if first < 0xc0:
+            value = (first & 0x3f) << 8 | self.byte()
+        elif first < 0xe0:
+            rest = self.read(2)
+            value = (first & 0x1f) << 16 | rest[0] << 8 | rest[1]
+        elif first < 0xf0:
+            rest = self.read(3)
+            value = ((first & 0x0f) << 24 | rest[0] << 16 | rest[1] << 8
+                     | rest[2])
+        else:
+            rest = self.read(4)
+            value = ((first & 0x0f) << 28 | rest[0] << 20 | rest[1] << 12
+                     | rest[2] << 4 | rest[3] & 0x0f)
+        return value - (1 << 32) if value & 0x80000000 else value
+
+    def ltf8(self):
+        """Read an LTF-8 integer: 1 to 9 bytes, where the number of leading
+        1 bits in the first byte is the number of bytes that follow."""
+        first = self.byte()
+        num_following = 0
+        while num_following < 8 and first & (0x80 >> num_following):
+            num_following += 1
+        value = first & (0xff >> (num_following + 1))
+        for b in self.read(num_following):
+            value = value << 8 | b
+        return value
+
+
+class _BgzfReader:
+    """Reads the uncompressed stream of a BGZF file, inflating blocks only
+    as they are needed."""
+
+    def __init__(self, fin, path):
+        self.fin = fin
+        self.path = path
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def read(self, size):
+        if size < 0:
+            raise HeaderError('bad BAM header: {}'.format(self.path))
+        while len(self.buffer) - self.offset < size:
+            self._inflate_next_block()
+        data = bytes(self.buffer[self.offset:self.offset+size])
+        self.offset += size
+        return data
+
+    def int32(self):
+        value, = struct.unpack('<i', self.read(4))
+        return value
+
+    def _inflate_next_block(self):
+        del self.buffer[:self.offset]
+        self.offset = 0
+        header = self.fin.read(BGZF_HEADER.size)
+        if len(header) != BGZF_HEADER.size:
+            raise HeaderError('truncated BAM header: {}'.format(self.path))
+        id1, id2, method, flags, _, _, _, extra_size = BGZF_HEADER.unpack(
+            header
+        )
+        if (id1, id2, method) != (31, 139, 8) or not flags & 4:
+            raise HeaderError('not a BGZF file: {}'.format(self.path))
+        extra = self.fin.read(extra_size)
+        block_size = find_bgzf_block_size(extra)
+        if block_size is None:
+            raise HeaderError('not a BGZF file: {}'.format(self.path))
+        data_size = block_size - BGZF_HEADER.size - extra_size
+        rest = self.fin.read(data_size)
+        if len(rest) != data_size or data_size < BGZF_FOOTER_SIZE:
+            raise HeaderError('truncated BAM header: {}'.format(self.path))
+        try:
+            self.buffer += zlib.decompress(rest[:-BGZF_FOOTER_SIZE],
+                                           -zlib.MAX_WBITS)
+        except zlib.error as e:
+            raise HeaderError('bad BGZF block: {}: {}'.format(self.path, e))
+
+
+def find_bgzf_block_size(extra):
+    """Return the total block size from the BC subfield of a gzip extra
+    field, or None if there is no such subfield."""
+    offset = 0
+    while offset + 4 <= len(extra):
+        subfield_id = extra[offset:offset+2]
+        subfield_size, = struct.unpack('<H', extra[offset+2:offset+4])
+        if subfield_id == b'BC' and subfield_size == 2:
+            block_size, = struct.unpack('<H', extra[offset+4:offset+6])
+            return block_size + 1
+        offset += 4 + subfield_size
+    return None
+
+
+class HeaderError(Exception):
+    """Raised when a file is not a readable alignment file."""
+    pass
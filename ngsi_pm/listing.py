@@ -0,0 +1,284 @@
+"""Directory listings for the worklists, optionally cached on disk.
+
+A Lister lists directories and counts the system calls it makes. A
+CachedLister keeps the listings in an SQLite file and reuses one as long as
+its directory has the same mtime, which changes whenever an entry is added,
+removed or renamed, so a rerun over unchanged result directories costs one
+stat per directory instead of a listing. With max_age, listings older than
+that many seconds are read again anyway.
+
+A listing made within RACY_SECONDS of its directory's mtime is not stored,
+since the directory could change again within the same mtime tick.
+
+An IndexLister answers every listing from an in-memory index of the whole
+tree, built once from manifest files (such as the output of find) or by a
+parallel walk of prescan roots. After that it touches the file system only
+for paths below an entry it knows as something other than a directory, such
+as a symbolic link to one, which it lists live. For batches of thousands of
+result directories one bulk walk is much cheaper than a listing per
+directory."""
+
+# First come standard libraries, in alphabetical order.
+from collections import Counter
+import errno
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# After another blank line, import local libraries.
+from .parse_cache import connect
+from .profiling import FILE_DISCOVERY, stage
+from .tree_walk import DEFAULT_JOBS, walk
+
+logger = logging.getLogger(__name__)
+
+# Bump when the meaning of cached listings changes, to drop old ones.
+FORMAT_VERSION = 1
+RACY_SECONDS = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS listings (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    listed_at REAL NOT NULL,
+    entries TEXT NOT NULL
+);
+'''
+
+
+def add_listing_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--listing-cache', metavar='FILE',
+                       help='reuse the directory listings stored in the '
+                            'SQLite file FILE while the directories are '
+                            'unchanged, and store new ones there')
+    group.add_argument('--manifest', action='append', metavar='FILE',
+                       help='take directory listings from FILE instead of '
+                            'the file system: one path per line, optionally '
+                            'followed by a tab and its type, d for '
+                            'directories, as printed by find -printf '
+                            '"%%p\\t%%y\\n"; FILE may be gzipped; '
+                            'may be repeated')
+    group.add_argument('--prescan', action='append', metavar='ROOT',
+                       help='walk the directory tree under ROOT in parallel '
+                            'once and take directory listings from it; may '
+                            'be repeated')
+    parser.add_argument('--listing-max-age', type=float, metavar='SECONDS',
+                        help='with --listing-cache, list directories again '
+                             'if their stored listing is older than this')
+
+
+def open_lister(cache_path=None, max_age=None, manifests=None,
+                prescan_roots=None, jobs=DEFAULT_JOBS):
+    """Return an IndexLister of manifests and prescan_roots if either is
+    set, else a CachedLister if cache_path is set, else a Lister. The
+    prescan walks with jobs threads. A cache that cannot be opened is
+    logged and not used."""
+    if manifests or prescan_roots:
+        lister = IndexLister()
+        for manifest in manifests or ():
+            lister.read_manifest(manifest)
+        for root in prescan_roots or ():
+            lister.prescan(root, jobs)
+        return lister
+    if cache_path:
+        try:
+            return CachedLister(cache_path, max_age)
+        except sqlite3.Error as e:
+            logger.warning('not using listing cache %s: %s', cache_path, e)
+    return Lister()
+
+
+class Lister:
+    """Lists directories. One instance may be shared by several threads.
+    counts holds the number of each kind of system call made, like
+    'scandir' and 'stat'."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._count_lock = threading.Lock()
+
+    def close(self):
+        pass
+
+    def count(self, kind, n=1):
+        with self._count_lock:
+            self.counts[kind] += n
+
+    def list_dir(self, path):
+        """Return [(name, is_dir)] of the entries of directory path, in the
+        order the file system returns them. Symbolic links to directories
+        are not directories. Raises OSError if path cannot be listed."""
+        return self._scan(path)
+
+    def _scan(self, path):
+        self.count('scandir')
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                entries.append((entry.name, is_dir))
+        return entries
+
+    def log_counts(self):
+        logger.info('directory I/O: %s', ', '.join(
+            '{} {}'.format(kind, n) for kind, n in sorted(self.counts.items())
+        ) or 'none')
+
+
+class CachedLister(Lister):
+    """A Lister that stores listings in an SQLite file."""
+
+    def __init__(self, db_path, max_age=None):
+        super().__init__()
+        self.db_path = str(db_path)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._connection = connect(self.db_path, check_same_thread=False)
+        version = self._connection.execute('PRAGMA user_version').fetchone()
+        if version[0] != FORMAT_VERSION:
+            logger.info('creating listing cache %s', self.db_path)
+            self._connection.executescript(
+                'DROP TABLE IF EXISTS listings;'
+                'PRAGMA user_version={};'.format(FORMAT_VERSION)
+            )
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def list_dir(self, path):
+        path = os.path.abspath(str(path))
+        self.count('stat')
+        mtime_ns = os.stat(path).st_mtime_ns
+        entries = self._get(path, mtime_ns)
+        if entries is not None:
+            self.count('cache hit')
+            return entries
+        now = time.time()
+        entries = self._scan(path)
+        if now - mtime_ns / 1e9 >= RACY_SECONDS:
+            self._put(path, mtime_ns, now, entries)
+        return entries
+
+    def _get(self, path, mtime_ns):
+        try:
+            with self._lock:
+                row = self._connection.execute(
+                    'SELECT mtime_ns, listed_at, entries FROM listings '
+                    'WHERE path = ?', (path,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning('listing cache %s unusable: %s', self.db_path, e)
+            return None
+        if row is None or row[0] != mtime_ns:
+            return None
+        if self.max_age is not None and time.time() - row[1] > self.max_age:
+            return None
+        return [tuple(entry) for entry in json.loads(row[2])]
+
+    def _put(self, path, mtime_ns, listed_at, entries):
+        try:
+            with self._lock:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)',
+                    (path, mtime_ns, listed_at, json.dumps(entries))
+                )
+        except sqlite3.Error as e:
+            logger.warning('listing cache %s unusable: %s', self.db_path, e)
+
+
+class IndexLister(Lister):
+    """A Lister that answers from an index of directory path -> {name:
+    is_dir} of its entries, built by add(), read_manifest() and prescan().
+    Paths at or below an entry that is not a directory, like a symbolic
+    link, are listed live, so that links to directories are followed as
+    Lister follows them. Other paths missing from the index cannot be
+    listed, as if they did not exist."""
+
+    def __init__(self):
+        super().__init__()
+        self._index = {}
+
+    def add(self, path, is_dir=False):
+        """Add path, and its ancestors as directories."""
+        path = normalize(path)
+        if is_dir:
+            self._index.setdefault(path, {})
+        while True:
+            parent, name = os.path.split(path)
+            if not name:
+                break
+            entries = self._index.get(parent)
+            known = entries is not None
+            if not known:
+                entries = self._index[parent] = {}
+            entries[name] = entries.get(name, False) or is_dir
+            if known:
+                break
+            path, is_dir = parent, True
+
+    def read_manifest(self, manifest_path):
+        """Add the paths listed in manifest_path, one per line. A path is a
+        directory if it ends with / or is followed by a tab and d, the
+        format of find -printf '%p\\t%y\\n'. Other types, like f or l,
+        are not directories."""
+        opener = gzip.open if str(manifest_path).endswith('.gz') else open
+        logger.info('reading manifest %s', manifest_path)
+        with stage(FILE_DISCOVERY), \
+                opener(str(manifest_path), 'rt', newline='\n') as fin:
+            for line in fin:
+                path, _, kind = line.rstrip('\n').partition('\t')
+                if path:
+                    self.add(path, kind == 'd' or path.endswith('/'))
+        logger.info('indexed %s directories', len(self._index))
+
+    def prescan(self, root, jobs=DEFAULT_JOBS):
+        """Add everything under directory root, listing jobs directories
+        at once. Symbolic links to directories are not walked, so that
+        loops cannot arise; list_dir() lists them live instead."""
+        logger.info('prescanning %s', root)
+        with stage(FILE_DISCOVERY):
+            self.add(root, True)
+            for path, files, subdirs in walk(root, jobs):
+                self.count('scandir')
+                for _, file_path in files:
+                    self.add(file_path)
+                for subdir in subdirs:
+                    self.add(subdir, True)
+        logger.info('indexed %s directories', len(self._index))
+
+    def list_dir(self, path):
+        normal_path = normalize(path)
+        entries = self._index.get(normal_path)
+        if entries is not None:
+            self.count('index lookup')
+            return list(entries.items())
+        if self._below_non_directory(normal_path):
+            return self._scan(normal_path)
+        self.count('index lookup')
+        raise FileNotFoundError(errno.ENOENT, 'not in the index', str(path))
+
+    def _below_non_directory(self, path):
+        """Whether path is, or is below, an entry of the index that is not
+        a directory."""
+        while True:
+            parent, name = os.path.split(path)
+            if not name:
+                return False
+            entries = self._index.get(parent)
+            if entries is not None:
+                return entries.get(name) is False
+            path = parent
+
+
+def normalize(path):
+    return os.path.normpath(os.path.abspath(str(path)))
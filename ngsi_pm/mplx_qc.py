@@ -12,31 +12,42 @@ samples.
 # First come standard libraries, in alphabetical order.
 import argparse
 from collections import Counter
+from functools import partial
 from json import JSONDecodeError
 import logging
-import os
 from pathlib import Path
 import re
+import sqlite3
 import sys
 from subprocess import run, DEVNULL, PIPE
-
-# after a blank line, import third-party libraries.
-import openpyxl
+import zlib
 
 # After another blank line, import local libraries.
 from .dump_js_barcodes import Merge
-from .dump_js_barcodes import SequencingEvent
+from .hts_header import HeaderError, read_cram_rg_lines
+from .parallel import ordered_map, positive_int
+from .parse_cache import ParseCache
+from .profiling import (HEADER_READ, JSON_PARSE, OUTPUT_WRITE, WORKBOOK_LOAD,
+                        add_profile_argument, profiled, stage)
 from .version import __version__
+from .workbook import generate_sheet_rows
 
 logger = logging.getLogger(__name__)
 
 COLUMNS_NEEDED = set('sample_id_nwd_id merge_id json_path cram_path'.split())
+CRAM_READERS = 'samtools', 'native'
+SHARD_TRAILER = '#shard'  # first field of the last line of --shard output
 
 
 def main():
     args = parse_args()
     config_logging(args)
-    error_code = run_qc(args.input_file)
+    fail_fast = args.fail_fast_code
+    if fail_fast is None and args.fail_fast:
+        fail_fast = 1
+    with profiled(args.profile, 'mplx_qc'):
+        error_code = run_qc(args.input_file, args.jobs, args.cram_reader,
+                            args.cache, fail_fast, args.shard)
     logging.shutdown()
     sys.exit(error_code)
 
@@ -47,6 +58,28 @@ def parse_args():
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
     parser.add_argument('input_file')
+    parser.add_argument('-j', '--jobs', type=positive_int, default=1,
+                        help='number of merges to check concurrently')
+    parser.add_argument('--cram-reader', choices=CRAM_READERS,
+                        default='samtools',
+                        help='how to read CRAM headers: run samtools, or '
+                             'read the header block directly')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='keep parsed CRAM read groups and merge JSONs '
+                             'in this file and reuse them while the files '
+                             'are unchanged')
+    parser.add_argument('--fail-fast', action='store_true',
+                        help='stop at the first merge with an error')
+    parser.add_argument('--fail-fast-code', type=positive_int,
+                        metavar='CODE',
+                        help='stop at the first merge with an error code of '
+                             'at least CODE')
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help='check only shard I of N (1 <= I <= N), '
+                             'partitioned by merge_id, and end the output '
+                             'with a trailer line; combine the outputs of '
+                             'all N shards with mplx_qc_merge')
+    add_profile_argument(parser)
     parser.add_argument('-v', '--verbose', action='count')
     parser.add_argument('--version', action='version',
                         version='%(prog)s {}'.format(__version__))
@@ -54,6 +87,26 @@ def parse_args():
     return args
 
 
+def parse_shard(text):
+    """argparse type for --shard: "I/N" -> (I, N)."""
+    try:
+        index, count = (int(s) for s in text.split('/'))
+    except ValueError:
+        index = count = 0
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            'expected I/N with 1 <= I <= N: {!r}'.format(text)
+        )
+    return index, count
+
+
+def in_shard(merge_id, shard):
+    """True if merge_id belongs to shard (I, N). Uses CRC32 rather than
+    hash(), so every node agrees on the partition."""
+    index, count = shard
+    return zlib.crc32(str(merge_id).encode()) % count == index - 1
+
+
 def config_logging(args):
     global logger
     if not args.verbose:
@@ -68,7 +121,8 @@ def config_logging(args):
     logger.setLevel(level)
 
 
-def run_qc(input_file):
+def run_qc(input_file, jobs=1, cram_reader='samtools', cache_path=None,
+           fail_fast=None, shard=None):
     """
     Error codes:
      0: no errors
@@ -94,44 +148,113 @@ def run_qc(input_file):
     20: Input file is missing"""
     logger.debug('input_file: %r', input_file)
     input_path = Path(input_file)
+    cache = None
+    if cache_path:
+        try:
+            cache = ParseCache(cache_path)
+        except sqlite3.Error as e:
+            logger.warning('not using parse cache %s: %s', cache_path, e)
+    num_records = 0
     try:
-        error_code = process_input(input_path)
+        error_code, num_records = process_input(input_path, jobs, cram_reader,
+                                                cache, fail_fast, shard)
     except GrosslyBadError as e:
         error_code = e.error_code
         logger.error(e.message)
+    finally:
+        if cache:
+            logger.info('parse cache: %s hits, %s misses',
+                        cache.hits, cache.misses)
+            cache.close()
+    if shard:
+        # The trailer tells mplx_qc_merge that the shard ran to completion.
+        with stage(OUTPUT_WRITE):
+            print(SHARD_TRAILER, '{}/{}'.format(*shard), num_records,
+                  error_code, sep='\t', flush=True)
     logger.debug('finished')
     return error_code
 
 
-def process_input(input_path):
+def process_input(input_path, jobs=1, cram_reader='samtools', cache=None,
+                  fail_fast=None, shard=None):
     """Read the XLSX input for a batch of merged CRAMs. Verify that the CRAM
-    headers and JSON metadata are consistent. Return an error code, where 0
-    means no errors, otherwise corresponding to the most severe error."""
+    headers and JSON metadata are consistent, checking up to jobs merges at a
+    time. Records are streamed from the input, so memory use does not grow
+    with the size of the batch, and results are printed in input order as
+    soon as they are known. If fail_fast is set, stop at the first record
+    with an error code of at least fail_fast, cancelling the checks that have
+    not started. If shard is set to (I, N), only the records in shard I of N
+    are checked, and each output line ends with the index of its record in
+    the input. Return (error code, number of records checked), where the
+    error code is 0 for no errors, otherwise corresponding to the most
+    severe error."""
     logger.debug('process_input %s', input_path)
-    merged_crams = read_input(input_path)
-    logger.info('found %s records', len(merged_crams))
-    logger.debug('first record: %r', vars(merged_crams[0]))
-    logger.debug('last record: %r', vars(merged_crams[-1]))
+    merged_crams = iter_input(input_path)
+    if shard:
+        logger.info('checking shard %s of %s', *shard)
+        merged_crams = (r for r in number_records(merged_crams)
+                        if in_shard(r.merge_id, shard))
     error_code = 0  # no error
-    for record in merged_crams:
-        logger.info('checking %s', record.merge_id)
-        try:
-            ec = compare_read_groups(record.sample_id_nwd_id,
-                                     record.cram_path,
-                                     record.json_path)
-        except GrosslyBadError as e:
-            logger.error(e.message)
-            ec = e.error_code
-        if ec:
-            print(ec, record.merge_id, record.cram_path, record.json_path,
-                  sep='\t')
-        error_code = max(error_code, ec)
-    return error_code
+    num_records = 0
+    record = None
+    check = partial(check_record, cram_reader=cram_reader, cache=cache)
+    results = ordered_map(check, merged_crams, jobs)
+    try:
+        for record, ec in results:
+            num_records += 1
+            if num_records == 1:
+                logger.debug('first record: %r', vars(record))
+            if ec:
+                row = (record.input_index,) if shard else ()
+                with stage(OUTPUT_WRITE):
+                    print(ec, record.merge_id, record.cram_path,
+                          record.json_path, *row, sep='\t', flush=True)
+            error_code = max(error_code, ec)
+            if fail_fast is not None and ec >= fail_fast:
+                logger.warning('Stopping early after %s records: %s has '
+                               'error code %s', num_records, record.merge_id,
+                               ec)
+                break
+    finally:
+        results.close()
+    if record is not None:
+        logger.debug('last record: %r', vars(record))
+    logger.info('checked %s records', num_records)
+    return error_code, num_records
+
+
+def number_records(records):
+    """Generator of records, each with its index in records as its
+    input_index attribute."""
+    for index, record in enumerate(records):
+        record.input_index = index
+        yield record
+
+
+def check_record(record, cram_reader='samtools', cache=None):
+    """Check one merged CRAM record and return (record, error_code)."""
+    logger.info('checking %s', record.merge_id)
+    try:
+        ec = compare_read_groups(record.sample_id_nwd_id,
+                                 record.cram_path,
+                                 record.json_path,
+                                 cram_reader,
+                                 cache)
+    except GrosslyBadError as e:
+        logger.error(e.message)
+        ec = e.error_code
+    return record, ec
 
 
 def read_input(input_path):
     """Read master XLSX of merged CRAMs and return list of objects containing
     the file paths."""
+    return list(iter_input(input_path))
+
+
+def iter_input(input_path):
+    """Check the input file and its column names, then return an iterator of
+    objects containing the file paths, read from the input as needed."""
     check_input_path(input_path)
     try:
         if input_path.suffix == '.xlsx':
@@ -148,15 +271,20 @@ def read_input(input_path):
             e
         )
     check_column_names(column_names)
-    merged_crams = []
+    return generate_records(column_names, row_iter)
+
+
+def generate_records(column_names, row_iter):
+    """Generator function that yields an object for each row, with the
+    needed columns as attributes."""
+    needed = [(i, column_name) for i, column_name in enumerate(column_names)
+              if column_name in COLUMNS_NEEDED]
     for row in row_iter:
         merged_cram = Generic()
-        for column_name, value in zip(column_names, row):
-            if column_name in ['sample_id_nwd_id', 'merge_id',
-                               'json_path', 'cram_path']:
-                setattr(merged_cram, column_name, value)
-        merged_crams.append(merged_cram)
-    return merged_crams
+        for i, column_name in needed:
+            if i < len(row):
+                setattr(merged_cram, column_name, row[i])
+        yield merged_cram
 
 
 def check_input_path(input_path):
@@ -184,16 +312,16 @@ def check_column_names(column_names):
 
 
 def generate_xlsx_rows(input_path):
-    """Generator function that yields lists of cell values from the "smpls"
-    worksheet."""
-    wb = openpyxl.load_workbook(str(input_path),
-                                data_only=True, read_only=True)
-    sheet = wb['smpls']
-    active_sheet = wb.active
-    assert sheet == active_sheet, (sheet.title, active_sheet.title)
-    logger.debug('active_sheet name: %s', active_sheet.title)
-    for row in active_sheet.rows:
-        yield [c.value for c in row]
+    """Generator function that yields tuples of cell values from the "smpls"
+    worksheet, which must be the active one."""
+    with stage(WORKBOOK_LOAD):
+        row_iter = generate_sheet_rows(input_path, 'smpls', data_only=True)
+        column_names = next(row_iter)
+    try:
+        yield column_names
+        yield from row_iter
+    finally:
+        row_iter.close()
 
 
 def generate_tsv_rows(input_path):
@@ -203,7 +331,8 @@ def generate_tsv_rows(input_path):
             yield raw_line.rstrip('\r\n').split('\t')
 
 
-def compare_read_groups(sample_id_nwd_id, cram_path, json_path):
+def compare_read_groups(sample_id_nwd_id, cram_path, json_path,
+                        cram_reader='samtools', cache=None):
     """Compare a set of CRAM RG barcodes & samples to JSON barcodes & samples
     for one merged CRAM, returning most severe error code.
 
@@ -214,8 +343,9 @@ def compare_read_groups(sample_id_nwd_id, cram_path, json_path):
         len(set(cram_rg_samples)) == len(set(json_rg_samples)) == 1
         set(cram_rg_samples) == set(json_rg_samples)
     """
-    cram_rg_barcodes, cram_rg_samples = process_cram(cram_path)
-    json_rg_barcodes, json_rg_samples = process_json(json_path)
+    cram_rg_barcodes, cram_rg_samples = process_cram(cram_path, cram_reader,
+                                                     cache)
+    json_rg_barcodes, json_rg_samples = process_json(json_path, cache)
     logger.info('found %s cram_rg_barcodes, %s json_rg_barcodes',
                 len(cram_rg_barcodes), len(json_rg_barcodes))
     logger.debug('first barcodes: %s, %s',
@@ -265,10 +395,13 @@ def compare_read_groups(sample_id_nwd_id, cram_path, json_path):
 MULTIPLE = object()  # For corrupt data with two PUs or SMs in the same RG.
 
 
-def process_cram(cram_path):
+def process_cram(cram_path, cram_reader='samtools', cache=None):
     """Read header of CRAM, parse resulting RGs and then return
     CRAM RG barcodes and CRAM RG samples"""
-    rg_lines = dump_cram_rgs(cram_path)
+    if cache is not None:
+        return cache.fetch('cram_rgs', cram_path,
+                           partial(process_cram, cram_reader=cram_reader))
+    rg_lines = dump_cram_rgs(cram_path, cram_reader)
     cram_rg_barcodes = []
     cram_rg_samples = []
     for rg_line in rg_lines:
@@ -307,14 +440,24 @@ def process_cram(cram_path):
     return cram_rg_barcodes, cram_rg_samples
 
 
-def dump_cram_rgs(cram_path):
-    """Read cram_path using samtools and return list of RG lines."""
+def dump_cram_rgs(cram_path, cram_reader='samtools'):
+    """Read cram_path using samtools, or the native reader in hts_header,
+    and return list of RG lines."""
     if not Path(cram_path).is_file():
         raise GrosslyBadError(15, 'CRAM is missing: {}', cram_path)
+    if cram_reader == 'native':
+        logger.debug('reading header of %r', cram_path)
+        try:
+            with stage(HEADER_READ):
+                return read_cram_rg_lines(cram_path)
+        except (HeaderError, OSError, UnicodeDecodeError):
+            raise GrosslyBadError(13, 'CRAM is bad: {}', cram_path)
+    assert cram_reader == 'samtools', cram_reader
     logger.debug('samtools view -H %r', cram_path)
-    cp = run(['samtools', 'view', '-H', cram_path],
-             stdin=DEVNULL, stdout=PIPE,
-             universal_newlines=True)
+    with stage(HEADER_READ):
+        cp = run(['samtools', 'view', '-H', cram_path],
+                 stdin=DEVNULL, stdout=PIPE,
+                 universal_newlines=True)
     if cp.returncode:
         raise GrosslyBadError(13, 'CRAM is bad: {}', cram_path)
     headers = cp.stdout.splitlines()
@@ -322,15 +465,18 @@ def dump_cram_rgs(cram_path):
     return rg_lines
 
 
-def process_json(json_path):
+def process_json(json_path, cache=None):
     """from dump_js_barcodes.py import Merge,
     and parse JSON merge barcodes and JSON merge samples"""
+    if cache is not None:
+        return cache.fetch('merge', json_path, process_json)
     if not Path(json_path).is_file():
         raise GrosslyBadError(14, 'JSON is missing: {}', json_path)
     logger.debug('parsing: %s', json_path)
     try:
-        merge = Merge(json_path)
-    except JSONDecodeError as e:
+        with stage(JSON_PARSE):
+            merge = Merge(json_path)
+    except JSONDecodeError:
         raise GrosslyBadError(12, 'JSON is bad: {}', json_path)
     barcodes = [s.barcode for s in merge.sequencing_events]
     samples = [s.sample_name for s in merge.sequencing_events]
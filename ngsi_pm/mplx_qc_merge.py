@@ -0,0 +1,184 @@
+#! /usr/bin/env python3
+
+"""Combine the outputs of mplx_qc --shard runs into the output a single
+mplx_qc run over the whole input would produce. The input file is read again
+to restore input order, and the exit code is the most severe error code in
+the shard outputs, or the input file's own error code if it is bad.
+
+Each shard output ends with a trailer line giving I/N, the number of records
+the shard checked and its exit code. Unless there is one complete output for
+each of the N shards, and together they checked every record of the input,
+the errors are logged and the exit code is at least 1, since a shard that
+crashed, was killed, stopped early or was left out could have hidden
+errors."""
+
+# First come standard libraries, in alphabetical order.
+import argparse
+import logging
+from pathlib import Path
+import sys
+
+# After another blank line, import local libraries.
+from .mplx_qc import SHARD_TRAILER, GrosslyBadError, iter_input
+from .profiling import OUTPUT_WRITE, add_profile_argument, profiled, stage
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    args = parse_args()
+    config_logging(args)
+    with profiled(args.profile, 'mplx_qc_merge'):
+        error_code = merge_shards(args.input_file, args.shard_outputs)
+    logging.shutdown()
+    sys.exit(error_code)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('input_file',
+                        help='the input given to every mplx_qc --shard run')
+    parser.add_argument('shard_outputs', nargs='+', metavar='shard_output',
+                        help='standard output of one mplx_qc --shard run')
+    add_profile_argument(parser)
+    parser.add_argument('-v', '--verbose', action='count')
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s {}'.format(__version__))
+    args = parser.parse_args()
+    return args
+
+
+def config_logging(args):
+    global logger
+    if not args.verbose:
+        level = logging.WARNING
+    elif args.verbose == 1:
+        level = logging.INFO
+    else:
+        level = logging.DEBUG
+    logger = logging.getLogger('mplx_qc_merge')
+    err_handler = logging.StreamHandler()
+    logger.addHandler(err_handler)
+    logger.setLevel(level)
+
+
+def merge_shards(input_file, shard_outputs):
+    """Print the lines of the shard outputs in input order and return the
+    most severe error code, or 1 if the shard outputs do not cover the
+    input."""
+    try:
+        merge_ids = read_merge_ids(Path(input_file))
+    except GrosslyBadError as e:
+        logger.error(e.message)
+        return e.error_code
+    error_code = 0
+    complete = True
+    lines = []
+    trailers = []
+    for shard_output in shard_outputs:
+        logger.debug('reading %s', shard_output)
+        try:
+            shard_lines, trailer = read_shard_output(shard_output, merge_ids)
+        except ValueError as e:
+            logger.error('%s: %s', shard_output, e)
+            return 1
+        lines += shard_lines
+        for index, line in shard_lines:
+            error_code = max(error_code, int(line.split('\t', 1)[0]))
+        if trailer is None:
+            logger.error('%s: no trailer, so the shard did not finish',
+                         shard_output)
+            complete = False
+        else:
+            trailers.append(trailer)
+            error_code = max(error_code, trailer[3])
+    if not check_coverage(trailers, len(merge_ids)):
+        complete = False
+    lines.sort(key=lambda index_line: index_line[0])
+    with stage(OUTPUT_WRITE):
+        sys.stdout.writelines(line for _, line in lines)
+    logger.info('merged %s lines from %s shards',
+                len(lines), len(shard_outputs))
+    if not complete:
+        error_code = max(error_code, 1)
+    return error_code
+
+
+def read_merge_ids(input_path):
+    """Return the list of the merge_ids of the input, in input order."""
+    return [str(record.merge_id) for record in iter_input(input_path)]
+
+
+def read_shard_output(shard_output, merge_ids):
+    """Return ([(input index, line)], trailer) of a shard output, where the
+    lines have their input index removed, and trailer is (I, N, number of
+    records, exit code), or None if the output has none. Raises ValueError
+    if the output is not mplx_qc --shard output of this input."""
+    lines = []
+    trailer = None
+    with open(shard_output) as fin:
+        for line_number, line in enumerate(fin, 1):
+            fields = line.rstrip('\n').split('\t')
+            if trailer is not None:
+                raise ValueError('line {} follows the trailer'.format(
+                    line_number))
+            if fields[0] == SHARD_TRAILER:
+                trailer = parse_trailer(fields)
+                continue
+            try:
+                index = int(fields[-1])
+                in_input = len(fields) == 5 and merge_ids[index] == fields[1]
+            except (IndexError, ValueError):
+                in_input = False
+            if not in_input:
+                raise ValueError('line {}: merge not in input: {}'.format(
+                    line_number, fields[1] if len(fields) > 1 else line))
+            lines.append((index, '\t'.join(fields[:-1]) + '\n'))
+    return lines, trailer
+
+
+def parse_trailer(fields):
+    """Return (I, N, number of records, exit code) of the fields of a
+    trailer line."""
+    try:
+        shard, num_records, error_code = fields[1:]
+        index, count = (int(s) for s in shard.split('/'))
+        return index, count, int(num_records), int(error_code)
+    except ValueError:
+        raise ValueError('bad trailer: {}'.format('\t'.join(fields)))
+
+
+def check_coverage(trailers, num_input_records):
+    """Log what is missing and return False unless trailers are those of
+    all N shards of one run that checked every input record."""
+    ok = True
+    counts = sorted(set(count for _, count, _, _ in trailers))
+    if len(counts) > 1:
+        logger.error('shards of different runs: N is %s',
+                     ', '.join(map(str, counts)))
+        return False
+    indexes = sorted(index for index, _, _, _ in trailers)
+    if counts:
+        expected = list(range(1, counts[0] + 1))
+        if indexes != expected:
+            missing = sorted(set(expected) - set(indexes))
+            duplicates = sorted(set(i for i in indexes
+                                    if indexes.count(i) > 1))
+            if missing:
+                logger.error('missing shards: %s', ', '.join(
+                    '{}/{}'.format(i, counts[0]) for i in missing))
+            if duplicates:
+                logger.error('shards given more than once: %s', ', '.join(
+                    '{}/{}'.format(i, counts[0]) for i in duplicates))
+            ok = False
+    num_checked = sum(num_records for _, _, num_records, _ in trailers)
+    if num_checked != num_input_records:
+        logger.error('the shards checked %s of the %s input records',
+                     num_checked, num_input_records)
+        ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    main()
@@ -6,22 +6,21 @@ Read a master workbook and output an TSV file."""
 # First come standard libraries, in alphabetical order.
 import argparse
 import csv
+from fnmatch import translate
+from functools import partial
 import logging
-import os
 import pprint
 import re
-import sys
-import warnings
 from pathlib import Path
 
-# After a blank line, import third-party libraries.
-import openpyxl
-from openpyxl.cell import Cell
-from openpyxl.styles import Font
-
 # After another blank line, import local libraries.
-
+from .listing import Lister, add_listing_arguments, open_lister
+from .parallel import ordered_map, positive_int
+from .profiling import (FILE_DISCOVERY, OUTPUT_WRITE, WORKBOOK_LOAD,
+                        add_profile_argument, profiled, stage)
 from .version import __version__
+from .workbook import read_columns
+from .worklist import DEFAULT_JOBS
 
 logger = logging.getLogger(__name__)
 
@@ -49,10 +48,43 @@ CRAM_PATTERNS = '*.hgv.cram', 'alignments/*.hgv.cram'
 CRAM_EXT = '.hgv.cram'
 
 
+def compile_patterns(patterns):
+    """Return {directory: regex} for patterns, a sequence of (column, glob
+    patterns relative to merge_path). A file name in directory ('' for
+    merge_path itself) matches its regex if it matches one of the patterns,
+    and then match.lastgroup is the column. As with Path.glob, wildcards
+    match a leading dot too."""
+    alternatives = {}
+    for column, globs in patterns:
+        for glob in globs:
+            directory, _, name_pattern = glob.rpartition('/')
+            alternatives.setdefault(directory, {}).setdefault(
+                column, []).append(translate(name_pattern))
+    return dict(
+        (directory, re.compile('|'.join(
+            '(?P<{}>{})'.format(column, '|'.join(regexes))
+            for column, regexes in columns.items()
+        )))
+        for directory, columns in alternatives.items()
+    )
+
+
+# The files looked for under merge_path, matched in one scan of each
+# directory.
+FILE_MATCHERS = compile_patterns([('json_path', MERGE_EVENT_PATTERNS),
+                                  ('cram_path', CRAM_PATTERNS)])
+
+
 def main():
     args = parse_args()
     config_logging(args)
-    run(args)
+    with profiled(args.profile, 'mplx_worklist'):
+        lister = open_lister(args.listing_cache, args.listing_max_age,
+                             args.manifest, args.prescan, args.jobs)
+        try:
+            run(args, lister)
+        finally:
+            lister.close()
     logging.shutdown()
 
 
@@ -65,8 +97,14 @@ def parse_args():
     )
     parser.add_argument('-o', '--output_file',
                         help='will default to MASTER_mplx.tsv')
+    parser.add_argument('-j', '--jobs', type=positive_int,
+                        default=DEFAULT_JOBS,
+                        help='merge paths searched concurrently, also by '
+                             '--prescan (default: %(default)s)')
+    add_listing_arguments(parser)
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='increase output verbosity')
+    add_profile_argument(parser)
     parser.add_argument('--version', action='version',
                         version='%(prog)s {}'.format(__version__))
     args = parser.parse_args()
@@ -88,89 +126,69 @@ def config_logging(args):
     logger = logging.getLogger('mplx_worklist')
 
 
-def run(args):
+def run(args, lister=None):
     logger.debug('args: %r', args)
     input_file = args.input_file
     output_file = args.output_file
-    process_input(input_file, output_file)
+    process_input(input_file, output_file, lister, args.jobs)
     logger.debug('finished')
 
 
-def process_input(input_file, output_file):
+def process_input(input_file, output_file, lister=None, jobs=1):
     """A docstring should say something about the inputs, operation,
     and any return values. In this case there are no return values,
-    since results are printed to the specified file."""
+    since results are printed to the specified file. The merge paths are
+    searched by jobs threads at once, as in Worklist.run."""
     logger.debug('process_input %s -> %s', input_file, output_file)
-    data = read_input(input_file)
+    with stage(WORKBOOK_LOAD):
+        data = read_input(input_file)
     logger.info('found %s records', len(data))
+    if lister is None:
+        lister = Lister()
     errors = False
-    for record in data:
-        add_file_paths(record)
-        if (record.json_path and record.cram_path):
-            get_new_cram_name(record)
-            detect_legacy_hybrid(record)
-        else:
-            errors = True
+    results = ordered_map(partial(discover_files, lister=lister), data, jobs)
+    try:
+        for record, _ in zip(data, results):
+            if (record.json_path and record.cram_path):
+                get_new_cram_name(record)
+                detect_legacy_hybrid(record)
+            else:
+                errors = True
+    finally:
+        results.close()
+    lister.log_counts()
     pprint.pprint(vars(data[0]))
     if not errors:
-        write_tsv_file(output_file, data)
+        with stage(OUTPUT_WRITE):
+            write_tsv_file(output_file, data)
     else:
         print('ERROR')
 
 
 def read_input(input_file):
     """Return representation of reading master XLSX."""
-    warnings.simplefilter("ignore")
-    wb = openpyxl.load_workbook(filename=input_file)
-    master_worksheet = find_master_worksheet(wb)
-    logger.debug('master worksheet name: %s', master_worksheet.title)
-    row_iter = iter(master_worksheet.rows)
-    header_row = next(row_iter)
-    # Read header row and parse into column names
-    column_names = [c.value for c in header_row]
-    # remove NoneType column names
-    column_names = remove_none_type_col(column_names)
-    if any(it is None for it in column_names):
-        sys.exit('NoneType column name in the middle')
-    # fix bad names
-    column_names = [n.replace('/', '_') for n in column_names]
-    logger.debug('columns: %s', column_names)
-    missing = REQUIRED_INPUT_COLUMN_NAMES_SET - set(column_names)
-    assert not missing, 'missing: {}'.format(sorted(missing))
     data = []
-    for row in row_iter:
+    for values in read_columns(input_file, REQUIRED_INPUT_COLUMN_NAMES,
+                               fix_names=True, key_column='merge_path'):
         record = Generic()
-        for column_name, cell in zip(column_names, row):
-            if column_name in REQUIRED_INPUT_COLUMN_NAMES_SET:
-                value = cell.value
-                setattr(record, column_name, value)
-        if record.merge_path and record.merge_path[0] != '#':
-            data.append(record)
+        vars(record).update(zip(REQUIRED_INPUT_COLUMN_NAMES, values))
+        data.append(record)
     return data
 
 
-def find_master_worksheet(wb):
-    master_worksheet = None
-    for ws in wb:
-        logger.debug('found: %s', ws.title)
-        if ws.title.endswith('_smpls') or ws.title == 'smpls':
-            assert master_worksheet is None, (
-                'ambiguous worksheets: {}, {}'.format(master_worksheet.title,
-                                                      ws.title)
-            )
-            master_worksheet = ws
-    assert master_worksheet, 'no worksheet with correct name'
-    return master_worksheet
+def discover_files(record, lister):
+    """add_file_paths, timed as file discovery."""
+    with stage(FILE_DISCOVERY):
+        add_file_paths(record, lister)
 
 
-def add_file_paths(record):
+def add_file_paths(record, lister):
     """Add the file paths found under merge_path."""
     merge_path = Path(record.merge_path)
     logger.debug("searching: %s", merge_path)
+    found = find_files(merge_path, lister)
     # get json paths
-    hits = sum(
-        (list(merge_path.glob(pat)) for pat in MERGE_EVENT_PATTERNS), []
-    )
+    hits = found['json_path']
     if len(hits) != 1:
         logger.error("{} number of hits: {}".format(merge_path, len(hits)))
         record.json_path = None
@@ -179,7 +197,7 @@ def add_file_paths(record):
         record.json_path = merge_event_path
 
     # get cram paths
-    cram_hits = sum((list(merge_path.glob(pat)) for pat in CRAM_PATTERNS), [])
+    cram_hits = found['cram_path']
     if len(cram_hits) != 1:
         logger.error(
             "{} number of cram_hits: {}".format(merge_path, len(cram_hits))
@@ -192,6 +210,41 @@ def add_file_paths(record):
         record.cram_path = merge_cram_path
 
 
+def find_files(merge_path, lister):
+    """Return {column: [path]} of the files under merge_path matching
+    FILE_MATCHERS. merge_path is listed once, and its subdirectories in
+    FILE_MATCHERS once each if they exist, even as symbolic links.
+    Directories never match, and are told apart by the type in the
+    listing, without a stat."""
+    found = dict((column, []) for column in ('json_path', 'cram_path'))
+    entries = list_entries(lister, merge_path)
+    subdirs = [name for name, _ in entries if name and name in FILE_MATCHERS]
+    for directory in [''] + subdirs:
+        if directory:
+            dir_path = merge_path / directory
+            entries = list_entries(lister, dir_path)
+        else:
+            dir_path = merge_path
+        match = FILE_MATCHERS[directory].match
+        for name, is_dir in entries:
+            if is_dir:
+                continue
+            m = match(name)
+            if m is not None:
+                found[m.lastgroup].append(dir_path / name)
+    return found
+
+
+def list_entries(lister, dir_path):
+    """Return the [(name, is_dir)] of dir_path, or [] if it cannot be
+    listed, as Path.glob would find nothing there."""
+    try:
+        return lister.list_dir(dir_path)
+    except OSError as e:
+        logger.debug('cannot list directory: %s', e)
+        return []
+
+
 def get_new_cram_name(record):
     """new_cram_name = sample_id_nwd_id + "-" + current_cram_name
     new_new_cram_name = sample_id_nwd_id + '.hgv.cram'"""
@@ -204,13 +257,6 @@ def get_new_cram_name(record):
     record.new_cram_name = str(sample_id_nwd_id) + ".hgv.cram"
 
 
-def remove_none_type_col(lst):
-    new_lst = list(lst)
-    while new_lst[-1] == None:
-        new_lst.pop()
-    return new_lst
-
-
 def detect_legacy_hybrid(record):
     """Detecting the case where the JSON is HGV17- but the CRAM is HGV19+.
     Warns if this happens. Should never happen. Then again, we work
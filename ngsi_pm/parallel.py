@@ -0,0 +1,60 @@
+"""Run per-record work in a pool of workers while keeping input order."""
+
+# First come standard libraries, in alphabetical order.
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import sys
+
+
+def ordered_map(func, iterable, jobs=1, executor_class=ThreadPoolExecutor):
+    """Generator that yields func(item) for each item of iterable, in input
+    order. With jobs > 1 the calls run in a pool of jobs workers. At most
+    2 * jobs items are in flight at any time, so iterable is consumed lazily.
+    Closing the generator early cancels the work that has not started."""
+    if jobs <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+    backlog = 2 * jobs
+    pending = deque()
+    with executor_class(max_workers=jobs) as executor:
+        try:
+            for item in iterable:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= backlog:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def process_pool(max_workers):
+    """Return a ProcessPoolExecutor whose workers are started by a fork
+    server rather than forked from this process. Forking a process that runs
+    other threads, like the directory walkers of tree_walk, can leave a
+    child waiting forever on a lock some thread held at the fork. Pass it as
+    the executor_class of ordered_map."""
+    if (sys.version_info < (3, 7)
+            or 'forkserver' not in multiprocessing.get_all_start_methods()):
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('forkserver')
+    )
+
+
+def positive_int(text):
+    """argparse type for options like --jobs."""
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError(
+            'expected a positive integer: {!r}'.format(text)
+        )
+    return value
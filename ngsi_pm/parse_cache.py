@@ -0,0 +1,181 @@
+"""On-disk cache of parsed file contents, such as the RG barcodes and samples
+of a CRAM or the barcodes and samples of a merge definition JSON.
+
+Entries are keyed by kind and absolute path, and are only used while the
+file still has the same inode, size and mtime, so an unchanged file costs a
+stat instead of a parse. The cache is an SQLite database, which takes care of
+locking when several processes, possibly run by different users, share it
+on the same node. Put it on a local disk in a directory writable by everyone
+who shares it, and owned by a group they share, with the setgid bit set so
+new files get that group; connect() makes a new database file writable by
+its group whatever the umask. The least recently used entries are evicted
+once there are more than max_entries."""
+
+# First come standard libraries, in alphabetical order.
+import json
+import logging
+import os
+import sqlite3
+import stat
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bump when the meaning of cached values changes, to ignore old entries.
+FORMAT_VERSION = 1
+DEFAULT_MAX_ENTRIES = 1000000
+EVICTION_INTERVAL = 1000  # number of stores between eviction checks
+TOUCH_INTERVAL = 3600  # seconds before a hit refreshes last_used
+LOCK_TIMEOUT = 60  # seconds to wait for another process to release the lock
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (kind, path)
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+'''
+
+
+class ParseCache:
+    """Cache of parse results, which must be tuples of JSON-serializable
+    values, stored in an SQLite file. One instance may be shared by several
+    threads."""
+
+    def __init__(self, db_path, max_entries=DEFAULT_MAX_ENTRIES):
+        """Raises sqlite3.Error if db_path cannot be opened as a cache."""
+        self.db_path = str(db_path)
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self._stores = 0
+        self._lock = threading.Lock()
+        self._connection = connect(self.db_path, check_same_thread=False)
+        version = self._connection.execute('PRAGMA user_version').fetchone()
+        if version[0] != FORMAT_VERSION:
+            logger.info('clearing parse cache %s', self.db_path)
+            self._connection.executescript(
+                'DROP TABLE IF EXISTS entries;'
+                'PRAGMA user_version={};'.format(FORMAT_VERSION)
+            )
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def fetch(self, kind, path, parse):
+        """Return parse(path), reusing the stored result if the file at path
+        is unchanged since it was stored. Exceptions from parse propagate and
+        nothing is stored, so errors are always reported afresh."""
+        try:
+            stamp = file_stamp(path)
+        except OSError:
+            return parse(path)  # let parse report the problem
+        key = kind, os.path.abspath(str(path))
+        value = self._get(key, stamp)
+        if value is not None:
+            return value
+        value = parse(path)
+        self._put(key, stamp, value)
+        return value
+
+    def _get(self, key, stamp):
+        try:
+            with self._lock:
+                row = self._connection.execute(
+                    'SELECT inode, size, mtime_ns, value, last_used '
+                    'FROM entries WHERE kind = ? AND path = ?', key
+                ).fetchone()
+                if row is None or tuple(row[:3]) != stamp:
+                    self.misses += 1
+                    return None
+                self.hits += 1
+                now = time.time()
+                if now - row[4] > TOUCH_INTERVAL:
+                    self._connection.execute(
+                        'UPDATE entries SET last_used = ? '
+                        'WHERE kind = ? AND path = ?', (now,) + key
+                    )
+        except sqlite3.Error as e:
+            logger.warning('parse cache %s unusable: %s', self.db_path, e)
+            self.misses += 1
+            return None
+        return tuple(json.loads(row[3]))
+
+    def _put(self, key, stamp, value):
+        try:
+            text = json.dumps(value)
+        except TypeError:
+            return  # e.g. contains a sentinel object; just don't cache it
+        try:
+            with self._lock:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO entries '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    key + stamp + (text, time.time())
+                )
+                self._stores += 1
+                if self._stores % EVICTION_INTERVAL == 0:
+                    self._evict()
+        except sqlite3.Error as e:
+            logger.warning('parse cache %s unusable: %s', self.db_path, e)
+
+    def _evict(self):
+        """Delete the least recently used entries beyond max_entries."""
+        count, = self._connection.execute(
+            'SELECT COUNT(*) FROM entries'
+        ).fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            logger.debug('evicting %s entries from %s', excess, self.db_path)
+            self._connection.execute(
+                'DELETE FROM entries WHERE rowid IN ('
+                'SELECT rowid FROM entries ORDER BY last_used LIMIT ?)',
+                (excess,)
+            )
+
+    def evict(self):
+        """Delete the least recently used entries beyond max_entries now."""
+        with self._lock:
+            self._evict()
+
+
+def file_stamp(path):
+    """Return (inode, size, mtime_ns) identifying the contents of path."""
+    st = os.stat(str(path))
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def connect(db_path, check_same_thread=True):
+    """Return an autocommit connection in WAL mode to the SQLite file
+    db_path, creating it readable and writable by its group if missing.
+    SQLite gives the -wal and -shm files the mode of the database, so every
+    user of the group can then write to it. Raises sqlite3.Error if db_path
+    cannot be opened."""
+    db_path = str(db_path)
+    try:
+        fd = os.open(db_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    except OSError:
+        pass  # it exists, or sqlite3 reports why it cannot be created
+    else:
+        try:
+            os.fchmod(fd, stat.S_IMODE(os.fstat(fd).st_mode)
+                      | stat.S_IRGRP | stat.S_IWGRP)
+        finally:
+            os.close(fd)
+    connection = sqlite3.connect(db_path, timeout=LOCK_TIMEOUT,
+                                 isolation_level=None,
+                                 check_same_thread=check_same_thread)
+    try:
+        connection.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
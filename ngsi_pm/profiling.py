@@ -0,0 +1,142 @@
+"""Optional profiling for the console scripts.
+
+Every script accepts --profile DIR. The run is then wrapped in profiled(),
+which writes these files to DIR, named after the script and process id:
+    PROG.PID.prof            cProfile dump, for pstats or snakeviz
+    PROG.PID.pstats.txt      the top functions by cumulative time
+    PROG.PID.tracemalloc.txt the top allocation sites and peak memory
+    PROG.PID.stages.tsv      wall time spent in each stage() of the run
+cProfile and tracemalloc only see the main process, and cProfile only its
+main thread. Stage times also cover worker processes whose work is wrapped
+in worker_stages(). tracemalloc slows everything down, so compare stage
+times between runs that were both profiled. Without
+--profile, stage() still sets up a generator-based context manager, a
+microsecond or two per use, so keep it out of the innermost loops."""
+
+# First come standard libraries, in alphabetical order.
+import contextlib
+import cProfile
+from functools import partial
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+NUM_TOP_FUNCTIONS = 40
+NUM_TOP_ALLOCATIONS = 30
+
+# Stage names shared by the scripts.
+WORKBOOK_LOAD = 'workbook load'
+FILE_DISCOVERY = 'file discovery'
+HEADER_READ = 'subprocess/header read'
+JSON_PARSE = 'JSON parse'
+OUTPUT_WRITE = 'output write'
+
+_stages = None  # stage name -> [seconds, calls], only while profiling
+_stages_lock = threading.Lock()
+
+
+def add_profile_argument(parser):
+    parser.add_argument('--profile', metavar='DIR',
+                        help='write a cProfile dump and a tracemalloc '
+                             'report of the main process, and per-stage '
+                             'wall times including worker processes, to DIR')
+
+
+@contextlib.contextmanager
+def profiled(profile_dir, prog):
+    """Context manager that profiles its body if profile_dir is set."""
+    global _stages
+    if not profile_dir:
+        yield
+        return
+    os.makedirs(profile_dir, exist_ok=True)
+    prefix = os.path.join(profile_dir, '{}.{}'.format(prog, os.getpid()))
+    _stages = {}
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        total = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stages, _stages = _stages, None
+        write_reports(prefix, profiler, snapshot, peak, stages, total)
+        logger.info('profile written to %s.*', prefix)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Context manager that adds the wall time of its body to stage name
+    while profiling. Safe to use from worker threads, where the times of
+    concurrent calls add up."""
+    if _stages is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _stages_lock:
+            totals = _stages.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+
+def worker_stages(func):
+    """Return a picklable function like func for a process pool, but
+    returning (result, stages), where stages holds the stage times of the
+    call if it ran in a worker process while this process was profiling,
+    else None. Pass stages to add_stages() in this process."""
+    return partial(_call_with_stages, func, _stages is not None)
+
+
+def _call_with_stages(func, collect, *args, **kwargs):
+    global _stages
+    if not collect or _stages is not None:
+        # Not profiling, or running in the profiled process itself.
+        return func(*args, **kwargs), None
+    _stages = {}
+    try:
+        result = func(*args, **kwargs)
+        return result, _stages
+    finally:
+        _stages = None
+
+
+def add_stages(stages):
+    """Add the stage times returned by a worker_stages() function."""
+    if stages is None or _stages is None:
+        return
+    with _stages_lock:
+        for name, (seconds, calls) in stages.items():
+            totals = _stages.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += calls
+
+
+def write_reports(prefix, profiler, snapshot, peak, stages, total):
+    profiler.dump_stats(prefix + '.prof')
+    with open(prefix + '.pstats.txt', 'w') as fout:
+        stats = pstats.Stats(profiler, stream=fout)
+        stats.sort_stats('cumulative').print_stats(NUM_TOP_FUNCTIONS)
+    with open(prefix + '.tracemalloc.txt', 'w') as fout:
+        print('peak traced memory: {:.1f} MiB'.format(peak / 2**20),
+              file=fout)
+        for stat in snapshot.statistics('lineno')[:NUM_TOP_ALLOCATIONS]:
+            print(stat, file=fout)
+    with open(prefix + '.stages.tsv', 'w') as fout:
+        print('stage', 'seconds', 'calls', sep='\t', file=fout)
+        for name, (seconds, calls) in sorted(stages.items()):
+            print(name, '{:.6f}'.format(seconds), calls, sep='\t', file=fout)
+        print('total', '{:.6f}'.format(total), 1, sep='\t', file=fout)
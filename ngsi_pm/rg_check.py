@@ -0,0 +1,176 @@
+#! /usr/bin/env python3
+
+"""Check the read groups in the BAM (rg_check) or CRAM (cram_rg_check) files
+of a workbook against the workbook's barcodes and samples.
+
+The smpls worksheet is read once. Its lane_barcode and sample_id_nwd_id
+pairs are grouped by the bam_path or cram_path of their row. The headers of
+those files are read concurrently, and the (barcode, sample) pairs of each
+file's @RG lines, parsed as dump_rgs does, are compared as sets with the
+workbook's. Order does not matter. Each difference is printed as a tab
+separated line:
+    missing PATH BARCODE SAMPLE   in the workbook, not in the header
+    extra   PATH BARCODE SAMPLE   in the header, not in the workbook
+    bad     PATH MESSAGE          the header could not be read
+The exit code is 0 if every file matches, else 1."""
+
+# First come standard libraries, in alphabetical order.
+import argparse
+from collections import OrderedDict
+from functools import partial
+import logging
+import sys
+
+# After another blank line, import local libraries.
+from .dump_rgs import parse_rg_line
+from .hts_header import HeaderError, read_bam_rg_lines
+from .mplx_qc import CRAM_READERS, GrosslyBadError, dump_cram_rgs
+from .parallel import ordered_map, positive_int
+from .profiling import (HEADER_READ, OUTPUT_WRITE, WORKBOOK_LOAD,
+                        add_profile_argument, profiled, stage)
+from .version import __version__
+from .workbook import read_columns
+
+logger = logging.getLogger(__name__)
+
+SHEET_NAME = 'smpls'
+BARCODE_COLUMN = 'lane_barcode'
+SAMPLE_COLUMN = 'sample_id_nwd_id'
+DEFAULT_JOBS = 8
+
+
+def main():
+    """rg_check: check the BAM headers."""
+    check_main('rg_check', 'bam_path')
+
+
+def cram_main():
+    """cram_rg_check: check the CRAM headers."""
+    check_main('cram_rg_check', 'cram_path')
+
+
+def check_main(prog, path_column):
+    args = parse_args(prog, path_column)
+    config_logging(prog, args)
+    with profiled(args.profile, prog):
+        error_code = run(args.input_file, path_column, args.jobs,
+                         args.cram_reader)
+    logging.shutdown()
+    sys.exit(error_code)
+
+
+def parse_args(prog, path_column):
+    parser = argparse.ArgumentParser(
+        prog=prog, description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('input_file', help='an XLSX workbook')
+    parser.add_argument('-j', '--jobs', type=positive_int,
+                        default=DEFAULT_JOBS,
+                        help='headers read concurrently '
+                             '(default: %(default)s)')
+    if path_column == 'cram_path':
+        parser.add_argument('--cram-reader', choices=CRAM_READERS,
+                            default='samtools',
+                            help='read CRAM headers with samtools or the '
+                                 'built-in reader (default: %(default)s)')
+    add_profile_argument(parser)
+    parser.add_argument('-v', '--verbose', action='count')
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s {}'.format(__version__))
+    args = parser.parse_args()
+    if path_column != 'cram_path':
+        args.cram_reader = None
+    return args
+
+
+def config_logging(prog, args):
+    global logger
+    if not args.verbose:
+        level = logging.WARNING
+    elif args.verbose == 1:
+        level = logging.INFO
+    else:
+        level = logging.DEBUG
+    logger = logging.getLogger(prog)
+    err_handler = logging.StreamHandler()
+    logger.addHandler(err_handler)
+    logger.setLevel(level)
+
+
+def run(input_file, path_column, jobs=DEFAULT_JOBS, cram_reader='samtools'):
+    """Print the differences between the workbook and the headers of the
+    files in its path_column, and return the exit code."""
+    try:
+        expected = read_expected_pairs(input_file, path_column)
+    except (AssertionError, KeyError, ValueError) as e:
+        logger.error('%s: %s', input_file, e)
+        return 2
+    logger.info('checking %s files', len(expected))
+    read_pairs = partial(read_header_pairs, cram_reader=cram_reader)
+    results = ordered_map(read_pairs, expected, jobs)
+    error_code = 0
+    try:
+        for path, (found, message) in zip(expected, results):
+            if message is not None:
+                lines = [('bad', path, message)]
+            else:
+                lines = compare_pairs(path, expected[path], found)
+            if lines:
+                error_code = 1
+            with stage(OUTPUT_WRITE):
+                for line in lines:
+                    print(*line, sep='\t')
+    finally:
+        results.close()
+    return error_code
+
+
+def read_expected_pairs(input_file, path_column):
+    """Return an OrderedDict of path -> set of (barcode, sample) pairs from
+    the smpls worksheet, in workbook order. Raises AssertionError if smpls
+    is not the active worksheet, KeyError if it or a column is missing, and
+    ValueError if a row has no path."""
+    expected = OrderedDict()
+    with stage(WORKBOOK_LOAD):
+        for path, barcode, sample in read_columns(
+                input_file, (path_column, BARCODE_COLUMN, SAMPLE_COLUMN),
+                SHEET_NAME):
+            if path is None:
+                raise ValueError('no {} for barcode {}, sample {}'.format(
+                    path_column, barcode, sample))
+            expected.setdefault(str(path), set()).add(
+                (str(barcode), str(sample))
+            )
+    return expected
+
+
+def read_header_pairs(path, cram_reader=None):
+    """Return (set of (barcode, sample) of the @RG lines, None), or
+    (None, message) if the header cannot be read. Reads a CRAM with
+    cram_reader, else a BAM."""
+    try:
+        if cram_reader is not None:
+            rg_lines = dump_cram_rgs(path, cram_reader)
+        else:
+            with stage(HEADER_READ):
+                rg_lines = read_bam_rg_lines(path)
+    except GrosslyBadError as e:
+        return None, e.message
+    except (HeaderError, OSError, UnicodeDecodeError) as e:
+        return None, str(e)
+    try:
+        return set(parse_rg_line(line) for line in rg_lines), None
+    except (AssertionError, AttributeError, KeyError, ValueError):
+        return None, 'bad @RG line'
+
+
+def compare_pairs(path, expected, found):
+    """Return the missing and extra lines for one file, sorted."""
+    lines = [('missing', path) + pair for pair in sorted(expected - found)]
+    lines += [('extra', path) + pair for pair in sorted(found - expected)]
+    return lines
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Write tables of strings as TSV or JSON Lines text, optionally gzip or zstd
+compressed, or as Parquet with dictionary-encoded columns.
+
+Rows are turned into text by format_rows(), which may run in a worker
+process, and written in bulk by the writer from open_writer(). zstd needs the
+zstandard package and Parquet needs pyarrow; check_available() says whether
+they are installed."""
+
+# First come standard libraries, in alphabetical order.
+import gzip
+import json
+import os
+import sys
+
+# After a blank line, import third-party libraries.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+OUTPUT_FORMATS = 'tsv', 'jsonl', 'parquet'
+COMPRESSIONS = 'gzip', 'zstd'
+SUFFIX_COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+PARQUET_ROW_GROUP_SIZE = 250000
+
+
+def check_available(output_format, compression):
+    """Return an error message if the libraries needed for output_format and
+    compression are missing, else None."""
+    if output_format == 'parquet' and pyarrow is None:
+        return 'parquet output needs pyarrow, which is not installed'
+    if (compression == 'zstd' and output_format != 'parquet'
+            and zstandard is None):
+        return 'zstd compression needs zstandard, which is not installed'
+    return None
+
+
+def guess_compression(output_path):
+    """Return the compression implied by the suffix of output_path."""
+    if output_path is None:
+        return None
+    return SUFFIX_COMPRESSIONS.get(os.path.splitext(output_path)[1])
+
+
+def format_rows(rows, columns, output_format):
+    """Return rows, a list of tuples of str, in the form the writer of
+    output_format takes: text for tsv and jsonl, the rows for parquet."""
+    if output_format == 'tsv':
+        return ''.join('\t'.join(row) + '\n' for row in rows)
+    if output_format == 'jsonl':
+        return ''.join(json.dumps(dict(zip(columns, row))) + '\n'
+                       for row in rows)
+    return rows
+
+
+def open_writer(output_path, output_format, columns, compression=None,
+                dictionary_columns=()):
+    """Return a writer of formatted rows to output_path, or stdout if it is
+    None. It has write(formatted_rows) and close()."""
+    if output_format == 'parquet':
+        return ParquetWriter(output_path, columns, compression,
+                             dictionary_columns)
+    return TextWriter(output_path, compression)
+
+
+class TextWriter:
+    """Writes text, compressed by gzip or zstd if compression is set."""
+
+    def __init__(self, output_path, compression=None):
+        self._text = self._file = self._compressor = None
+        if output_path is None and compression is None:
+            self._text = sys.stdout
+            return
+        if output_path is None:
+            binary = sys.stdout.buffer
+        else:
+            binary = self._file = open(output_path, 'wb')
+        if compression == 'gzip':
+            binary = self._compressor = gzip.GzipFile(fileobj=binary,
+                                                      mode='wb')
+        elif compression == 'zstd':
+            binary = self._compressor = (
+                zstandard.ZstdCompressor().stream_writer(binary,
+                                                         closefd=False)
+            )
+        self._binary = binary
+
+    def write(self, text):
+        if self._text is not None:
+            self._text.write(text)
+        else:
+            self._binary.write(text.encode())
+
+    def close(self):
+        if self._text is not None:
+            self._text.flush()
+            return
+        if self._compressor is not None:
+            self._compressor.close()  # ends the compressed stream
+        if self._file is not None:
+            self._file.close()
+        else:
+            sys.stdout.buffer.flush()
+
+
+class ParquetWriter:
+    """Writes rows to a Parquet file, in row groups of up to
+    PARQUET_ROW_GROUP_SIZE rows. The dictionary_columns, typically ones with
+    few distinct values like sample and reference, are dictionary encoded,
+    and read back as categoricals by pandas."""
+
+    def __init__(self, output_path, columns, compression=None,
+                 dictionary_columns=()):
+        fields = [
+            pyarrow.field(name, pyarrow.dictionary(pyarrow.int32(),
+                                                   pyarrow.string())
+                          if name in dictionary_columns else pyarrow.string())
+            for name in columns
+        ]
+        self._schema = pyarrow.schema(fields)
+        sink = sys.stdout.buffer if output_path is None else output_path
+        self._writer = pyarrow.parquet.ParquetWriter(
+            sink, self._schema, compression=compression or 'snappy'
+        )
+        self._rows = []
+
+    def write(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        arrays = [
+            pyarrow.array(column, type=pyarrow.string())
+            for column in zip(*self._rows)
+        ]
+        arrays = [
+            array.dictionary_encode()
+            if pyarrow.types.is_dictionary(field.type) else array
+            for array, field in zip(arrays, self._schema)
+        ]
+        self._writer.write_table(
+            pyarrow.Table.from_arrays(arrays, schema=self._schema)
+        )
+        self._rows = []
@@ -0,0 +1,77 @@
+"""Find files by name in a directory tree, reading directories in parallel.
+
+On network file systems most of the time of a tree walk is spent waiting for
+directory listings, so find_files() keeps several listings in flight in a
+thread pool while it yields results in a deterministic order: depth first,
+the files of a directory before its subdirectories, each sorted by name.
+walk() yields every directory in that order, for callers that want the
+whole tree."""
+
+# First come standard libraries, in alphabetical order.
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 8
+
+
+def find_files(root, names, jobs=DEFAULT_JOBS, prune=True):
+    """Generator of the paths of files under root whose name is in names.
+    With prune, the subdirectories of a directory holding a match are not
+    searched. Symbolic links to directories are not followed. Directories
+    that cannot be read are logged and skipped, like find does."""
+    names = frozenset(names)
+    for _, files, subdirs in walk(root, jobs):
+        matches = [path for name, path in files if name in names]
+        yield from matches
+        if matches and prune:
+            subdirs.clear()
+
+
+def walk(root, jobs=DEFAULT_JOBS):
+    """Generator of (path, files, subdirs) for each directory under root, as
+    returned by scan_dir(), depth first. Like os.walk, clearing or removing
+    from subdirs before the next iteration skips those subdirectories."""
+    prefetch = 2 * jobs
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # The directories still to search, the next one last, each with the
+        # future of its listing once that has been submitted.
+        stack = [[str(root), None]]
+        try:
+            while stack:
+                for item in stack[-prefetch:]:
+                    if item[1] is None:
+                        item[1] = executor.submit(scan_dir, item[0])
+                path, future = stack.pop()
+                files, subdirs = future.result()
+                yield path, files, subdirs
+                stack.extend([subdir, None] for subdir in reversed(subdirs))
+        finally:
+            for _, future in stack:
+                if future is not None:
+                    future.cancel()
+
+
+def scan_dir(path):
+    """Return ([(name, path)] of non-directories, [path] of subdirectories),
+    both sorted by name."""
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    subdirs.append(entry.path)
+                else:
+                    files.append((entry.name, entry.path))
+    except OSError as e:
+        logger.warning('cannot read directory: %s', e)
+    files.sort()
+    subdirs.sort()
+    return files, subdirs
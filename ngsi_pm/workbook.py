@@ -0,0 +1,288 @@
+"""Stream the rows of a master worksheet as plain values.
+
+The workbook is opened read-only, so openpyxl parses rows as they are read
+instead of building a styled cell object for every cell up front. The header
+is resolved once, and read_columns() yields only the requested columns, so a
+tool that needs a few columns of a wide 100k-row master pays for little more
+than those.
+
+Setting NGSI_PM_WORKBOOK_CACHE to a directory turns on a cache of worksheets
+there. The first read of a worksheet also writes its values to a sidecar
+file, named after the SHA-256 of the workbook's contents, and later reads of
+the same workbook by any tool stream the sidecar instead of parsing XML.
+Changing the workbook changes its hash, so stale sidecars are never read;
+they can be deleted at any time."""
+
+# First come standard libraries, in alphabetical order.
+import datetime
+import hashlib
+import logging
+import marshal
+import os
+import struct
+import tempfile
+import warnings
+import zlib
+
+# After a blank line, import third-party libraries.
+import openpyxl
+
+logger = logging.getLogger(__name__)
+
+MASTER_SHEET_NAME = 'smpls'
+MASTER_SHEET_SUFFIX = '_smpls'
+
+CACHE_VARIABLE = 'NGSI_PM_WORKBOOK_CACHE'
+# Bump when the sidecar format changes; the version is part of the file name.
+CACHE_FORMAT_VERSION = 1
+CACHE_CHUNK_ROWS = 4096
+CHUNK_LENGTH = struct.Struct('>I')  # of each compressed chunk; 0 ends the file
+HASH_BLOCK_SIZE = 1 << 20
+# Cells marshal cannot store are stored as (type name, components).
+# openpyxl never returns tuples as cell values, so these are unambiguous.
+CELL_TYPES = {
+    'datetime': datetime.datetime,
+    'date': datetime.date,
+    'time': datetime.time,
+    'timedelta': datetime.timedelta,
+}
+
+
+def load_workbook(input_file, data_only=False):
+    """Open input_file read-only. With data_only, formulas are read as their
+    cached values. Close it with close()."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # data validation, header/footer
+        return openpyxl.load_workbook(str(input_file), read_only=True,
+                                      data_only=data_only)
+
+
+def find_worksheet(wb, sheet_name=None):
+    """Return the worksheet named sheet_name, which must be the active one,
+    or if sheet_name is None the only master worksheet, named smpls or
+    ending in _smpls."""
+    if sheet_name is not None:
+        sheet = wb[sheet_name]
+        active_sheet = wb.active
+        assert sheet.title == active_sheet.title, (sheet.title,
+                                                   active_sheet.title)
+        return sheet
+    master_worksheet = None
+    for ws in wb:
+        if (ws.title.endswith(MASTER_SHEET_SUFFIX)
+                or ws.title == MASTER_SHEET_NAME):
+            assert master_worksheet is None, (
+                'ambiguous worksheets: {}, {}'.format(master_worksheet.title,
+                                                      ws.title)
+            )
+            master_worksheet = ws
+    assert master_worksheet, 'no worksheet with correct name'
+    return master_worksheet
+
+
+def generate_sheet_rows(input_file, sheet_name=None, data_only=False):
+    """Generator of the header and then the rows of the worksheet picked by
+    find_worksheet(), as tuples of cell values. The header is () if the
+    worksheet is empty. Uses the cache in $NGSI_PM_WORKBOOK_CACHE if set."""
+    cache_dir = os.environ.get(CACHE_VARIABLE)
+    cache_path = None
+    if cache_dir:
+        try:
+            cache_path = sidecar_path(cache_dir, input_file, sheet_name,
+                                      data_only)
+        except OSError:
+            pass  # let load_workbook report the problem
+    if cache_path is None:
+        yield from generate_workbook_rows(input_file, sheet_name, data_only)
+        return
+    try:
+        fin = open(cache_path, 'rb')
+    except OSError:
+        logger.debug('workbook cache miss: %s', cache_path)
+        rows = generate_workbook_rows(input_file, sheet_name, data_only)
+        yield from write_sidecar(cache_path, rows)
+        return
+    logger.debug('workbook cache hit: %s', cache_path)
+    with fin:
+        yield from read_sidecar(fin, cache_path)
+
+
+def generate_workbook_rows(input_file, sheet_name=None, data_only=False):
+    """generate_sheet_rows() from the workbook itself."""
+    wb = load_workbook(input_file, data_only)
+    try:
+        row_iter = find_worksheet(wb, sheet_name).iter_rows(values_only=True)
+        yield next(row_iter, ())
+        yield from row_iter
+    finally:
+        wb.close()
+
+
+def sidecar_path(cache_dir, input_file, sheet_name=None, data_only=False):
+    """Return the path in cache_dir of the sidecar of the worksheet."""
+    digest = hashlib.sha256()
+    with open(str(input_file), 'rb') as fin:
+        for block in iter(lambda: fin.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    name = '{}.{}.{}.v{}.rows'.format(
+        digest.hexdigest(),
+        'master' if sheet_name is None else 'sheet-' + sheet_name,
+        'values' if data_only else 'cells',
+        CACHE_FORMAT_VERSION
+    )
+    return os.path.join(cache_dir, name)
+
+
+def write_sidecar(cache_path, rows):
+    """Generator of rows that also writes them to the sidecar at
+    cache_path, which only appears once every row has been read. If the
+    sidecar cannot be written, the rows are still generated."""
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    except OSError as e:
+        logger.warning('workbook cache %s unusable: %s', cache_dir, e)
+        yield from rows
+        return
+    fout = os.fdopen(fd, 'wb')
+    chunk = []
+    try:
+        for row in rows:
+            yield row
+            if fout is None:
+                continue
+            chunk.append(row)
+            if len(chunk) == CACHE_CHUNK_ROWS:
+                fout = _write_chunk(fout, chunk, temp_path)
+                chunk = []
+        if fout is not None:
+            fout = _write_chunk(fout, chunk, temp_path)
+        if fout is not None:
+            fout.write(CHUNK_LENGTH.pack(0))
+            fout.close()
+            fout = None
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, cache_path)
+            temp_path = None
+    finally:
+        rows.close()
+        if fout is not None:
+            fout.close()
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _write_chunk(fout, chunk, temp_path):
+    """Write chunk to fout and return fout, or close it and return None if
+    it cannot be written."""
+    if not chunk:
+        return fout
+    try:
+        try:
+            data = marshal.dumps((False, chunk))
+        except ValueError:
+            data = marshal.dumps((True, [tuple(encode_cell(value)
+                                               for value in row)
+                                         for row in chunk]))
+        data = zlib.compress(data)
+        fout.write(CHUNK_LENGTH.pack(len(data)))
+        fout.write(data)
+        return fout
+    except ValueError:
+        logger.debug('workbook cache: cannot store the cells of %s',
+                     temp_path)  # just don't cache it
+    except OSError as e:
+        logger.warning('workbook cache %s unusable: %s', temp_path, e)
+    fout.close()
+    return None
+
+
+def encode_cell(value):
+    """Return value, or (type name, components) if it is a date or time."""
+    if isinstance(value, datetime.datetime):
+        return 'datetime', (value.year, value.month, value.day, value.hour,
+                            value.minute, value.second, value.microsecond)
+    if isinstance(value, datetime.date):
+        return 'date', (value.year, value.month, value.day)
+    if isinstance(value, datetime.time):
+        return 'time', (value.hour, value.minute, value.second,
+                        value.microsecond)
+    if isinstance(value, datetime.timedelta):
+        return 'timedelta', (value.days, value.seconds, value.microseconds)
+    return value
+
+
+def decode_cell(value):
+    """Inverse of encode_cell()."""
+    if type(value) is tuple:
+        type_name, components = value
+        return CELL_TYPES[type_name](*components)
+    return value
+
+
+def read_sidecar(fin, cache_path):
+    """Generator of the rows stored in a sidecar."""
+    while True:
+        prefix = fin.read(CHUNK_LENGTH.size)
+        if len(prefix) != CHUNK_LENGTH.size:
+            raise ValueError('truncated workbook cache: {}'.format(cache_path))
+        length, = CHUNK_LENGTH.unpack(prefix)
+        if length == 0:
+            return
+        data = fin.read(length)
+        if len(data) != length:
+            raise ValueError('truncated workbook cache: {}'.format(cache_path))
+        encoded, chunk = marshal.loads(zlib.decompress(data))
+        if encoded:
+            chunk = [tuple(decode_cell(value) for value in row)
+                     for row in chunk]
+        yield from chunk
+
+
+def fix_column_name(name):
+    """sample_id/nwd_id -> sample_id_nwd_id"""
+    return name.replace('/', '_')
+
+
+def column_indexes(header, columns, fix_names=False):
+    """Return the index in header of each name in columns. With fix_names,
+    header names are matched after fix_column_name(). Raises KeyError
+    naming the missing columns."""
+    indexes = {}
+    for i, name in enumerate(header):
+        if name is None:
+            continue
+        name = str(name)
+        if fix_names:
+            name = fix_column_name(name)
+        indexes.setdefault(name, i)
+    missing = [name for name in columns if name not in indexes]
+    if missing:
+        raise KeyError('missing columns: {}'.format(sorted(missing)))
+    return [indexes[name] for name in columns]
+
+
+def read_columns(input_file, columns, sheet_name=None, fix_names=False,
+                 key_column=None, data_only=False):
+    """Generator of tuples of the values in columns of each row of the
+    worksheet picked by find_worksheet(). Blank rows are skipped. With
+    key_column, so are the rows whose key_column is empty or starts with
+    '#', which comments a row out."""
+    rows = generate_sheet_rows(input_file, sheet_name, data_only)
+    try:
+        indexes = column_indexes(next(rows), columns, fix_names)
+        width = max(indexes, default=-1) + 1
+        key = None if key_column is None else columns.index(key_column)
+        for row in rows:
+            if len(row) < width:
+                row += (None,) * (width - len(row))
+            values = tuple(row[i] for i in indexes)
+            if key is not None:
+                value = values[key]
+                if not value or str(value).startswith('#'):
+                    continue
+            elif all(value is None for value in row):
+                continue
+            yield values
+    finally:
+        rows.close()
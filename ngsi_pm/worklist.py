@@ -0,0 +1,272 @@
+"""The engine of the XLSX worklists, such as cram_worklist and
+globus_worklist.
+
+Each worklist is a Worklist spec: the columns it reads from the master
+worksheet, the Rules that find files under each row's result_path, the names
+derived from those, and the suffix of the output workbook. run() reads the
+master, adds the files found for every row, and writes the input columns
+followed by the added ones to a new workbook with a smpls worksheet.
+
+The directories of the rows are listed by --jobs threads at once, since on
+network file systems a listing mostly waits on the server. If any cannot be
+listed, or lack a file, all of the problems are logged and nothing is
+written. With --listing-cache, listings of unchanged directories are reused
+from earlier runs, and with --manifest or --prescan all listings come from
+one index of the tree built up front; see listing.py."""
+
+# First come standard libraries, in alphabetical order.
+import argparse
+from functools import partial
+import logging
+import os
+import pprint
+import sys
+
+# After a blank line, import third-party libraries.
+import openpyxl
+
+# After another blank line, import local libraries.
+from .listing import Lister, add_listing_arguments, open_lister
+from .parallel import ordered_map, positive_int
+from .profiling import (FILE_DISCOVERY, OUTPUT_WRITE, WORKBOOK_LOAD,
+                        add_profile_argument, profiled, stage)
+from .version import __version__
+from .workbook import read_columns
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMN = 'result_path'  # rows with an empty or #-commented one are skipped
+OUTPUT_SHEET_NAME = 'smpls'
+DEFAULT_JOBS = 8
+
+
+class Rule:
+    """Find the file whose name ends with suffix in directory, relative to
+    result_path, and put its name in name_column and its path in
+    path_column, either of which may be None. If several files match, the
+    last one listed wins. A file matches at most the first of the rules of
+    its directory."""
+
+    def __init__(self, directory, suffix, name_column=None, path_column=None):
+        self.directory = directory
+        self.suffix = suffix
+        self.name_column = name_column
+        self.path_column = path_column
+
+    @property
+    def columns(self):
+        return [c for c in (self.name_column, self.path_column)
+                if c is not None]
+
+
+class Worklist:
+    """The spec of a worklist.
+
+    input_columns are read from the master and output first, in this order.
+    With fix_names, / in the master's column names is read as _. rules find
+    files under result_path, and output_columns are output after the input
+    columns. derived is a sequence of (column, template) formatted with the
+    record's columns after the files are found, like
+    ('new_bam_name', '{sample_id_nwd_id}-{current_bam_name}'). The output
+    of X.xlsx defaults to X + output_suffix."""
+
+    def __init__(self, name, description, input_columns, rules,
+                 output_columns, output_suffix, derived=(), fix_names=False):
+        self.name = name
+        self.description = description
+        self.input_columns = list(input_columns)
+        self.rules = list(rules)
+        self.output_columns = list(output_columns)
+        self.output_suffix = output_suffix
+        self.derived = list(derived)
+        self.fix_names = fix_names
+        assert KEY_COLUMN in self.input_columns, self.input_columns
+        # The directories to list, parents before their subdirectories,
+        # else in the order of their first rule.
+        self.directories = []
+        for rule in self.rules:
+            if rule.directory not in self.directories:
+                self.directories.append(rule.directory)
+        self.directories.sort(key=depth)
+
+    @property
+    def header(self):
+        return self.input_columns + self.output_columns
+
+    def main(self):
+        args = self.parse_args()
+        self.config_logging(args)
+        with profiled(args.profile, self.name):
+            lister = open_lister(args.listing_cache, args.listing_max_age,
+                                 args.manifest, args.prescan, args.jobs)
+            try:
+                error_code = self.run(args.input_file, args.output_file,
+                                      args.jobs, lister)
+            finally:
+                lister.close()
+        logging.shutdown()
+        sys.exit(error_code)
+
+    def parse_args(self):
+        parser = argparse.ArgumentParser(description=self.description)
+        parser.add_argument(
+            'input_file',
+            help='an XLSX workbook containing a master worklist '
+                 'in the smpls or *_smpls worksheet'
+        )
+        parser.add_argument('-o', '--output_file',
+                            help='will default to MASTER{}'.format(
+                                self.output_suffix))
+        parser.add_argument('-j', '--jobs', type=positive_int,
+                            default=DEFAULT_JOBS,
+                            help='directories listed concurrently, also by '
+                                 '--prescan (default: %(default)s)')
+        add_listing_arguments(parser)
+        parser.add_argument('-v', '--verbose', action='store_true',
+                            help='increase output verbosity')
+        add_profile_argument(parser)
+        parser.add_argument('--version', action='version',
+                            version='%(prog)s {}'.format(__version__))
+        args = parser.parse_args()
+        if args.output_file is None:
+            args.output_file = self.munge_input_file_name(args.input_file)
+        return args
+
+    def munge_input_file_name(self, input_file_name):
+        """X.xlsx -> X + output_suffix"""
+        assert input_file_name.endswith('.xlsx')
+        return input_file_name[:-5] + self.output_suffix
+
+    def config_logging(self, args):
+        global logger
+        level = logging.DEBUG if args.verbose else logging.INFO
+        logging.basicConfig(level=level)
+        logger = logging.getLogger(self.name)
+
+    def run(self, input_file, output_file, jobs=1, lister=None):
+        """Write the worklist of input_file to output_file, listing
+        directories with lister, and return the exit code: 1 if a directory
+        could not be listed or a file was not found, when nothing is written,
+        else 0."""
+        if lister is None:
+            lister = Lister()
+        logger.debug('process_input %s -> %s', input_file, output_file)
+        with stage(WORKBOOK_LOAD):
+            data = self.read_input(input_file)
+        logger.info('found %s records', len(data))
+        error_code = 0
+        results = ordered_map(partial(self.list_directories, lister=lister),
+                              [record.result_path for record in data], jobs)
+        try:
+            for record, (listings, errors) in zip(data, results):
+                for message in errors:
+                    logger.error('cannot list directory: %s', message)
+                    error_code = 1
+                missing = self.add_file_paths(record, listings)
+                if missing:
+                    logger.error('%s: found no %s', record.result_path,
+                                 ', '.join(missing))
+                    error_code = 1
+                if not (errors or missing):
+                    self.add_derived_names(record)
+        finally:
+            results.close()
+        lister.log_counts()
+        if data:
+            pprint.pprint(vars(data[0]))
+        if error_code:
+            logger.error('not writing %s', output_file)
+            return error_code
+        with stage(OUTPUT_WRITE):
+            self.write_workbook(output_file, data)
+        logger.debug('finished')
+        return 0
+
+    def read_input(self, input_file):
+        """Return the records of the master, with the input_columns as
+        attributes."""
+        data = []
+        for values in read_columns(input_file, self.input_columns,
+                                   fix_names=self.fix_names,
+                                   key_column=KEY_COLUMN):
+            record = Generic()
+            vars(record).update(zip(self.input_columns, values))
+            data.append(record)
+        return data
+
+    def list_directories(self, result_path, lister):
+        """Return ({directory: [file name]}, [error message]) for the
+        directories of the rules under result_path. The subdirectories of a
+        directory that cannot be listed are not tried, so each problem is
+        reported once. Runs in the worker threads."""
+        logger.debug('searching: %s', result_path)
+        listings = {}
+        errors = []
+        failed = []
+        with stage(FILE_DISCOVERY):
+            for directory in self.directories:
+                if any(is_within(directory, f) for f in failed):
+                    continue
+                try:
+                    entries = lister.list_dir(
+                        os.path.join(str(result_path), directory)
+                    )
+                except OSError as e:
+                    errors.append(str(e))
+                    failed.append(directory)
+                else:
+                    listings[directory] = [name for name, _ in entries]
+        return listings, errors
+
+    def add_file_paths(self, record, listings):
+        """Add the file names and paths found in listings, from
+        list_directories(record.result_path). Return the columns of the
+        rules of the listed directories that matched no file."""
+        found = set()
+        for directory, file_names in listings.items():
+            rules = [rule for rule in self.rules
+                     if rule.directory == directory]
+            dir_path = os.path.join(str(record.result_path), directory)
+            for file_name in file_names:
+                for rule in rules:
+                    if file_name.endswith(rule.suffix):
+                        if rule.name_column is not None:
+                            setattr(record, rule.name_column, file_name)
+                        if rule.path_column is not None:
+                            setattr(record, rule.path_column,
+                                    os.path.join(dir_path, file_name))
+                        found.add(rule)
+                        break
+        return [column for rule in self.rules
+                if rule not in found and rule.directory in listings
+                for column in rule.columns]
+
+    def add_derived_names(self, record):
+        for column, template in self.derived:
+            setattr(record, column, template.format(**vars(record)))
+
+    def write_workbook(self, output_file, data):
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(OUTPUT_SHEET_NAME)
+        header = self.header
+        ws.append(header)
+        for record in data:
+            ws.append([getattr(record, name) for name in header])
+        wb.save(output_file)
+
+
+def depth(directory):
+    """The number of levels of directory below result_path, which is ''."""
+    return directory.count('/') + 1 if directory else 0
+
+
+def is_within(directory, parent):
+    """Whether directory is parent or below it, both relative to
+    result_path."""
+    return (not parent or directory == parent
+            or directory.startswith(parent + '/'))
+
+
+class Generic:
+    """Nothing special. Just a class to create objects with __dict__."""
+    pass
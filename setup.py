@@ -20,6 +20,13 @@ REQUIREMENTS = [
     "openpyxl"
 ]
 
+# Optional speedups, e.g. pip install ngsi-pm[orjson]
+EXTRA_REQUIREMENTS = {
+    "orjson": ["orjson"],
+    "parquet": ["pyarrow"],
+    "zstd": ["zstandard"],
+}
+
 TEST_REQUIREMENTS = [
     "pytest==3.0.7",
 ]
@@ -47,21 +54,27 @@ setup(
     ],
     packages=find_packages(exclude=["contrib", "docs", "tests"]),
     install_requires=REQUIREMENTS,
+    extras_require=EXTRA_REQUIREMENTS,
     tests_require=TEST_REQUIREMENTS,
     setup_requires=SETUP_REQUIREMENTS,
     entry_points={
         "console_scripts": [
             "annotate_worklist=ngsi_pm.annotate_worklist:main",
+            "barcode_index=ngsi_pm.barcode_index:main",
+            "cram_rg_check=ngsi_pm.rg_check:cram_main",
             "cram_worklist=ngsi_pm.cram_worklist:main",
             "dump_js_barcodes=ngsi_pm.dump_js_barcodes:main",
             "dump_rgs=ngsi_pm.dump_rgs:main",
             "dump_xl_bam_paths=ngsi_pm.dump_xl_bam_paths:main",
             "dump_xl_barcodes=ngsi_pm.dump_xl_barcodes:main",
+            "dump_xl_columns=ngsi_pm.dump_xl_columns:main",
             "dump_xl_cram_paths=ngsi_pm.dump_xl_cram_paths:main",
             "globus_worklist=ngsi_pm.globus_worklist:main",
             "gmkf_worklist=ngsi_pm.gmkf_worklist:main",
             "mplx_qc=ngsi_pm.mplx_qc:main",
+            "mplx_qc_merge=ngsi_pm.mplx_qc_merge:main",
             "mplx_worklist=ngsi_pm.mplx_worklist:main",
+            "rg_check=ngsi_pm.rg_check:main",
             "topmed_worklist=ngsi_pm.topmed_worklist:main",
             "vcf_worklist=ngsi_pm.vcf_worklist:main"
         ],
@@ -0,0 +1,82 @@
+import json
+import os
+from subprocess import run, DEVNULL, PIPE
+
+import pytest
+
+from ngsi_pm.barcode_index import BarcodeIndex, split_barcode
+
+
+def test_split_barcode():
+    assert split_barcode('HC5W5CCXY-3-IDDUI040') == ('HC5W5CCXY', 3,
+                                                     'IDDUI040')
+    assert split_barcode('HC5W5CCXY-3-A-B') == ('HC5W5CCXY', 3, 'A-B')
+    assert split_barcode('HC5W5CCXY-X-IDDUI040') == (None, None, None)
+    assert split_barcode('odd') == (None, None, None)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_build_and_query(tmpdir, jobs):
+    paths = [write_merge(tmpdir, 'm1', 'S1', ['FC1-1-A', 'FC1-2-B']),
+             write_merge(tmpdir, 'm2', 'S2', ['FC1-1-C', 'FC2-1-A'])]
+    index = BarcodeIndex(str(tmpdir.join('index.sqlite')))
+    assert index.build(paths, jobs=jobs) == 0
+    assert index.query(flowcell='FC1', lane=1) == [
+        ('FC1-1-A', 'S1', 'm1', 'hg38', paths[0]),
+        ('FC1-1-C', 'S2', 'm2', 'hg38', paths[1]),
+    ]
+    assert [r[0] for r in index.query(index='A')] == ['FC1-1-A', 'FC2-1-A']
+    assert [r[0] for r in index.query(barcode='FC2-1-A')] == ['FC2-1-A']
+    assert [r[0] for r in index.query(sample='S1', merge='m1')] == \
+        ['FC1-1-A', 'FC1-2-B']
+    assert index.query(sample='S1', merge='m2') == []
+    index.close()
+
+
+def test_build_is_incremental(tmpdir, caplog):
+    paths = [write_merge(tmpdir, 'm1', 'S1', ['FC1-1-A']),
+             write_merge(tmpdir, 'm2', 'S2', ['FC1-1-B'])]
+    db_path = str(tmpdir.join('index.sqlite'))
+    index = BarcodeIndex(db_path)
+    index.build(paths)
+    index.close()
+    # Change one JSON, with a different mtime, and break another.
+    write_merge(tmpdir, 'm1', 'S1', ['FC1-1-A', 'FC1-2-A'])
+    st = os.stat(paths[0])
+    os.utime(paths[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    paths.append(str(tmpdir.join('bad', 'event.json')))
+    tmpdir.join('bad', 'event.json').write('{', ensure=True)
+    index = BarcodeIndex(db_path)
+    caplog.set_level('INFO')
+    assert index.build(paths) == 1
+    assert 'indexed 1 of 3 merge definitions' in caplog.text
+    assert 'cannot index {}'.format(paths[2]) in caplog.text
+    assert [r[0] for r in index.query()] == ['FC1-1-A', 'FC1-2-A', 'FC1-1-B']
+    # Without prune, merges not given are kept; with prune, dropped.
+    index.build(paths[1:2])
+    assert len(index.query()) == 3
+    index.build(paths[1:2], prune=True)
+    assert [r[0] for r in index.query()] == ['FC1-1-B']
+    index.close()
+
+
+def write_merge(tmpdir, merge_id, sample, barcodes):
+    json_path = tmpdir.join(merge_id, 'event.json')
+    json_path.write(json.dumps({
+        'event_id': merge_id,
+        'library_name': merge_id,
+        'sequencing_events': {
+            bc: {'event_id': bc, 'sample_name': sample, 'reference': 'hg38'}
+            for bc in barcodes
+        },
+    }), ensure=True)
+    return str(json_path)
+
+
+def test_unusable_index(tmpdir):
+    cp = run(['barcode_index', 'query', str(tmpdir.join('nowhere', 'x.db')),
+              '--lane', '7'],
+             stdin=DEVNULL, stdout=PIPE, stderr=PIPE, universal_newlines=True,
+             timeout=60)
+    assert (cp.returncode, cp.stdout) == (1, '')
+    assert 'cannot use index' in cp.stderr
@@ -0,0 +1,174 @@
+import gzip
+import io
+from json import JSONDecodeError
+import json
+import os
+from pathlib import Path
+import shutil
+
+import pytest
+
+from ngsi_pm import dump_js_barcodes
+from ngsi_pm.dump_js_barcodes import Merge
+from ngsi_pm.parallel import process_pool
+
+current_path = Path(__file__).resolve()
+JSON_BASE = current_path.parent.parent / 'mplx_qc' / 'resources'
+JSON_PATHS = sorted(str(p) for p in JSON_BASE.glob('json_*/*_*.json'))
+JSON_PARSERS = [
+    p for p in dump_js_barcodes.JSON_PARSERS
+    if p != 'orjson' or dump_js_barcodes.orjson is not None
+]
+
+
+@pytest.mark.parametrize('json_parser', JSON_PARSERS)
+def test_parsers_agree_on_legacy_json(json_parser):
+    for json_path in JSON_PATHS:
+        assert summarize(Merge(json_path, json_parser)) == \
+            summarize(Merge(json_path, 'json'))
+
+
+@pytest.mark.parametrize('json_parser', JSON_PARSERS)
+def test_hgv_19_json(tmpdir, json_parser):
+    json_path = tmpdir.join('event.json')
+    json_path.write(json.dumps({
+        'event_id': 'M1',
+        'library_name': 'L1',
+        'path': '/some/where',
+        'sequencing_events': {
+            bc: {'event_id': bc, 'sample_name': 'NWD1', 'reference': 'hg38',
+                 'fastq1': '/fastq/' + bc, 'metrics': {'q': [30.5, None]},
+                 'score': float('nan')}
+            for bc in ('FC1-1-A', 'FC1-2-A')
+        },
+    }))
+    merge = Merge(str(json_path), json_parser)
+    assert summarize(merge) == (
+        'M1', 'L1', 'NWD1', 'hg38',
+        [('FC1-1-A', 'NWD1', 'hg38'), ('FC1-2-A', 'NWD1', 'hg38')]
+    )
+
+
+@pytest.mark.parametrize('json_parser', JSON_PARSERS)
+def test_invalid_json(json_parser):
+    with pytest.raises(JSONDecodeError):
+        Merge(str(JSON_BASE / 'json_bad' / 'invalid.json'), json_parser)
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_run_keeps_input_order(capsys, monkeypatch, jobs):
+    monkeypatch.setattr(dump_js_barcodes, 'CHUNK_SIZE', 2)
+    stream = io.StringIO(''.join(p + '\n' for p in JSON_PATHS))
+    dump_js_barcodes.run(stream, False, True, jobs=jobs)
+    out, err = capsys.readouterr()
+    expected = [
+        '\t'.join([se.barcode, se.sample_name, merge.id, merge.json_path])
+        for merge in map(Merge, JSON_PATHS) for se in merge.sequencing_events
+    ]
+    assert out.splitlines() == expected
+    assert err == ''
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_run_writes_merges_before_a_bad_one(capsys, jobs):
+    bad_path = str(JSON_BASE / 'json_bad' / 'invalid.json')
+    stream = io.StringIO(''.join(p + '\n'
+                                 for p in JSON_PATHS[:3] + [bad_path]
+                                 + JSON_PATHS[3:]))
+    with pytest.raises(JSONDecodeError):
+        dump_js_barcodes.run(stream, False, False, jobs=jobs)
+    out, err = capsys.readouterr()
+    expected = [
+        '\t'.join([se.barcode, se.sample_name, merge.id])
+        for merge in map(Merge, JSON_PATHS[:3])
+        for se in merge.sequencing_events
+    ]
+    assert out.splitlines() == expected
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_run_warns_of_multiple_references(tmpdir, capsys, jobs):
+    json_paths = []
+    for i, reference in enumerate(['hg19', 'hg38', 'hg38']):
+        merge_dir = tmpdir.mkdir('m{}'.format(i))
+        json_path = merge_dir.join('event.json')
+        json_path.write(json.dumps({
+            'event_id': 'M{}'.format(i), 'library_name': 'L',
+            'sequencing_events': {'B{}'.format(i): {
+                'event_id': 'B{}'.format(i), 'sample_name': 'S',
+                'reference': reference,
+            }},
+        }))
+        json_paths.append(str(json_path) + '\n')
+    dump_js_barcodes.run(io.StringIO(''.join(json_paths)), False, False,
+                         jobs=jobs)
+    out, err = capsys.readouterr()
+    assert out == 'B0\tS\tM0\nB1\tS\tM1\nB2\tS\tM2\n'
+    assert err == 'Multiple references: hg19 hg38\n'
+    dump_js_barcodes.run(io.StringIO(''.join(json_paths)), True, False,
+                         jobs=jobs)
+    out, err = capsys.readouterr()
+    assert out.splitlines()[0] == 'B0\tS\tM0\thg19'
+    assert err == ''
+
+
+def test_run_jsonl_gzip(tmpdir):
+    output_path = str(tmpdir.join('barcodes.jsonl.gz'))
+    stream = io.StringIO(JSON_PATHS[0] + '\n')
+    dump_js_barcodes.run(stream, True, False, output_format='jsonl',
+                         output_path=output_path, compression='gzip')
+    with gzip.open(output_path, 'rt') as fin:
+        rows = [json.loads(line) for line in fin]
+    merge = Merge(JSON_PATHS[0])
+    assert rows[0] == {
+        'barcode': merge.sequencing_events[0].barcode,
+        'sample_name': merge.sample_name,
+        'merge_id': merge.id,
+        'reference': merge.reference,
+    }
+    assert len(rows) == len(merge.sequencing_events)
+
+
+def summarize(merge):
+    return (merge.id, merge.lib_name, merge.sample_name, merge.reference,
+            [(se.barcode, se.sample_name, se.reference)
+             for se in merge.sequencing_events])
+
+
+def test_compact_representation():
+    merges = [Merge(json_path) for json_path in JSON_PATHS[:2]]
+    assert merges[0].json_path == JSON_PATHS[0]
+    for merge in merges:
+        assert not hasattr(merge, '__dict__')
+        for se in merge.sequencing_events:
+            assert not hasattr(se, '__dict__')
+            assert se.sample_name is merge.sample_name
+    # Events of different merges share one reference string.
+    assert merges[0].sequencing_events[0].reference is \
+        merges[1].sequencing_events[0].reference
+
+
+def test_find_merge_definitions(tmpdir):
+    for path in ['m2/MergeDefn.json', 'm1/event.json', 'm1/alignments/x',
+                 'm3/notes.json']:
+        tmpdir.join(path).ensure()
+    found = dump_js_barcodes.find_merge_definitions([str(tmpdir)])
+    assert list(found) == [str(tmpdir.join('m1/event.json')),
+                           str(tmpdir.join('m2/MergeDefn.json'))]
+
+
+def test_root_with_jobs(tmpdir, capsys):
+    for i, json_path in enumerate(JSON_PATHS[:6]):
+        shutil.copy(json_path, str(tmpdir.mkdir('m{}'.format(i))
+                                   .join('MergeDefn.json')))
+    outputs = []
+    for jobs in 1, 2:
+        paths = dump_js_barcodes.find_merge_definitions([str(tmpdir)], jobs=2)
+        dump_js_barcodes.run(paths, True, True, jobs=jobs)
+        outputs.append(capsys.readouterr().out)
+    assert outputs[0] and outputs[0] == outputs[1]
+
+
+def test_process_pool_does_not_fork_this_process():
+    with process_pool(1) as pool:
+        assert pool.submit(os.getppid).result() != os.getpid()
@@ -0,0 +1,141 @@
+import io
+from pathlib import Path
+import struct
+from subprocess import run, DEVNULL, PIPE
+import sys
+import zlib
+
+import pytest
+
+from ngsi_pm import dump_rgs, hts_header
+
+current_path = Path(__file__).resolve()
+RESOURCE_BASE = current_path.parent / "resources"
+MPLX_QC_RESOURCE_BASE = current_path.parent.parent / "mplx_qc" / "resources"
+NAME = ('ATRFIB.NWD161809-1_2AMP-FLOWCELL-HC5NCCCXY-HC5W5CCXY-HC55WCCXY-'
+        'H7TGTCCXY.hgv.mini')
+BAM_PATH = RESOURCE_BASE / (NAME + '.bam')
+SAM_PATH = MPLX_QC_RESOURCE_BASE / 'sam_good' / (NAME + '.sam')
+
+
+# Functional tests
+
+def test_dump_rgs_bam():
+    cp = run_dump_rgs(str(BAM_PATH))
+    assert cp.returncode == 0
+    assert not cp.stderr
+    lines = cp.stdout.splitlines()
+    assert len(lines) == 20
+    assert lines[0] == 'HC55WCCXY-2-IDDUI040\tNWD161809'
+
+
+def test_dump_rgs_bam_matches_stdin():
+    from_bam = run_dump_rgs(str(BAM_PATH), str(BAM_PATH))
+    from_sam = run_dump_rgs(input=SAM_PATH.read_text() * 2)
+    assert from_bam.stdout == from_sam.stdout
+
+
+def test_dump_rgs_bad_bam():
+    bad_path = MPLX_QC_RESOURCE_BASE / 'sam_bad' / 'invalid.bam'
+    cp = run_dump_rgs(str(bad_path), str(BAM_PATH))
+    assert cp.returncode == 1
+    assert cp.stderr.startswith('dump_rgs: ')
+    assert len(cp.stdout.splitlines()) == 20
+
+
+def test_dump_rgs_any_files_with_source():
+    cram_path = MPLX_QC_RESOURCE_BASE / 'cram_good' / (NAME + '.cram')
+    paths = [str(SAM_PATH), str(cram_path), str(BAM_PATH)]
+    cp = run_dump_rgs('--add-source', *paths)
+    assert cp.returncode == 0
+    rows = [line.split('\t') for line in cp.stdout.splitlines()]
+    assert [row[2] for row in rows] == [p for p in paths for _ in range(20)]
+    assert rows[0] == rows[20][:2] + [str(SAM_PATH)] == \
+        rows[40][:2] + [str(SAM_PATH)]
+
+
+def test_dump_rgs_header_only_stdin():
+    cp = run_dump_rgs('--header-only', input=SAM_PATH.read_text() * 2)
+    assert len(cp.stdout.splitlines()) == 20
+
+
+def run_dump_rgs(*args, input=None):
+    """Runs dump_rgs, returning the completed process object."""
+    cp = run(["dump_rgs", *args], input=input,
+             stdin=None if input is not None else DEVNULL,
+             stdout=PIPE, stderr=PIPE, universal_newlines=True, timeout=20)
+    print(cp.stdout)
+    print(cp.stderr, file=sys.stderr)
+    return cp
+
+
+# Unit tests
+
+@pytest.mark.parametrize('chunk_size', [7, 100, 1 << 20])
+def test_generate_sam_rg_lines(monkeypatch, chunk_size):
+    monkeypatch.setattr(dump_rgs, 'CHUNK_SIZE', chunk_size)
+    text = SAM_PATH.read_bytes()
+    header_size = sum(len(line) for line in text.splitlines(True)
+                      if line.startswith(b'@'))
+    expected = [line for line in SAM_PATH.read_text().splitlines()
+                if line.startswith('@RG\t')]
+    fin = io.BytesIO(text * 2)
+    assert list(dump_rgs.generate_sam_rg_lines(fin, True)) == expected
+    assert fin.tell() <= header_size + chunk_size
+    fin = io.BytesIO(text * 2)
+    assert list(dump_rgs.generate_sam_rg_lines(fin)) == expected * 2
+    # A last line without a newline is still read.
+    fin = io.BytesIO(b'@HD\tVN:1.5\n' + expected[0].encode())
+    assert list(dump_rgs.generate_sam_rg_lines(fin, True)) == expected[:1]
+
+
+def test_read_bam_header():
+    header_text, references = hts_header.read_bam_header(BAM_PATH)
+    assert header_text.decode().splitlines() == [
+        l for l in SAM_PATH.read_text().splitlines() if l.startswith('@')
+    ]
+    assert references == [('chr1', 248956422)]
+
+
+def test_read_bam_header_many_blocks(tmpdir):
+    """A header larger than one BGZF block is read across blocks."""
+    rg_lines = ['@RG\tID:{0}\tPU:FLOWCELL-1-IDX{0:05}\tSM:S1'.format(i)
+                for i in range(5000)]
+    text = '\n'.join(['@HD\tVN:1.5'] + rg_lines) + '\n'
+    bam_path = str(tmpdir.join('big.bam'))
+    write_bam_header(bam_path, text.encode(), [('chr1', 1000), ('chr2', 50)])
+    header_text, references = hts_header.read_bam_header(bam_path)
+    assert header_text == text.encode()
+    assert references == [('chr1', 1000), ('chr2', 50)]
+    assert hts_header.read_bam_rg_lines(bam_path) == rg_lines
+
+
+def test_read_bam_header_truncated(tmpdir):
+    data = BAM_PATH.read_bytes()
+    bam_path = tmpdir.join('truncated.bam')
+    bam_path.write_binary(data[:40])
+    with pytest.raises(hts_header.HeaderError):
+        hts_header.read_bam_header(str(bam_path))
+
+
+def write_bam_header(bam_path, text, references):
+    """Write a BAM header as BGZF blocks of at most 1000 bytes each."""
+    data = b'BAM\x01' + struct.pack('<i', len(text)) + text
+    data += struct.pack('<i', len(references))
+    for name, length in references:
+        name = name.encode() + b'\0'
+        data += struct.pack('<i', len(name)) + name + struct.pack('<i', length)
+    with open(bam_path, 'wb') as fout:
+        for start in range(0, len(data), 1000):
+            fout.write(bgzf_block(data[start:start+1000]))
+        fout.write(bgzf_block(b''))
+
+
+def bgzf_block(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = 12 + 6 + len(cdata) + 8
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6,
+                         66, 67, 2, block_size - 1)
+    footer = struct.pack('<II', zlib.crc32(data), len(data))
+    return header + cdata + footer
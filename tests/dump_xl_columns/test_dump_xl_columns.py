@@ -0,0 +1,62 @@
+import gzip
+import json
+from subprocess import run, DEVNULL, PIPE
+
+from openpyxl import Workbook
+
+HEADER = ['sample_id/nwd_id', 'lane_barcode', 'cram_path', 'result_path']
+ROWS = [
+    ['NWD1', 'HC5W5CCXY-3-IDDUI040', '/a/x y.cram', '/results/a'],
+    ['NWD2', None, '/b/x.cram', '#/results/b'],
+]
+
+
+def test_tsv_in_column_order(tmpdir):
+    cp = run_dump_xl_columns(write_workbook(tmpdir), '-H', 'lane_barcode',
+                             'sample_id_nwd_id')
+    assert cp.returncode == 0
+    assert cp.stdout == ('lane_barcode\tsample_id_nwd_id\n'
+                         'HC5W5CCXY-3-IDDUI040\tNWD1\n'
+                         '\tNWD2\n')
+
+
+def test_null_terminated_with_key(tmpdir):
+    cp = run_dump_xl_columns(write_workbook(tmpdir), '-0', '-k',
+                             'result_path', 'cram_path', 'result_path')
+    assert cp.stdout == '/a/x y.cram\0/results/a\0'
+
+
+def test_jsonl_gzip(tmpdir):
+    output = str(tmpdir.join('out.jsonl.gz'))
+    cp = run_dump_xl_columns(write_workbook(tmpdir), '--format', 'jsonl',
+                             '-o', output, 'sample_id/nwd_id',
+                             'lane_barcode')
+    assert (cp.returncode, cp.stdout) == (0, '')
+    with gzip.open(output, 'rt') as fin:
+        records = [json.loads(line) for line in fin]
+    assert records == [
+        {'sample_id_nwd_id': 'NWD1', 'lane_barcode': 'HC5W5CCXY-3-IDDUI040'},
+        {'sample_id_nwd_id': 'NWD2', 'lane_barcode': None},
+    ]
+
+
+def test_missing_column(tmpdir):
+    cp = run_dump_xl_columns(write_workbook(tmpdir), 'bam_path')
+    assert (cp.returncode, cp.stdout) == (2, '')
+    assert 'bam_path' in cp.stderr
+
+
+def run_dump_xl_columns(*args):
+    return run(['dump_xl_columns'] + list(args), stdin=DEVNULL, stdout=PIPE,
+               stderr=PIPE, universal_newlines=True, timeout=60)
+
+
+def write_workbook(tmpdir):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'batch1_smpls'
+    for row in [HEADER] + ROWS:
+        ws.append(row)
+    path = str(tmpdir.join('test.xlsx'))
+    wb.save(path)
+    return path
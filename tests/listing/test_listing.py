@@ -0,0 +1,111 @@
+import gzip
+import os
+import time
+
+import pytest
+
+from ngsi_pm.listing import CachedLister, IndexLister, Lister, open_lister
+
+
+def test_lister_counts_scans(tmpdir):
+    tmpdir.join('a.txt').ensure()
+    tmpdir.mkdir('sub')
+    lister = Lister()
+    assert sorted(lister.list_dir(str(tmpdir))) == [('a.txt', False),
+                                                    ('sub', True)]
+    assert lister.counts == {'scandir': 1}
+
+
+def test_cached_lister_reuses_unchanged_directories(tmpdir):
+    directory = tmpdir.mkdir('result')
+    directory.join('a.bam').ensure()
+    age(directory, 100)
+    db_path = str(tmpdir.join('listings.sqlite'))
+    lister = CachedLister(db_path)
+    expected = lister.list_dir(str(directory))
+    lister.close()
+
+    lister = CachedLister(db_path)
+    assert lister.list_dir(str(directory) + '/') == expected
+    assert lister.counts == {'stat': 1, 'cache hit': 1}
+
+    directory.join('b.bam').ensure()
+    age(directory, 50)
+    assert sorted(lister.list_dir(str(directory))) == [('a.bam', False),
+                                                       ('b.bam', False)]
+    assert lister.counts['scandir'] == 1
+    lister.close()
+
+
+def test_cached_lister_max_age(tmpdir):
+    directory = tmpdir.mkdir('result')
+    age(directory, 100)
+    lister = CachedLister(str(tmpdir.join('listings.sqlite')), max_age=0)
+    lister.list_dir(str(directory))
+    lister.list_dir(str(directory))
+    assert lister.counts['scandir'] == 2
+    lister.close()
+
+
+def test_cached_lister_skips_racy_listings(tmpdir):
+    directory = tmpdir.mkdir('result')
+    lister = CachedLister(str(tmpdir.join('listings.sqlite')))
+    lister.list_dir(str(directory))
+    lister.list_dir(str(directory))
+    assert lister.counts['scandir'] == 2
+    lister.close()
+
+
+def test_unusable_listing_cache_is_not_used(tmpdir):
+    lister = open_lister(str(tmpdir.join('nowhere', 'listings.sqlite')))
+    assert type(lister) is Lister
+
+
+def test_index_lister_reads_manifest(tmpdir):
+    manifest = tmpdir.join('manifest.txt.gz')
+    with gzip.open(str(manifest), 'wt') as fout:
+        fout.write('/results\td\n'
+                   '/results/a\td\n'
+                   '/results/a/s.hgv.bam\tf\n'
+                   '/results/a/variants/\n'
+                   '/results/b/link\tl\n'
+                   '/results/c\td\n')
+    lister = open_lister(manifests=[str(manifest)])
+    assert lister.list_dir('/results/') == [('a', True), ('b', True),
+                                            ('c', True)]
+    assert lister.list_dir('/results/b/../a') == [('s.hgv.bam', False),
+                                                  ('variants', True)]
+    assert lister.list_dir('/results/a/variants') == []
+    assert lister.list_dir('/results/b') == [('link', False)]
+    with pytest.raises(FileNotFoundError):
+        lister.list_dir('/results/d')
+    assert lister.counts == {'index lookup': 5}
+
+
+def test_index_lister_prescan_matches_live_listing(tmpdir):
+    root = tmpdir.mkdir('results')
+    for path in ('a/s.hgv.bam', 'a/variants/x.vcf', 'b/x.bam'):
+        root.join(path).ensure()
+    root.mkdir('empty')
+    os.symlink(str(root.join('a')), str(root.join('link')))
+    lister = IndexLister()
+    lister.prescan(str(root), jobs=2)
+    assert lister.counts == {'scandir': 5}
+    live = Lister()
+    for path in ('', 'a', 'a/variants', 'b', 'empty'):
+        path = str(root.join(path))
+        assert sorted(lister.list_dir(path)) == sorted(live.list_dir(path))
+    # The link is listed live, like Lister follows it.
+    link_path = str(root.join('link'))
+    assert sorted(lister.list_dir(link_path)) == sorted(
+        live.list_dir(link_path))
+    assert lister.counts['scandir'] == 6
+    with pytest.raises(FileNotFoundError):
+        lister.list_dir(str(root.join('nowhere')))
+    with pytest.raises(NotADirectoryError):
+        lister.list_dir(str(root.join('b', 'x.bam')))
+
+
+def age(directory, seconds):
+    then = time.time() - seconds
+    os.utime(str(directory), (then, then))
@@ -66,6 +66,14 @@ def test_ec7(tmpdir):
                  RESOURCE_BASE/'tsv_main/ec_7_expect.tsv')
 
 
+def test_ec2_jobs(tmpdir):
+    cp = run_mplx_qc_xlsx(tmpdir, 'tsv_jwatt/ec_2_b.xlsx.tsv', '--jobs', '4')
+    check_output(cp, 2, 3,
+                 'CRAM and JSON '
+                 'have mismatching sets of barcodes.',
+                 RESOURCE_BASE/'tsv_jwatt/ec_2_expect.tsv')
+
+
 def test_ec0_tsv():
     cp = run_mplx_qc(RESOURCE_BASE/'tsv_main/ec_0.xlsx.tsv')
     check_output(cp, 0, 0, None, None)
@@ -78,13 +86,13 @@ def test_ec7_tsv():
                  RESOURCE_BASE/'tsv_main/ec_7_expect.tsv')
 
 
-def run_mplx_qc_xlsx(tmpdir, input_path):
+def run_mplx_qc_xlsx(tmpdir, input_path, *options):
     """Sets up all the paths, and then runs mplx_qc, returning the
     completed process object."""
     xlsx_path = str(tmpdir.join('test.xlsx'))
     print(xlsx_path)
     convert_tsv(RESOURCE_BASE/input_path, xlsx_path)
-    return run_mplx_qc(xlsx_path)
+    return run_mplx_qc(xlsx_path, *options)
 
 
 def convert_tsv(tsv_path, dst_path):
@@ -97,9 +105,9 @@ def convert_tsv(tsv_path, dst_path):
     wb.save(dst_path)
 
 
-def run_mplx_qc(input_path):
+def run_mplx_qc(input_path, *options):
     """Runs mplx_qc, returning the completed process object."""
-    args = ["mplx_qc", input_path]
+    args = ["mplx_qc", input_path, *options]
     cp = run(args, stdin=DEVNULL, stdout=PIPE, stderr=PIPE,
              universal_newlines=True, timeout=20)
     print(cp.stdout)
@@ -142,6 +150,25 @@ def test_ec2_unit(capsys, caplog):
                  RESOURCE_BASE/'tsv_jwatt/ec_2_expect.tsv')
 
 
+def test_ec2_jobs_unit(capsys, caplog):
+    error_code = mplx_qc.run_qc(str(RESOURCE_BASE/'tsv_jwatt/ec_2_b.xlsx.tsv'),
+                                jobs=3)
+    assert error_code == 2
+    check_run_qc(capsys, caplog, 3,
+                 'CRAM and JSON have mismatching sets of barcodes.',
+                 RESOURCE_BASE/'tsv_jwatt/ec_2_expect.tsv')
+
+
+def test_ec15_jobs_unit(capsys, caplog):
+    """GrosslyBadError raised in a worker still sets the error code."""
+    error_code = mplx_qc.run_qc(str(RESOURCE_BASE/'tsv_main/ec_15.tsv'),
+                                jobs=2)
+    assert error_code == 15
+    check_run_qc(capsys, caplog, 1,
+                 'CRAM is missing:',
+                 RESOURCE_BASE/'tsv_main/ec_15_expect.tsv')
+
+
 def test_ec4_unit(capsys, caplog):
     error_code = mplx_qc.run_qc(str(RESOURCE_BASE/'tsv_main/ec_4.xlsx.tsv'))
     assert error_code == 4
@@ -288,3 +315,255 @@ def check_run_qc(capsys, caplog, num_errs, error_prefix, expected_out_path):
     assert len(caplog.records) == num_errs
     for record in caplog.records:
         assert record.msg.startswith(error_prefix)
+
+
+# Native CRAM header reader
+
+def test_native_rg_lines_match_sam():
+    for cram_path in sorted((RESOURCE_BASE/'cram_good').glob('*.cram')):
+        sam_path = RESOURCE_BASE/'sam_good'/(cram_path.stem + '.sam')
+        expected = [l for l in sam_path.read_text().splitlines()
+                    if l.startswith('@RG\t')]
+        assert mplx_qc.dump_cram_rgs(str(cram_path), 'native') == expected
+
+
+def test_ec0_native_unit(capsys, caplog):
+    error_code = mplx_qc.run_qc(str(RESOURCE_BASE/'tsv_main/ec_0_cram.tsv'),
+                                cram_reader='native')
+    assert error_code == 0
+    check_run_qc(capsys, caplog, 0, None, RESOURCE_BASE/'empty_file')
+
+
+def test_ec4_native_unit(capsys, caplog):
+    error_code = mplx_qc.run_qc(str(RESOURCE_BASE/'tsv_main/ec_4_cram.tsv'),
+                                cram_reader='native')
+    assert error_code == 4
+    check_run_qc(capsys, caplog, 1,
+                 'Duplicate barcodes in CRAM.',
+                 RESOURCE_BASE/'tsv_main/ec_4_cram_expect.tsv')
+
+
+def test_ec7_native(tmpdir):
+    cp = run_mplx_qc_xlsx(tmpdir, 'tsv_main/ec_7_cram.tsv',
+                          '--cram-reader', 'native')
+    check_output(cp, 7, 1,
+                 'CRAM contains multiple values for sample.',
+                 RESOURCE_BASE/'tsv_main/ec_7_cram_expect.tsv')
+
+
+def test_ec13_native_unit(capsys, caplog):
+    """If a CRAM file is too bad to read..."""
+    error_code = mplx_qc.run_qc(str(RESOURCE_BASE/'tsv_main/ec_13_cram.tsv'),
+                                cram_reader='native')
+    assert error_code == 13
+    check_run_qc(capsys, caplog, 1,
+                 'CRAM is bad:',
+                 RESOURCE_BASE/'tsv_main/ec_13_expect.tsv')
+
+
+# Parse cache
+
+def test_ec2_cache_unit(capsys, caplog, tmpdir):
+    cache_path = str(tmpdir.join('cache.sqlite'))
+    for _ in range(2):
+        error_code = mplx_qc.run_qc(
+            str(RESOURCE_BASE/'tsv_jwatt/ec_2_b.xlsx.tsv'),
+            cache_path=cache_path
+        )
+        assert error_code == 2
+        check_run_qc(capsys, caplog, 3,
+                     'CRAM and JSON have mismatching sets of barcodes.',
+                     RESOURCE_BASE/'tsv_jwatt/ec_2_expect.tsv')
+        caplog.clear()
+
+
+def test_ec15_cache(tmpdir):
+    cache_path = str(tmpdir.join('cache.sqlite'))
+    for _ in range(2):
+        cp = run_mplx_qc(RESOURCE_BASE/'tsv_main/ec_15.tsv',
+                         '--cache', cache_path)
+        check_output(cp, 15, 1, 'CRAM is missing:',
+                     RESOURCE_BASE/'tsv_main/ec_15_expect.tsv')
+
+
+def test_ec15_unusable_cache(tmpdir):
+    cp = run_mplx_qc(RESOURCE_BASE/'tsv_main/ec_15.tsv',
+                     '--cache', str(tmpdir.join('nowhere', 'cache.sqlite')))
+    warning, error = cp.stderr.splitlines()
+    assert warning.startswith('not using parse cache')
+    cp.stderr = error + '\n'
+    check_output(cp, 15, 1, 'CRAM is missing:',
+                 RESOURCE_BASE/'tsv_main/ec_15_expect.tsv')
+
+
+# Streaming input
+
+def test_iter_input_is_lazy(tmpdir):
+    tsv_path = tmpdir.join('test.tsv')
+    header = (RESOURCE_BASE/'tsv_main/ec_0.xlsx.tsv').read_text()
+    tsv_path.write(header.splitlines()[0] + '\n')
+    with open(str(tsv_path), 'a') as fout:
+        for i in range(1000):
+            print(i, 'merge{}'.format(i), 'x', 'y', 'c', 'n', 'j', 'p',
+                  sep='\t', file=fout)
+    records = mplx_qc.iter_input(Path(str(tsv_path)))
+    assert not isinstance(records, list)
+    assert next(records).merge_id == 'merge0'
+    assert next(records).merge_id == 'merge1'
+
+
+def test_iter_input_checks_eagerly():
+    with pytest.raises(mplx_qc.GrosslyBadError):
+        mplx_qc.iter_input(RESOURCE_BASE/'tsv_main/ec_17.tsv')
+
+
+def test_header_only_unit(capsys, caplog, tmpdir):
+    tsv_path = tmpdir.join('test.tsv')
+    header = (RESOURCE_BASE/'tsv_main/ec_0.xlsx.tsv').read_text()
+    tsv_path.write(header.splitlines()[0] + '\n')
+    assert mplx_qc.run_qc(str(tsv_path), jobs=2) == 0
+    check_run_qc(capsys, caplog, 0, None, RESOURCE_BASE/'empty_file')
+
+
+# Fail fast
+
+def test_ec2_fail_fast_unit(capsys, caplog):
+    error_code = mplx_qc.run_qc(str(RESOURCE_BASE/'tsv_jwatt/ec_2_b.xlsx.tsv'),
+                                jobs=2, fail_fast=1)
+    assert error_code == 2
+    out, err = capsys.readouterr()
+    expected = (RESOURCE_BASE/'tsv_jwatt/ec_2_expect.tsv').read_text()
+    assert out == expected.splitlines(keepends=True)[0]
+    # Records after the first error may have been checked concurrently, so
+    # their errors are logged, but not printed.
+    messages = [r.msg for r in caplog.records]
+    stops = [m for m in messages if m.startswith('Stopping early after')]
+    assert len(stops) == 1
+    messages.remove(stops[0])
+    assert messages
+    assert all(m.startswith('CRAM and JSON have mismatching sets of barcodes.')
+               for m in messages)
+
+
+def test_ec2_fail_fast_threshold_unit(capsys, caplog):
+    """Errors below the threshold do not stop the run."""
+    error_code = mplx_qc.run_qc(str(RESOURCE_BASE/'tsv_jwatt/ec_2_b.xlsx.tsv'),
+                                fail_fast=3)
+    assert error_code == 2
+    check_run_qc(capsys, caplog, 3,
+                 'CRAM and JSON have mismatching sets of barcodes.',
+                 RESOURCE_BASE/'tsv_jwatt/ec_2_expect.tsv')
+
+
+def test_ec15_fail_fast(tmpdir):
+    cp = run_mplx_qc(RESOURCE_BASE/'tsv_main/ec_15.tsv', '--fail-fast')
+    assert cp.returncode == 15
+    assert cp.stdout == (
+        RESOURCE_BASE/'tsv_main/ec_15_expect.tsv'
+    ).read_text()
+    error_lines = cp.stderr.splitlines()
+    assert error_lines[0].startswith('CRAM is missing:')
+    assert error_lines[1].startswith('Stopping early after 2 records:')
+
+
+def test_ec15_fail_fast_before_input(tmpdir):
+    cp = run(['mplx_qc', '--fail-fast', RESOURCE_BASE/'tsv_main/ec_15.tsv'],
+             stdin=DEVNULL, stdout=PIPE, stderr=PIPE,
+             universal_newlines=True, timeout=20)
+    assert cp.returncode == 15
+    assert cp.stderr.splitlines()[1].startswith('Stopping early after')
+
+
+def test_ec15_fail_fast_code(tmpdir):
+    """An error code below CODE does not stop the run."""
+    cp = run_mplx_qc(RESOURCE_BASE/'tsv_main/ec_15.tsv',
+                     '--fail-fast-code', '16')
+    check_output(cp, 15, 1, 'CRAM is missing:',
+                 RESOURCE_BASE/'tsv_main/ec_15_expect.tsv')
+
+
+# Sharding
+
+@pytest.mark.parametrize('input_path,returncode,expected_out_path', [
+    ('tsv_jwatt/ec_2_b.xlsx.tsv', 2, 'tsv_jwatt/ec_2_expect.tsv'),
+    ('tsv_main/ec_15.tsv', 15, 'tsv_main/ec_15_expect.tsv'),
+])
+def test_shards_merge(tmpdir, input_path, returncode, expected_out_path):
+    shard_outputs = run_shards(tmpdir, RESOURCE_BASE/input_path, 3)
+    cp = run_mplx_qc_merge(RESOURCE_BASE/input_path, shard_outputs)
+    assert cp.returncode == returncode
+    assert cp.stdout == (RESOURCE_BASE/expected_out_path).read_text()
+    assert not cp.stderr
+
+
+def run_shards(tmpdir, input_path, count, shards=None):
+    """Run mplx_qc --shard I/count for each I in shards (default: all) and
+    return the paths of their outputs."""
+    shard_outputs = []
+    for i in shards or range(1, count + 1):
+        cp = run_mplx_qc(input_path, '--shard', '{}/{}'.format(i, count))
+        shard_output = tmpdir.join('shard{}.tsv'.format(i))
+        shard_output.write(cp.stdout)
+        shard_outputs.append(str(shard_output))
+    return shard_outputs
+
+
+def run_mplx_qc_merge(input_path, shard_outputs):
+    return run(['mplx_qc_merge', str(input_path)] + shard_outputs,
+               stdin=DEVNULL, stdout=PIPE, stderr=PIPE,
+               universal_newlines=True, timeout=20)
+
+
+def test_shards_merge_needs_every_shard(tmpdir):
+    input_path = RESOURCE_BASE/'tsv_main/ec_15.tsv'
+    shard_outputs = run_shards(tmpdir, input_path, 3)
+    cp = run_mplx_qc_merge(input_path, shard_outputs[1:])
+    assert cp.returncode != 0
+    assert 'missing shards: 1/3' in cp.stderr
+
+
+def test_shards_merge_rejects_empty_outputs(tmpdir):
+    """Outputs without trailers, as left by shards that never ran."""
+    empty_outputs = [str(tmpdir.join(name).ensure())
+                     for name in ('shard1.tsv', 'shard2.tsv')]
+    cp = run_mplx_qc_merge(RESOURCE_BASE/'tsv_main/ec_15.tsv', empty_outputs)
+    assert cp.returncode == 1
+    assert cp.stderr.count('no trailer') == 2
+
+
+def test_shards_merge_keeps_order_of_repeated_merges(tmpdir):
+    lines = (RESOURCE_BASE/'tsv_main/ec_15.tsv').read_text().splitlines()
+    header, row = lines[0], lines[2].split('\t')
+    # Two merge_ids that fall in different shards of 2.
+    assert mplx_qc.in_shard('A', (2, 2)) and mplx_qc.in_shard('D', (1, 2))
+    input_path = tmpdir.join('repeated.tsv')
+    input_path.write('\n'.join(
+        [header] + ['\t'.join(row[:1] + [merge_id] + row[2:])
+                    for merge_id in ('A', 'D', 'A')]) + '\n')
+    expected = run_mplx_qc(str(input_path))
+    assert expected.returncode == 15
+    shard_outputs = run_shards(tmpdir, str(input_path), 2)
+    cp = run_mplx_qc_merge(input_path, shard_outputs)
+    assert cp.returncode == 15
+    assert [line.split('\t')[1] for line in cp.stdout.splitlines()] == [
+        'A', 'D', 'A']
+    assert cp.stdout == expected.stdout
+
+
+def test_shards_partition_records(capsys):
+    seen = []
+    for i in range(1, 4):
+        records = mplx_qc.iter_input(RESOURCE_BASE/'tsv_main/ec_0.xlsx.tsv')
+        seen += [r.merge_id for r in records
+                 if mplx_qc.in_shard(r.merge_id, (i, 3))]
+    records = mplx_qc.iter_input(RESOURCE_BASE/'tsv_main/ec_0.xlsx.tsv')
+    assert sorted(seen) == sorted(r.merge_id for r in records)
+
+
+def test_shards_merge_bad_input(tmpdir):
+    cp = run(['mplx_qc_merge', str(RESOURCE_BASE/'foo.tsv'),
+              str(RESOURCE_BASE/'empty_file')],
+             stdin=DEVNULL, stdout=PIPE, stderr=PIPE,
+             universal_newlines=True, timeout=20)
+    assert cp.returncode == 20
+    assert cp.stderr.startswith('Input file is missing:')
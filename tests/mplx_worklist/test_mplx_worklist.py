@@ -0,0 +1,128 @@
+from pathlib import Path
+
+from ngsi_pm import mplx_worklist
+from ngsi_pm.listing import IndexLister, Lister
+
+
+class Record:
+    def __init__(self, merge_path):
+        self.merge_path = merge_path
+
+
+def test_add_file_paths_legacy_and_new(tmpdir):
+    legacy = tmpdir.mkdir('legacy')
+    legacy.join('MEDefn.json').ensure()
+    legacy.join('x.hgv.cram').ensure()
+    legacy.join('x.hgv.cram.crai').ensure()
+    new = tmpdir.mkdir('new')
+    new.join('event.json').ensure()
+    new.join('alignments', 'y.hgv.cram').ensure()
+    lister = Lister()
+
+    record = Record(str(legacy))
+    mplx_worklist.add_file_paths(record, lister)
+    assert record.json_path == Path(str(legacy), 'MEDefn.json')
+    assert record.cram_path == Path(str(legacy), 'x.hgv.cram')
+    assert record.current_cram_name == 'x.hgv.cram'
+
+    record = Record(str(new))
+    mplx_worklist.add_file_paths(record, lister)
+    assert record.json_path == Path(str(new), 'event.json')
+    assert record.cram_path == Path(str(new), 'alignments', 'y.hgv.cram')
+    assert lister.counts == {'scandir': 3}
+
+
+def test_add_file_paths_missing_merge_path(tmpdir):
+    record = Record(str(tmpdir.join('nowhere')))
+    mplx_worklist.add_file_paths(record, Lister())
+    assert record.json_path is None
+    assert record.cram_path is None
+
+
+def test_dotfiles_match_like_path_glob(tmpdir):
+    merge = tmpdir.mkdir('merge')
+    merge.join('event.json').ensure()
+    merge.join('alignments', 'y.hgv.cram').ensure()
+    merge.join('alignments', '.y.hgv.cram').ensure()
+    record = Record(str(merge))
+    mplx_worklist.add_file_paths(record, Lister())
+    assert sorted(Path(str(merge)).glob('alignments/*.hgv.cram')) == [
+        Path(str(merge), 'alignments', name)
+        for name in ('.y.hgv.cram', 'y.hgv.cram')
+    ]
+    assert record.cram_path is None
+
+
+def test_directories_never_match(tmpdir):
+    merge = tmpdir.mkdir('merge')
+    merge.mkdir('event.json')
+    merge.join('MergeDefn.json').ensure()
+    merge.mkdir('z.hgv.cram')
+    target = tmpdir.mkdir('elsewhere')
+    target.join('z.hgv.cram').ensure()
+    merge.join('alignments').mksymlinkto(target)
+    record = Record(str(merge))
+    mplx_worklist.add_file_paths(record, Lister())
+    assert record.json_path == Path(str(merge), 'MergeDefn.json')
+    assert record.cram_path == Path(str(merge), 'alignments', 'z.hgv.cram')
+
+
+def test_add_file_paths_from_prescan(tmpdir):
+    new = tmpdir.mkdir('new')
+    new.join('event.json').ensure()
+    new.join('alignments', 'y.hgv.cram').ensure()
+    lister = IndexLister()
+    lister.prescan(str(tmpdir))
+    record = Record(str(new))
+    mplx_worklist.add_file_paths(record, lister)
+    assert record.json_path == Path(str(new), 'event.json')
+    assert record.cram_path == Path(str(new), 'alignments', 'y.hgv.cram')
+    assert lister.counts == {'scandir': 3, 'index lookup': 2}
+
+
+def test_symlinks_from_manifest(tmpdir):
+    target = tmpdir.mkdir('elsewhere')
+    target.join('event.json').ensure()
+    target.join('alignments', 'y.hgv.cram').ensure()
+    results = tmpdir.mkdir('results')
+    merge = results.join('merge')
+    merge.mksymlinkto(target)
+    manifest = tmpdir.join('manifest.txt')
+    manifest.write('{}\td\n{}\tl\n'.format(results, merge))
+    lister = IndexLister()
+    lister.read_manifest(str(manifest))
+    record = Record(str(merge))
+    mplx_worklist.add_file_paths(record, lister)
+    assert record.json_path == Path(str(merge), 'event.json')
+    assert record.cram_path == Path(str(merge), 'alignments', 'y.hgv.cram')
+    assert lister.counts == {'scandir': 2}
+
+
+def test_process_input_jobs_keep_order(tmpdir, monkeypatch):
+    def read_input(input_file):
+        data = []
+        for i in range(10):
+            record = mplx_worklist.Generic()
+            merge_path = str(tmpdir.join('merge{}'.format(i)))
+            vars(record).update(zip(mplx_worklist.REQUIRED_INPUT_COLUMN_NAMES,
+                                    ['NWD{}'.format(i), 'M{}'.format(i), 'x',
+                                     'b', merge_path]))
+            data.append(record)
+        return data
+
+    for i in range(10):
+        merge = tmpdir.mkdir('merge{}'.format(i))
+        merge.join('event.json').ensure()
+        merge.join('alignments', 'c{}.hgv.cram'.format(i)).ensure()
+    monkeypatch.setattr(mplx_worklist, 'read_input', read_input)
+    outputs = []
+    for jobs in 1, 4:
+        output_file = tmpdir.join('out{}.tsv'.format(jobs))
+        mplx_worklist.process_input('master.xlsx', str(output_file),
+                                    jobs=jobs)
+        outputs.append(output_file.read())
+    assert outputs[0] == outputs[1]
+    lines = outputs[0].splitlines()
+    assert [line.split('\t')[1] for line in lines[1:]] == [
+        'M{}'.format(i) for i in range(10)
+    ]
@@ -0,0 +1,118 @@
+import os
+from pathlib import Path
+import stat
+import threading
+
+import pytest
+
+from ngsi_pm import parse_cache
+from ngsi_pm.parse_cache import ParseCache
+
+
+def test_unchanged_file_is_not_parsed_again(tmpdir):
+    data_path = make_file(tmpdir, 'a.txt', 'x y')
+    parse = CountingParser()
+    cache = ParseCache(str(tmpdir.join('cache.sqlite')))
+    assert cache.fetch('words', data_path, parse) == (['x', 'y'],)
+    assert cache.fetch('words', data_path, parse) == (['x', 'y'],)
+    assert parse.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+    # A second process sees the same entry.
+    cache = ParseCache(str(tmpdir.join('cache.sqlite')))
+    assert cache.fetch('words', data_path, parse) == (['x', 'y'],)
+    assert parse.calls == 1
+
+
+def test_new_cache_is_group_writable(tmpdir):
+    old_umask = os.umask(0o022)
+    try:
+        cache = ParseCache(str(tmpdir.join('cache.sqlite')))
+        cache.fetch('words', make_file(tmpdir, 'a.txt', 'x'), CountingParser())
+        for name in 'cache.sqlite', 'cache.sqlite-wal':
+            mode = os.stat(str(tmpdir.join(name))).st_mode
+            assert mode & stat.S_IWGRP, name
+        cache.close()
+    finally:
+        os.umask(old_umask)
+
+
+def test_changed_file_is_parsed_again(tmpdir):
+    data_path = make_file(tmpdir, 'a.txt', 'x y')
+    parse = CountingParser()
+    cache = ParseCache(str(tmpdir.join('cache.sqlite')))
+    cache.fetch('words', data_path, parse)
+    Path(data_path).write_text('x y z')
+    assert cache.fetch('words', data_path, parse) == (['x', 'y', 'z'],)
+    st = os.stat(data_path)
+    os.utime(data_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.fetch('words', data_path, parse) == (['x', 'y', 'z'],)
+    assert parse.calls == 3
+
+
+def test_kinds_are_separate(tmpdir):
+    data_path = make_file(tmpdir, 'a.txt', 'x y')
+    cache = ParseCache(str(tmpdir.join('cache.sqlite')))
+    cache.fetch('words', data_path, CountingParser())
+    assert cache.fetch('chars', data_path, lambda p: (['c'],)) == (['c'],)
+
+
+def test_errors_are_not_cached(tmpdir):
+    data_path = make_file(tmpdir, 'a.txt', 'x y')
+    cache = ParseCache(str(tmpdir.join('cache.sqlite')))
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.fetch('words', data_path, fail)
+    with pytest.raises(ValueError):
+        cache.fetch('words', str(tmpdir.join('missing')), fail)
+
+
+def test_eviction(tmpdir, monkeypatch):
+    monkeypatch.setattr(parse_cache, 'EVICTION_INTERVAL', 1)
+    cache = ParseCache(str(tmpdir.join('cache.sqlite')), max_entries=2)
+    paths = [make_file(tmpdir, '{}.txt'.format(i), str(i)) for i in range(4)]
+    parse = CountingParser()
+    for path in paths:
+        cache.fetch('words', path, parse)
+    assert parse.calls == 4
+    cache.fetch('words', paths[-1], parse)  # newest is still there
+    assert parse.calls == 4
+    cache.fetch('words', paths[0], parse)  # oldest was evicted
+    assert parse.calls == 5
+
+
+def test_threads_share_cache(tmpdir):
+    paths = [make_file(tmpdir, '{}.txt'.format(i), str(i)) for i in range(20)]
+    cache = ParseCache(str(tmpdir.join('cache.sqlite')))
+    results = []
+
+    def work():
+        for path in paths:
+            results.append(cache.fetch('words', path, CountingParser()))
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 80
+    assert cache.hits + cache.misses == 80
+
+
+def make_file(tmpdir, name, text):
+    path = tmpdir.join(name)
+    path.write(text)
+    return str(path)
+
+
+class CountingParser:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        return (Path(path).read_text().split(),)
+
+
+def fail(path):
+    raise ValueError(path)
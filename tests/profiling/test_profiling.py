@@ -0,0 +1,100 @@
+from pathlib import Path
+from subprocess import run, DEVNULL, PIPE
+import sys
+import time
+
+import pytest
+
+from ngsi_pm import profiling
+
+current_path = Path(__file__).resolve()
+MPLX_QC_RESOURCE_BASE = current_path.parent.parent / "mplx_qc" / "resources"
+CONSOLE_SCRIPTS = '''
+    annotate_worklist barcode_index cram_rg_check cram_worklist
+    dump_js_barcodes dump_rgs dump_xl_bam_paths dump_xl_barcodes
+    dump_xl_columns dump_xl_cram_paths globus_worklist gmkf_worklist mplx_qc
+    mplx_qc_merge mplx_worklist rg_check topmed_worklist vcf_worklist
+'''.split()
+
+
+@pytest.mark.parametrize('script', CONSOLE_SCRIPTS)
+def test_every_script_has_profile_option(script):
+    cp = run([script, '--help'], stdin=DEVNULL, stdout=PIPE, stderr=PIPE,
+             universal_newlines=True, timeout=20)
+    assert cp.returncode == 0
+    assert '--profile DIR' in cp.stdout
+
+
+def test_mplx_qc_profile(tmpdir):
+    profile_dir = tmpdir.join('profile')
+    cp = run(['mplx_qc', str(MPLX_QC_RESOURCE_BASE/'tsv_main/ec_0_cram.tsv'),
+              '--cram-reader', 'native', '--profile', str(profile_dir)],
+             stdin=DEVNULL, stdout=PIPE, stderr=PIPE,
+             universal_newlines=True, timeout=20)
+    print(cp.stderr, file=sys.stderr)
+    assert cp.returncode == 0
+    suffixes = sorted(p.basename.split('.', 2)[2]
+                      for p in profile_dir.listdir())
+    assert suffixes == ['prof', 'pstats.txt', 'stages.tsv',
+                        'tracemalloc.txt']
+    stages = profile_dir.listdir('*.stages.tsv')[0].read().splitlines()
+    stage_names = [line.split('\t')[0] for line in stages]
+    assert stage_names == ['stage', profiling.JSON_PARSE,
+                           profiling.HEADER_READ, 'total']
+
+
+def test_stage_only_counts_while_profiling(tmpdir):
+    with profiling.stage('ignored'):
+        pass
+    with profiling.profiled(str(tmpdir), 'test'):
+        for _ in range(3):
+            with profiling.stage('sleep'):
+                time.sleep(0.01)
+    with profiling.stage('ignored'):
+        pass
+    stages = tmpdir.listdir('test.*.stages.tsv')[0].read().splitlines()
+    name, seconds, calls = stages[1].split('\t')
+    assert (name, calls) == ('sleep', '3')
+    assert float(seconds) >= 0.03
+    assert stages[2].startswith('total\t')
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_dump_js_barcodes_profile_counts_workers(tmpdir, jobs):
+    json_paths = sorted(MPLX_QC_RESOURCE_BASE.glob('json_*/*_*.json'))
+    input_path = tmpdir.join('json_paths.txt')
+    input_path.write(''.join(str(p) + '\n' for p in json_paths))
+    profile_dir = tmpdir.join('profile')
+    cp = run(['dump_js_barcodes', str(input_path), '--jobs', jobs,
+              '--profile', str(profile_dir)],
+             stdin=DEVNULL, stdout=PIPE, stderr=PIPE,
+             universal_newlines=True, timeout=60)
+    print(cp.stderr, file=sys.stderr)
+    assert cp.returncode == 0
+    stages = profile_dir.listdir('*.stages.tsv')[0].read().splitlines()
+    calls = {line.split('\t')[0]: line.split('\t')[2] for line in stages[1:]}
+    assert calls[profiling.JSON_PARSE] == str(len(json_paths))
+
+
+def double(x):
+    with profiling.stage('double'):
+        return 2 * x
+
+
+def test_worker_stages(tmpdir):
+    assert profiling.worker_stages(double)(1) == (2, None)
+    with profiling.profiled(str(tmpdir), 'test'):
+        call = profiling.worker_stages(double)
+        # In the profiled process, the stage is counted directly.
+        assert call(1) == (2, None)
+        # Simulate a worker process, where nothing is being profiled.
+        stages, profiling._stages = profiling._stages, None
+        try:
+            result, worker_stages = call(2)
+        finally:
+            profiling._stages = stages
+        assert result == 4
+        assert worker_stages['double'][1] == 1
+        profiling.add_stages(worker_stages)
+    stages = tmpdir.listdir('test.*.stages.tsv')[0].read().splitlines()
+    assert stages[1].split('\t')[::2] == ['double', '2']
@@ -0,0 +1,116 @@
+from pathlib import Path
+import random
+import shutil
+from subprocess import run, DEVNULL, PIPE
+
+from openpyxl import Workbook, load_workbook
+import pytest
+
+from ngsi_pm.dump_rgs import parse_rg_line
+from ngsi_pm.hts_header import read_bam_rg_lines, read_cram_rg_lines
+
+current_path = Path(__file__).resolve()
+TESTS_BASE = current_path.parent.parent
+BAM_PATH = str(next((TESTS_BASE/'dump_rgs'/'resources').glob('*.bam')))
+CRAM_PATHS = sorted(
+    str(p) for p in
+    (TESTS_BASE/'mplx_qc'/'resources'/'cram_good').glob('*.cram')
+)[:3]
+COLUMNS = ['sample_id_nwd_id', 'lane_barcode', 'bam_path', 'cram_path']
+
+
+def test_rg_check_matches_in_any_order(tmpdir):
+    pairs = rg_pairs(read_bam_rg_lines(BAM_PATH))
+    random.Random(1).shuffle(pairs)
+    workbook = write_workbook(tmpdir, [(BAM_PATH, pairs)], 'bam_path')
+    cp = run_script('rg_check', workbook)
+    assert (cp.returncode, cp.stdout) == (0, '')
+
+
+def test_rg_check_reports_missing_extra_and_bad(tmpdir):
+    pairs = rg_pairs(read_bam_rg_lines(BAM_PATH))
+    missing = pairs.pop(3)
+    pairs.append(('HXXXXCCXY-1-IDDUI040', 'NWD161809'))
+    bad_path = str(tmpdir.join('bad.bam'))
+    Path(bad_path).write_bytes(b'not a bam')
+    workbook = write_workbook(
+        tmpdir, [(BAM_PATH, pairs), (bad_path, pairs[:1])], 'bam_path'
+    )
+    cp = run_script('rg_check', workbook)
+    assert cp.returncode == 1
+    lines = cp.stdout.splitlines()
+    assert lines[:2] == [
+        '\t'.join(('missing', BAM_PATH, 'HXXXXCCXY-1-IDDUI040', 'NWD161809')),
+        '\t'.join(('extra', BAM_PATH) + missing),
+    ]
+    assert lines[2].startswith('bad\t' + bad_path + '\t')
+    assert len(lines) == 3
+
+
+@pytest.mark.parametrize('cram_reader', ['native', 'samtools'])
+def test_cram_rg_check(tmpdir, cram_reader):
+    if cram_reader == 'samtools' and not shutil.which('samtools'):
+        pytest.skip('samtools is not installed')
+    groups = [(p, rg_pairs(read_cram_rg_lines(p))) for p in CRAM_PATHS]
+    groups[1][1].append(('HXXXXCCXY-1-IDDUI040', 'NWD000000'))
+    workbook = write_workbook(tmpdir, groups, 'cram_path')
+    cp = run_script('cram_rg_check', workbook, '--cram-reader', cram_reader,
+                    '--jobs', '2')
+    assert cp.returncode == 1
+    assert cp.stdout == '\t'.join(('missing', CRAM_PATHS[1],
+                                   'HXXXXCCXY-1-IDDUI040', 'NWD000000\n'))
+
+
+def test_missing_column(tmpdir):
+    workbook = write_workbook(tmpdir, [(BAM_PATH, [])], 'bam_path',
+                              columns=COLUMNS[1:])
+    cp = run_script('rg_check', workbook)
+    assert cp.returncode == 2
+    assert "missing columns: ['sample_id_nwd_id']" in cp.stderr
+
+
+def test_smpls_not_active(tmpdir):
+    workbook = write_workbook(tmpdir, [(BAM_PATH, [('B', 'S')])], 'bam_path')
+    wb = load_workbook(workbook)
+    wb.active = wb.create_sheet('other')
+    wb.save(workbook)
+    cp = run_script('rg_check', workbook)
+    assert (cp.returncode, cp.stdout) == (2, '')
+    assert "('smpls', 'other')" in cp.stderr
+    assert 'Traceback' not in cp.stderr
+
+
+def test_trailing_empty_cell(tmpdir):
+    workbook = write_workbook(tmpdir, [(BAM_PATH, [('B', None)])], 'bam_path',
+                              columns=['lane_barcode', 'bam_path',
+                                       'sample_id_nwd_id'])
+    cp = run_script('rg_check', workbook)
+    assert cp.returncode == 1
+    assert cp.stdout.startswith('\t'.join(('missing', BAM_PATH, 'B',
+                                           'None\n')))
+
+
+def rg_pairs(rg_lines):
+    return [parse_rg_line(line) for line in rg_lines]
+
+
+def write_workbook(tmpdir, groups, path_column, columns=COLUMNS):
+    """Write a workbook with a row for each (barcode, sample) pair of each
+    (path, pairs) group."""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'smpls'
+    ws.append(columns)
+    for path, pairs in groups:
+        for barcode, sample in pairs:
+            values = {'sample_id_nwd_id': sample, 'lane_barcode': barcode,
+                      path_column: path}
+            ws.append([values.get(c) for c in columns])
+    workbook = str(tmpdir.join('workbook.xlsx'))
+    wb.save(workbook)
+    return workbook
+
+
+def run_script(script, *args):
+    return run([script] + list(args), stdin=DEVNULL, stdout=PIPE,
+               stderr=PIPE, universal_newlines=True, timeout=60)
@@ -0,0 +1,73 @@
+import gzip
+import json
+
+import pytest
+
+from ngsi_pm import table_output
+from ngsi_pm.table_output import format_rows, guess_compression, open_writer
+
+COLUMNS = ['barcode', 'sample_name']
+ROWS = [('FC1-1-A', 'S1'), ('FC1-2-A', 'S1'), ('FC2-1-B', 'S2')]
+TSV = 'FC1-1-A\tS1\nFC1-2-A\tS1\nFC2-1-B\tS2\n'
+
+
+def test_guess_compression():
+    assert guess_compression('x.tsv.gz') == 'gzip'
+    assert guess_compression('x.tsv.zst') == 'zstd'
+    assert guess_compression('x.tsv') is None
+    assert guess_compression(None) is None
+
+
+def test_format_rows():
+    assert format_rows(ROWS, COLUMNS, 'tsv') == TSV
+    lines = format_rows(ROWS, COLUMNS, 'jsonl').splitlines()
+    assert json.loads(lines[2]) == {'barcode': 'FC2-1-B', 'sample_name': 'S2'}
+    assert format_rows(ROWS, COLUMNS, 'parquet') is ROWS
+
+
+def test_stdout(capsys):
+    write_table(None, 'tsv', None)
+    assert capsys.readouterr().out == TSV
+
+
+def test_gzip(tmpdir):
+    output_path = str(tmpdir.join('x.tsv.gz'))
+    write_table(output_path, 'tsv', 'gzip')
+    with gzip.open(output_path, 'rt') as fin:
+        assert fin.read() == TSV
+
+
+def test_zstd(tmpdir):
+    zstandard = pytest.importorskip('zstandard')
+    output_path = str(tmpdir.join('x.tsv.zst'))
+    write_table(output_path, 'tsv', 'zstd')
+    with open(output_path, 'rb') as fin:
+        data = zstandard.ZstdDecompressor().stream_reader(fin).read()
+    assert data.decode() == TSV
+
+
+def test_parquet(tmpdir, monkeypatch):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    monkeypatch.setattr(table_output, 'PARQUET_ROW_GROUP_SIZE', 2)
+    output_path = str(tmpdir.join('x.parquet'))
+    write_table(output_path, 'parquet', None)
+    parquet_file = pyarrow_parquet.ParquetFile(output_path)
+    assert parquet_file.metadata.num_row_groups == 2
+    table = parquet_file.read()
+    assert str(table.schema.field('sample_name').type).startswith(
+        'dictionary<values=string'
+    )
+    assert table.to_pydict() == {
+        'barcode': ['FC1-1-A', 'FC1-2-A', 'FC2-1-B', 'FC1-1-A', 'FC1-2-A',
+                    'FC2-1-B'],
+        'sample_name': ['S1', 'S1', 'S2', 'S1', 'S1', 'S2'],
+    }
+
+
+def write_table(output_path, output_format, compression):
+    """Write ROWS in two chunks, as dump_js_barcodes does per worker task."""
+    writer = open_writer(output_path, output_format, COLUMNS, compression,
+                         ['sample_name'])
+    for _ in range(2 if output_format == 'parquet' else 1):
+        writer.write(format_rows(ROWS, COLUMNS, output_format))
+    writer.close()
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from ngsi_pm.tree_walk import find_files
+
+
+@pytest.fixture
+def tree(tmpdir):
+    for path in ['b/2/event.json', 'b/2/alignments/event.json',
+                 'b/1/MergeDefn.json', 'b/1/x.txt', 'a/event.json',
+                 'c/d/e/MEDefn.json', 'c/other.json']:
+        tmpdir.join(path).ensure()
+    tmpdir.join('c/d/event.json').ensure(dir=True)  # not a file
+    os.symlink(str(tmpdir.join('b')), str(tmpdir.join('c/link')))
+    return tmpdir
+
+
+NAMES = 'MEDefn.json', 'MergeDefn.json', 'event.json'
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_find_files(tree, jobs):
+    found = list(find_files(str(tree), NAMES, jobs))
+    assert [os.path.relpath(p, str(tree)) for p in found] == [
+        'a/event.json', 'b/1/MergeDefn.json', 'b/2/event.json',
+        'c/d/e/MEDefn.json',
+    ]
+
+
+def test_find_files_without_pruning(tree):
+    found = list(find_files(str(tree.join('b')), NAMES, prune=False))
+    assert [os.path.relpath(p, str(tree)) for p in found] == [
+        'b/1/MergeDefn.json', 'b/2/event.json', 'b/2/alignments/event.json',
+    ]
+
+
+def test_unreadable_directory_is_skipped(tmpdir, caplog):
+    assert list(find_files(str(tmpdir.join('missing')), NAMES)) == []
+    assert 'cannot read directory' in caplog.text
+
+
+def test_closing_early(tree):
+    found = find_files(str(tree), NAMES, jobs=2)
+    assert next(found).endswith('event.json')
+    found.close()
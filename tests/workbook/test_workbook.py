@@ -0,0 +1,130 @@
+import datetime
+
+from openpyxl import Workbook
+import pytest
+
+from ngsi_pm import cram_worklist, mplx_worklist, workbook
+from ngsi_pm.workbook import column_indexes, generate_sheet_rows, read_columns
+
+HEADER = ['sample_id/nwd_id', 'lane_barcode', 'unused', 'result_path']
+ROWS = [
+    ['NWD1', 'HC5W5CCXY-3-IDDUI040', 'x', '/results/a'],
+    [None, None, None, None],
+    ['NWD2', 'HC5W5CCXY-4-IDDUI041', 'y', '#/results/b'],
+    ['NWD3', 'HC5W5CCXY-5-IDDUI042', 'z', None],
+    ['NWD4', 'HC5W5CCXY-6-IDDUI043'],
+]
+
+
+def test_read_columns_projects_in_order(tmpdir):
+    path = write_workbook(tmpdir, {'batch1_smpls': [HEADER] + ROWS})
+    rows = list(read_columns(path, ['lane_barcode', 'sample_id_nwd_id'],
+                             fix_names=True))
+    assert rows == [
+        ('HC5W5CCXY-3-IDDUI040', 'NWD1'),
+        ('HC5W5CCXY-4-IDDUI041', 'NWD2'),
+        ('HC5W5CCXY-5-IDDUI042', 'NWD3'),
+        ('HC5W5CCXY-6-IDDUI043', 'NWD4'),
+    ]
+
+
+def test_read_columns_skips_commented_and_empty_keys(tmpdir):
+    path = write_workbook(tmpdir, {'smpls': [HEADER] + ROWS})
+    rows = list(read_columns(path, ['sample_id/nwd_id', 'result_path'],
+                             key_column='result_path'))
+    assert rows == [('NWD1', '/results/a')]
+
+
+def test_read_columns_missing_column(tmpdir):
+    path = write_workbook(tmpdir, {'smpls': [HEADER] + ROWS})
+    with pytest.raises(KeyError, match='sample_id_nwd_id'):
+        list(read_columns(path, ['sample_id_nwd_id']))
+
+
+def test_column_indexes_ignores_blank_names():
+    header = ('a', None, 'b/c', None)
+    assert column_indexes(header, ['b_c', 'a'], fix_names=True) == [2, 0]
+
+
+def test_named_sheet_must_be_active(tmpdir):
+    path = write_workbook(tmpdir, {'smpls': [['a']], 'other': [['b']]})
+    with pytest.raises(AssertionError):
+        next(generate_sheet_rows(path, 'smpls'))
+
+
+def test_master_sheet_must_be_unique(tmpdir):
+    path = write_workbook(tmpdir, {'a_smpls': [['a']], 'b_smpls': [['b']]})
+    with pytest.raises(AssertionError, match='ambiguous'):
+        next(generate_sheet_rows(path))
+
+
+def test_worklists_read_input(tmpdir):
+    columns = cram_worklist.REQUIRED_INPUT_COLUMN_NAMES
+    header = [n.replace('sample_id_nwd_id', 'sample_id/nwd_id')
+              for n in columns] + ['merge_path']
+    rows = [['{}1'.format(i) for i in range(len(header))],
+            ['{}2'.format(i) for i in range(len(header) - 2)] + ['#x', '#y']]
+    path = write_workbook(tmpdir, {'smpls': [header] + rows})
+    records = cram_worklist.SPEC.read_input(path)
+    assert [vars(r) for r in records] == [
+        dict((name, '{}1'.format(i)) for i, name in enumerate(columns))
+    ]
+    with pytest.raises(KeyError):
+        mplx_worklist.read_input(path)
+
+
+def test_cache_reuses_sidecar_until_workbook_changes(tmpdir, monkeypatch):
+    cache_dir = tmpdir.mkdir('cache')
+    monkeypatch.setenv(workbook.CACHE_VARIABLE, str(cache_dir))
+    monkeypatch.setattr(workbook, 'CACHE_CHUNK_ROWS', 2)
+    path = write_workbook(tmpdir, {'smpls': [HEADER] + ROWS})
+    expected = list(generate_sheet_rows(path))
+    assert len(cache_dir.listdir()) == 1
+
+    def fail(*args):
+        raise AssertionError('workbook read')
+    monkeypatch.setattr(workbook, 'load_workbook', fail)
+    assert list(generate_sheet_rows(path)) == expected
+    with pytest.raises(AssertionError):
+        list(generate_sheet_rows(path, data_only=True))
+    monkeypatch.undo()
+
+    monkeypatch.setenv(workbook.CACHE_VARIABLE, str(cache_dir))
+    path = write_workbook(tmpdir, {'smpls': [HEADER] + ROWS[:1]})
+    assert list(generate_sheet_rows(path)) == expected[:2]
+    assert len(cache_dir.listdir()) == 2
+
+
+def test_cache_stores_dates(tmpdir, monkeypatch):
+    cache_dir = tmpdir.mkdir('cache')
+    monkeypatch.setenv(workbook.CACHE_VARIABLE, str(cache_dir))
+    rows = [['date', 'n'], [datetime.datetime(2019, 5, 17, 13, 30), 1.5]]
+    path = write_workbook(tmpdir, {'smpls': rows})
+    assert list(generate_sheet_rows(path)) == [tuple(r) for r in rows]
+    assert list(generate_sheet_rows(path)) == [tuple(r) for r in rows]
+    assert len(cache_dir.listdir()) == 1
+
+
+def test_cache_ignores_partial_reads(tmpdir, monkeypatch):
+    cache_dir = tmpdir.mkdir('cache')
+    monkeypatch.setenv(workbook.CACHE_VARIABLE, str(cache_dir))
+    path = write_workbook(tmpdir, {'smpls': [HEADER] + ROWS})
+    rows = generate_sheet_rows(path)
+    next(rows)
+    rows.close()
+    assert cache_dir.listdir() == []
+
+
+def write_workbook(tmpdir, sheets):
+    """Write a workbook with the sheets, a dict of title -> rows; the last
+    one is active."""
+    wb = Workbook()
+    wb.remove(wb.active)
+    for title, rows in sheets.items():
+        ws = wb.create_sheet(title)
+        for row in rows:
+            ws.append(row)
+    wb.active = len(sheets) - 1
+    path = str(tmpdir.join('test.xlsx'))
+    wb.save(path)
+    return path
@@ -0,0 +1,185 @@
+import os
+from subprocess import run, DEVNULL, PIPE
+import time
+
+from openpyxl import Workbook, load_workbook
+
+from ngsi_pm import cram_worklist, topmed_worklist
+from ngsi_pm.listing import CachedLister
+
+
+def test_cram_worklist(tmpdir):
+    result_paths = make_results(tmpdir, {
+        'a': ['x.hgv.cram', 'x.hgv.cram.crai', 'notes.txt'],
+        'b': ['y.hgv.cram'],
+    })
+    header = ['lane_barcode', 'hgsc_xfer_subdir', 'batch', 'sample_id/nwd_id',
+              'run_name', 'current_cram_name', 'new_cram_name', 'result_path']
+    rows = [
+        ['L1', 'sub', 1, 'NWD1', 'run1', None, None, result_paths['a']],
+        ['L2', 'sub', 1, 'NWD2', 'run2', None, None, '#' + result_paths['b']],
+        ['L3', 'sub', 1, 'NWD3', 'run3', None, None, result_paths['b']],
+    ]
+    input_file = write_master(tmpdir, header, rows)
+    cp = run(['cram_worklist', input_file], stdin=DEVNULL, stdout=PIPE,
+             stderr=PIPE, universal_newlines=True, timeout=60)
+    assert cp.returncode == 0, cp.stderr
+    output = read_output(input_file[:-5] + '_cram.xlsx')
+    assert output == [
+        tuple(cram_worklist.SPEC.header),
+        ('L1', 'sub', 1, 'NWD1', 'run1', 'x.hgv.cram', 'NWD1-x.hgv.cram',
+         result_paths['a'], os.path.join(result_paths['a'], 'x.hgv.cram')),
+        ('L3', 'sub', 1, 'NWD3', 'run3', 'y.hgv.cram', 'NWD3-y.hgv.cram',
+         result_paths['b'], os.path.join(result_paths['b'], 'y.hgv.cram')),
+    ]
+
+
+def test_topmed_worklist_finds_variants(tmpdir):
+    result_paths = make_results(tmpdir, {
+        'a': ['s.hgv.bam', 'variants/s_snp_Annotated.vcf',
+              'variants/s_indel_Annotated.vcf'],
+    })
+    header = ['sample_id_nwd_id', 'lane_barcode', 'batch', 'vcf_batch',
+              'result_path']
+    input_file = write_master(tmpdir, header,
+                              [['NWD1', 'L1', 1, 2, result_paths['a']]])
+    output_file = str(tmpdir.join('out.xlsx'))
+    assert topmed_worklist.SPEC.run(input_file, output_file) == 0
+    variants = os.path.join(result_paths['a'], 'variants')
+    assert read_output(output_file)[1] == (
+        'NWD1', 'L1', 1, 2, result_paths['a'],
+        's.hgv.bam', os.path.join(result_paths['a'], 's.hgv.bam'),
+        's_snp_Annotated.vcf', os.path.join(variants, 's_snp_Annotated.vcf'),
+        's_indel_Annotated.vcf',
+        os.path.join(variants, 's_indel_Annotated.vcf'),
+    )
+
+
+def test_missing_file_writes_nothing(tmpdir):
+    result_paths = make_results(tmpdir, {'a': ['s.hgv.bam', 'variants/x']})
+    header = ['sample_id_nwd_id', 'lane_barcode', 'batch', 'vcf_batch',
+              'result_path']
+    input_file = write_master(tmpdir, header,
+                              [['NWD1', 'L1', 1, 2, result_paths['a']]])
+    output_file = str(tmpdir.join('out.xlsx'))
+    assert topmed_worklist.SPEC.run(input_file, output_file) == 1
+    assert not os.path.exists(output_file)
+
+
+def test_jobs_keep_master_order(tmpdir):
+    names = ['r{:02}'.format(i) for i in range(20)]
+    result_paths = make_results(tmpdir, dict(
+        (name, [name + '.hgv.bam', 'variants/x_snp_Annotated.vcf',
+                'variants/x_indel_Annotated.vcf'])
+        for name in names
+    ))
+    header = ['sample_id_nwd_id', 'lane_barcode', 'batch', 'vcf_batch',
+              'result_path']
+    rows = [[name, 'L1', 1, 2, result_paths[name]] for name in names]
+    input_file = write_master(tmpdir, header, rows)
+    output_file = str(tmpdir.join('out.xlsx'))
+    assert topmed_worklist.SPEC.run(input_file, output_file, jobs=4) == 0
+    assert [row[5] for row in read_output(output_file)[1:]] == [
+        name + '.hgv.bam' for name in names
+    ]
+
+
+def test_every_error_is_reported_once(tmpdir, caplog):
+    result_paths = make_results(tmpdir, {
+        'a': ['s.hgv.bam'],
+        'b': ['variants/s_snp_Annotated.vcf'],
+    })
+    header = ['sample_id_nwd_id', 'lane_barcode', 'batch', 'vcf_batch',
+              'result_path']
+    rows = [['NWD1', 'L1', 1, 2, result_paths['a']],
+            ['NWD2', 'L2', 1, 2, str(tmpdir.join('nowhere'))],
+            ['NWD3', 'L3', 1, 2, result_paths['b']]]
+    input_file = write_master(tmpdir, header, rows)
+    output_file = str(tmpdir.join('out.xlsx'))
+    assert topmed_worklist.SPEC.run(input_file, output_file, jobs=2) == 1
+    assert not os.path.exists(output_file)
+    errors = [r.getMessage() for r in caplog.records if r.levelname == 'ERROR']
+    assert len(errors) == 4
+    assert 'variants' in errors[0]
+    assert errors[1].startswith('cannot list directory')
+    assert 'nowhere' in errors[1]
+    assert errors[2].endswith('found no bam_file, bam_path, indel_file, '
+                              'indel_path')
+    assert errors[3] == 'not writing ' + output_file
+
+
+def test_rerun_uses_listing_cache(tmpdir):
+    result_paths = make_results(tmpdir, {
+        'a': ['s.hgv.bam', 'variants/s_snp_Annotated.vcf',
+              'variants/s_indel_Annotated.vcf'],
+    })
+    then = time.time() - 100
+    for path in (result_paths['a'],
+                 os.path.join(result_paths['a'], 'variants')):
+        os.utime(path, (then, then))
+    header = ['sample_id_nwd_id', 'lane_barcode', 'batch', 'vcf_batch',
+              'result_path']
+    input_file = write_master(tmpdir, header,
+                              [['NWD1', 'L1', 1, 2, result_paths['a']]])
+    cache_path = str(tmpdir.join('listings.sqlite'))
+    outputs = []
+    for name in 'out1.xlsx', 'out2.xlsx':
+        outputs.append(str(tmpdir.join(name)))
+        lister = CachedLister(cache_path)
+        assert topmed_worklist.SPEC.run(input_file, outputs[-1],
+                                        lister=lister) == 0
+        lister.close()
+    assert lister.counts == {'stat': 2, 'cache hit': 2}
+    assert read_output(outputs[0]) == read_output(outputs[1])
+
+
+def test_cram_worklist_from_manifest(tmpdir):
+    result_paths = make_results(tmpdir, {'a': ['x.hgv.cram']})
+    header = ['lane_barcode', 'hgsc_xfer_subdir', 'batch', 'sample_id/nwd_id',
+              'run_name', 'current_cram_name', 'new_cram_name', 'result_path']
+    input_file = write_master(tmpdir, header, [
+        ['L1', 'sub', 1, 'NWD1', 'run1', None, None, result_paths['a']],
+    ])
+    # The manifest is all the worklist sees: the file is long gone.
+    os.remove(os.path.join(result_paths['a'], 'x.hgv.cram'))
+    manifest = tmpdir.join('manifest.txt')
+    manifest.write(os.path.join(result_paths['a'], 'y.hgv.cram') + '\n')
+    cp = run(['cram_worklist', '--manifest', str(manifest), input_file],
+             stdin=DEVNULL, stdout=PIPE, stderr=PIPE, universal_newlines=True,
+             timeout=60)
+    assert cp.returncode == 0, cp.stderr
+    assert 'index lookup 1' in cp.stderr
+    output = read_output(input_file[:-5] + '_cram.xlsx')
+    assert output[1][5:7] == ('y.hgv.cram', 'NWD1-y.hgv.cram')
+
+
+def make_results(tmpdir, results):
+    """Create a result directory holding the files of each name in results,
+    and return a dict of name -> result_path."""
+    result_paths = {}
+    for name, file_names in results.items():
+        result_path = tmpdir.join('results', name)
+        for file_name in file_names:
+            result_path.join(file_name).ensure()
+        result_paths[name] = str(result_path)
+    return result_paths
+
+
+def write_master(tmpdir, header, rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'batch1_smpls'
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    path = str(tmpdir.join('master.xlsx'))
+    wb.save(path)
+    return path
+
+
+def read_output(output_file):
+    wb = load_workbook(output_file, read_only=True)
+    try:
+        return [tuple(row) for row in wb['smpls'].iter_rows(values_only=True)]
+    finally:
+        wb.close()